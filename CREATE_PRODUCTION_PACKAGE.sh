@@ -19,9 +19,18 @@ mkdir -p "$PRODUCTION_DIR/docs"
 
 echo "[*] Копируем Python файлы..."
 cp captcha_api.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] captcha_api.py не найден"
+cp serve.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] serve.py не найден"
+cp captcha_asgi.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] captcha_asgi.py не найден"
+cp ctc_decoder.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] ctc_decoder.py не найден"
+cp inference_backend.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] inference_backend.py не найден"
+cp api_metrics.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] api_metrics.py не найден"
+cp binary_protocol.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] binary_protocol.py не найден"
+cp result_cache.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] result_cache.py не найден"
+cp fast_preprocess.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] fast_preprocess.py не найден"
+cp model_metadata.py "$PRODUCTION_DIR/python_api/" || echo "[ERROR] model_metadata.py не найден"
 cp requirements.txt "$PRODUCTION_DIR/python_api/" || echo "[ERROR] requirements.txt не найден"
 
-echo "[*] Копируем модель и метки..."
+echo "[*] Копируем модель и метаданные..."
 if [ -f "final-results/output/model.keras" ]; then
     cp "final-results/output/model.keras" "$PRODUCTION_DIR/python_api/models/"
     echo "[OK] Модель скопирована"
@@ -29,11 +38,12 @@ else
     echo "[ERROR] Модель не найдена в final-results/output/model.keras"
 fi
 
-if [ -f "images/labels.csv" ]; then
-    cp "images/labels.csv" "$PRODUCTION_DIR/python_api/models/"
-    echo "[OK] Labels.csv скопирован"
+if [ -f "final-results/output/model.meta.json" ]; then
+    cp "final-results/output/model.meta.json" "$PRODUCTION_DIR/python_api/models/"
+    echo "[OK] Метаданные модели скопированы"
 else
-    echo "[ERROR] Labels.csv не найден в images/labels.csv"
+    echo "[ERROR] Метаданные не найдены в final-results/output/model.meta.json"
+    echo "        Создайте их: python model_metadata.py --model final-results/output/model.keras --labels images/labels.csv"
 fi
 
 echo "[*] Копируем Node.js файлы..."
@@ -59,10 +69,11 @@ cat > "$PRODUCTION_DIR/README.md" << 'PROD_README'
 production/
 ├── python_api/          - Flask REST API
 │   ├── captcha_api.py
+│   ├── serve.py         - production запуск (несколько воркеров)
 │   ├── requirements.txt
 │   └── models/
 │       ├── model.keras
-│       └── labels.csv
+│       └── model.meta.json
 ├── nodejs_client/       - Node.js интеграция с Puppeteer
 │   ├── captcha_client_nodejs.js
 │   ├── captcha_solver_example.js
@@ -81,6 +92,9 @@ python3 -m venv venv
 source venv/bin/activate
 pip install -r requirements.txt
 python3 captcha_api.py --host 0.0.0.0 --port 5000
+
+# Production: несколько воркеров на одном порту, 1 поток TF на воркер
+python3 serve.py --host 0.0.0.0 --port 5000 --workers 4 --intra-op-threads 1 --cpu-affinity auto -- --model models/model.keras
 ```
 
 ### 2. Node.js Bot
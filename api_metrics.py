@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метрики в формате Prometheus для captcha_api.py (без зависимости от prometheus_client)
+
+Запись метрики из потока запроса - одно deque.append (атомарно в CPython),
+без блокировок. События сворачиваются в счетчики и гистограммы при чтении
+/metrics или когда их накопилось больше DRAIN_THRESHOLD; сворачивает один
+поток (неблокирующий try-lock), остальные в это время продолжают писать.
+
+    metrics = Metrics()
+    metrics.histogram('captcha_stage_duration_seconds', 'Время стадии', labels=('stage',))
+    with metrics.timer('captcha_stage_duration_seconds', stage='model'):
+        ...
+    metrics.render()  # текст для GET /metrics
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+# Границы корзин гистограмм (секунды): от долей миллисекунды до секунд
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+DRAIN_THRESHOLD = 10000  # Событий в очереди, после которых запись сама их сворачивает
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metrics:
+    """Реестр метрик: counter, gauge, histogram с метками"""
+
+    def __init__(self, drain_threshold=DRAIN_THRESHOLD):
+        self.drain_threshold = drain_threshold
+        self._events = deque()
+        self._drain_lock = threading.Lock()
+        self._definitions = {}  # name -> (type, help, buckets)
+        self._values = {}       # (name, labels) -> float | [counts по корзинам, sum, count]
+
+    def counter(self, name, help_text):
+        self._definitions[name] = ('counter', help_text, None)
+
+    def gauge(self, name, help_text):
+        self._definitions[name] = ('gauge', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._definitions[name] = ('histogram', help_text, tuple(buckets))
+
+    def _record(self, kind, name, value, labels):
+        self._events.append((kind, name, tuple(sorted(labels.items())), value))
+        if len(self._events) > self.drain_threshold:
+            self._drain(blocking=False)
+
+    def inc(self, name, value=1, **labels):
+        """Увеличивает counter или gauge"""
+        self._record('add', name, value, labels)
+
+    def dec(self, name, value=1, **labels):
+        """Уменьшает gauge"""
+        self._record('add', name, -value, labels)
+
+    def set(self, name, value, **labels):
+        """Устанавливает значение gauge"""
+        self._record('set', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """Добавляет наблюдение в histogram"""
+        self._record('observe', name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Измеряет время блока и добавляет его в histogram (в том числе при исключении)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _drain(self, blocking=True):
+        """Сворачивает накопленные события в значения метрик"""
+        if not self._drain_lock.acquire(blocking=blocking):
+            return
+        try:
+            events, values = self._events, self._values
+            for _ in range(len(events)):
+                kind, name, labels, value = events.popleft()
+                key = (name, labels)
+                if kind == 'add':
+                    values[key] = values.get(key, 0) + value
+                elif kind == 'set':
+                    values[key] = value
+                else:
+                    buckets = self._definitions[name][2]
+                    state = values.get(key)
+                    if state is None:
+                        state = values[key] = [[0] * len(buckets), 0.0, 0]
+                    index = bisect_left(buckets, value)
+                    if index < len(buckets):
+                        state[0][index] += 1
+                    state[1] += value
+                    state[2] += 1
+        finally:
+            self._drain_lock.release()
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        self._drain()
+        with self._drain_lock:
+            values = {key: (value if not isinstance(value, list) else [list(value[0]), value[1], value[2]])
+                      for key, value in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._definitions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            for labels, value in series:
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
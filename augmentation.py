@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Аугментация батчей CAPTCHA внутри графа tf.data для train.py
+
+Преобразования применяются сразу к батчу (один вызов ops на батч, а не на
+изображение). Каждое изображение получает преобразование независимо, с
+заданной вероятностью; считаются только выбранные изображения:
+
+    affine     - сдвиг и поворот (ImageProjectiveTransformV3, края - ближайший пиксель)
+    noise      - гауссов шум
+    blur       - размытие 3x3
+    contrast   - изменение контраста относительно среднего
+    occlusion  - случайная линия поперек изображения
+
+Вход и выход - uint8 той же формы, что и в encode_single_sample:
+(batch, height, width, 3) или транспонированные (batch, width, height, 3).
+
+Оценка скорости (изображений/сек на одно ядро tf.data):
+    python augmentation.py --benchmark
+"""
+
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+# Вероятность применения каждого преобразования к изображению
+DEFAULT_PROBABILITIES = {
+    'affine': 0.5,
+    'noise': 0.3,
+    'blur': 0.2,
+    'contrast': 0.3,
+    'occlusion': 0.2,
+}
+
+MAX_SHIFT = (0.05, 0.05)  # Доля высоты / ширины
+MAX_ROTATION = 5.0        # Градусы
+NOISE_STDDEV = (2.0, 12.0)
+CONTRAST_RANGE = (0.6, 1.4)
+LINE_THICKNESS = (1.0, 3.0)
+LINE_MAX_COLOR = 128.0    # Линии темные: яркость 0..128
+
+def parse_probabilities(text):
+    """'affine=0.5,noise=0' -> словарь вероятностей поверх DEFAULT_PROBABILITIES"""
+    probabilities = dict(DEFAULT_PROBABILITIES)
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        name, _, value = item.partition('=')
+        if name not in probabilities:
+            raise ValueError(f"Неизвестное преобразование '{name}', доступны: {', '.join(probabilities)}")
+        probabilities[name] = float(value)
+    return probabilities
+
+def _apply(transform, images, mask):
+    """Применяет transform только к выбранным изображениям батча (остальные не вычисляются)"""
+    def update():
+        selected = tf.where(mask)
+        augmented = transform(tf.gather_nd(images, selected))
+        return tf.tensor_scatter_nd_update(images, selected, augmented)
+
+    # Пустой выбор пропускаем: часть ops (MirrorPad, depthwise_conv2d) не работает с пустым батчем
+    return tf.cond(tf.reduce_any(mask), update, lambda: images)
+
+def _affine(images):
+    batch, height, width = tf.shape(images)[0], tf.shape(images)[1], tf.shape(images)[2]
+    h, w = tf.cast(height, tf.float32), tf.cast(width, tf.float32)
+    angle = tf.random.uniform([batch], -MAX_ROTATION, MAX_ROTATION) * (np.pi / 180.0)
+    tx = tf.random.uniform([batch], -MAX_SHIFT[1], MAX_SHIFT[1]) * w
+    ty = tf.random.uniform([batch], -MAX_SHIFT[0], MAX_SHIFT[0]) * h
+    cos, sin = tf.cos(angle), tf.sin(angle)
+    cx, cy = (w - 1) / 2, (h - 1) / 2
+    # Отображение выходных координат во входные: поворот вокруг центра и сдвиг
+    zeros = tf.zeros_like(angle)
+    transforms = tf.stack([
+        cos, -sin, cx - cos * cx + sin * cy - tx,
+        sin, cos, cy - sin * cx - cos * cy - ty,
+        zeros, zeros,
+    ], axis=1)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=tf.stack([height, width]),
+        fill_value=0.0, interpolation='BILINEAR', fill_mode='NEAREST',
+    )
+
+def _noise(images):
+    stddev = tf.random.uniform([tf.shape(images)[0], 1, 1, 1], *NOISE_STDDEV)
+    return images + tf.random.normal(tf.shape(images)) * stddev
+
+def _blur(images):
+    channels = images.shape[-1]
+    kernel = tf.constant([1.0, 2.0, 1.0])
+    kernel = tf.tensordot(kernel, kernel, axes=0) / 16.0
+    kernel = tf.tile(kernel[:, :, None, None], [1, 1, channels, 1])
+    padded = tf.pad(images, [[0, 0], [1, 1], [1, 1], [0, 0]], mode='SYMMETRIC')
+    return tf.nn.depthwise_conv2d(padded, kernel, strides=[1, 1, 1, 1], padding='VALID')
+
+def _contrast(images):
+    factor = tf.random.uniform([tf.shape(images)[0], 1, 1, 1], *CONTRAST_RANGE)
+    mean = tf.reduce_mean(images, axis=[1, 2, 3], keepdims=True)
+    return (images - mean) * factor + mean
+
+def _occlusion(images):
+    batch, height, width = tf.shape(images)[0], tf.shape(images)[1], tf.shape(images)[2]
+    h, w = tf.cast(height, tf.float32), tf.cast(width, tf.float32)
+    # Линия y = y0 + slope * x через все изображение
+    y0 = tf.random.uniform([batch, 1, 1], 0.2, 0.8) * h
+    slope = tf.random.uniform([batch, 1, 1], -0.3, 0.3) * h / w
+    thickness = tf.random.uniform([batch, 1, 1], *LINE_THICKNESS)
+    color = tf.random.uniform([batch, 1, 1, 1], 0.0, LINE_MAX_COLOR)
+    ys = tf.range(h)[None, :, None]
+    xs = tf.range(w)[None, None, :]
+    line = tf.abs(ys - (y0 + slope * xs)) < thickness / 2
+    return tf.where(line[..., None], color, images)
+
+TRANSFORMS = {
+    'affine': _affine,
+    'noise': _noise,
+    'blur': _blur,
+    'contrast': _contrast,
+    'occlusion': _occlusion,
+}
+
+def make_augmenter(probabilities=None, transposed=False):
+    """
+    Функция images -> images для dataset.map на батчах uint8.
+    transposed=True - изображения (width, height, channels), как при TRANSPOSE_IN_MODEL=False.
+    """
+    if probabilities is None:
+        probabilities = DEFAULT_PROBABILITIES
+    probabilities = {name: p for name, p in probabilities.items() if p > 0}
+
+    def augment(images):
+        dtype = images.dtype
+        x = tf.cast(images, tf.float32)
+        if transposed:
+            x = tf.transpose(x, perm=[0, 2, 1, 3])
+        batch = tf.shape(x)[0]
+        for name, probability in probabilities.items():
+            mask = tf.random.uniform([batch]) < probability
+            x = _apply(TRANSFORMS[name], x, mask)
+        if transposed:
+            x = tf.transpose(x, perm=[0, 2, 1, 3])
+        if dtype == tf.uint8:
+            return tf.saturate_cast(tf.round(x), tf.uint8)
+        return tf.cast(x, dtype)
+
+    return augment
+
+def measure_throughput(augment, images, steps=20):
+    """Изображений/сек для augment на батче images (после прогрева графа)"""
+    augment = tf.function(augment)
+    images = tf.convert_to_tensor(images)
+    augment(images).numpy()
+    start = time.perf_counter()
+    for _ in range(steps):
+        result = augment(images)
+    result.numpy()
+    return steps * int(images.shape[0]) / (time.perf_counter() - start)
+
+def benchmark(batch_size=64, steps=20, height=60, width=200):
+    """Скорость каждого преобразования (вероятность 1) и всей аугментации с вероятностями по умолчанию"""
+    images = np.random.default_rng(0).integers(0, 256, (batch_size, width, height, 3), dtype=np.uint8)
+    print(f"Батч {batch_size}x{width}x{height}x3 uint8, {steps} шагов")
+    identity = measure_throughput(make_augmenter({}, transposed=True), images, steps)
+    print(f"  {'uint8 <-> float32':12s} {identity:10.0f} изображений/сек")
+    for name in TRANSFORMS:
+        rate = measure_throughput(make_augmenter({name: 1.0}, transposed=True), images, steps)
+        print(f"  {name:12s} {rate:10.0f} изображений/сек")
+    rate = measure_throughput(make_augmenter(transposed=True), images, steps)
+    print(f"  {'все (по умолч.)':12s} {rate:10.0f} изображений/сек")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description='Аугментация батчей CAPTCHA')
+    parser.add_argument('--benchmark', action='store_true', help='Скорость преобразований')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--preview', default=None, help='Сохранить PNG с примерами аугментации для изображения')
+    args = parser.parse_args()
+
+    if args.preview:
+        from PIL import Image
+        image = np.asarray(Image.open(args.preview).convert('RGB'))
+        batch = np.repeat(image[None], 8, axis=0)
+        augmented = make_augmenter()(tf.constant(batch)).numpy()
+        output = args.preview.rsplit('.', 1)[0] + '_augmented.png'
+        Image.fromarray(np.concatenate([image] + list(augmented), axis=0)).save(output)
+        print(f"[OK] Примеры сохранены: {output}")
+    if args.benchmark or not args.preview:
+        benchmark(args.batch_size, args.steps)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарки горячего пути инференса captcha_api.py
+
+Стадии (те же функции, что обслуживают /predict и /predict-batch):
+    preprocess - preprocess_into для каждого PNG батча в общий батч-буфер
+                 (TF или OpenCV/NumPy, --preprocess)
+    model      - run_model (Keras бэкенд)
+    decode     - decode_predictions (greedy или beam)
+    load       - load_model_weights (только cold)
+
+Все входные данные строятся офлайн и детерминированно: модель той же
+архитектуры, что в train.py, со случайными весами из --seed, и синтетические
+CAPTCHA из synthetic_captcha.py. Датасет и обученная модель не нужны.
+
+Для каждого размера батча (по умолчанию 1, 8, 32, 128):
+    cold - первый вызов в новом процессе (трассировка tf.function, создание
+           ядер TF); замеряется в отдельных подпроцессах, медиана по --cold-runs
+    warm - медиана и p90 по --repeats вызовам после прогрева
+
+Результаты пишутся в JSON и сравниваются с сохраненным baseline: стадия
+считается регрессией, если медиана выросла больше чем на --threshold
+(доля) и больше чем на --min-delta-ms. При регрессии код выхода 1.
+
+Использование:
+    python benchmarks/inference_benchmark.py
+    python benchmarks/inference_benchmark.py --threshold 0.1 --batch-sizes 1 32
+    python benchmarks/inference_benchmark.py --preprocess cv2
+    python benchmarks/inference_benchmark.py --update-baseline   # после осознанного изменения
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from io import BytesIO
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from PIL import Image
+
+import captcha_api
+import fast_preprocess
+from model_metadata import save_metadata
+from synthetic_captcha import DEFAULT_ALPHABET, generate_chunk
+
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, 'results.json')
+BATCH_SIZES = [1, 8, 32, 128]
+STAGES = ('preprocess', 'model', 'decode')
+THRESHOLD = 0.25     # Допустимый рост медианы (доля)
+MIN_DELTA_MS = 0.1   # Меньшие абсолютные изменения считаются шумом
+TIME_STEPS = 50
+
+def build_synthetic_model(num_classes, seed):
+    """Модель предсказания с архитектурой train.py (вход uint8 WHC) и детерминированными весами"""
+    keras.utils.set_random_seed(seed)
+    input_img = layers.Input(shape=(captcha_api.IMG_WIDTH, captcha_api.IMG_HEIGHT, 3), name="image", dtype="uint8")
+    x = layers.Rescaling(1.0 / 255, name="rescale")(input_img)
+    x = layers.Conv2D(32, (3, 3), activation="relu", kernel_initializer="he_normal", padding="same", name="Conv1")(x)
+    x = layers.MaxPooling2D((2, 2), name="pool1")(x)
+    x = layers.Conv2D(64, (3, 3), activation="relu", kernel_initializer="he_normal", padding="same", name="Conv2")(x)
+    x = layers.MaxPooling2D((2, 2), name="pool2")(x)
+    x = layers.Reshape(target_shape=(TIME_STEPS, 960), name="reshape")(x)
+    x = layers.Dense(64, activation="relu", name="dense1")(x)
+    x = layers.Bidirectional(layers.LSTM(128, return_sequences=True))(x)
+    x = layers.Bidirectional(layers.LSTM(64, return_sequences=True))(x)
+    x = layers.Dense(num_classes, activation="softmax", name="dense2")(x)
+    return keras.models.Model(input_img, x, name="benchmark_model")
+
+def prepare_model(model_dir, seed):
+    """Сохраняет синтетическую модель и ее метаданные (как после train.py)"""
+    characters = sorted(set(DEFAULT_ALPHABET))
+    model_path = os.path.join(model_dir, 'model.keras')
+    build_synthetic_model(len(characters) + 1, seed).save(model_path)
+    save_metadata([model_path], characters, captcha_api.IMG_WIDTH, captcha_api.IMG_HEIGHT, 3,
+                  captcha_api.MAX_SEQUENCE_LENGTH, TIME_STEPS, input_dtype="uint8", input_layout="WHC")
+    return model_path
+
+def synthetic_pngs(count, seed):
+    """count закодированных PNG синтетических CAPTCHA (детерминированно по seed)"""
+    images, _ = generate_chunk(0, count, seed)
+    encoded = []
+    for pixels in images:
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, format='PNG')
+        encoded.append(buffer.getvalue())
+    return encoded
+
+def load_api(model_path, decoder, preprocess='tf'):
+    """Настраивает captcha_api как при запуске сервера и загружает модель"""
+    logging.getLogger(captcha_api.__name__).setLevel(logging.WARNING)
+    captcha_api.MODEL_BACKEND = 'keras'
+    captcha_api.MODEL_PATH = model_path
+    captcha_api.DECODER = decoder
+    captcha_api.PREPROCESSOR = preprocess
+    start = time.perf_counter()
+    captcha_api.load_model_weights()
+    return (time.perf_counter() - start) * 1000.0
+
+def stage_calls(pngs):
+    """Функции стадий; каждая следующая берет вход из результата предыдущей"""
+    state = {}
+
+    def preprocess():
+        # Как /predict-batch: каждое изображение сразу в свой слот батч-буфера
+        images = fast_preprocess.allocate(len(pngs), captcha_api.IMG_WIDTH, captcha_api.IMG_HEIGHT,
+                                          captcha_api.INPUT_LAYOUT)
+        for png, out in zip(pngs, images):
+            captcha_api.preprocess_into(png, out)
+        state['images'] = images
+
+    def model():
+        state['predictions'] = captcha_api.run_model(state['images'])
+
+    def decode():
+        captcha_api.decode_predictions(state['predictions'])
+
+    return {'preprocess': preprocess, 'model': model, 'decode': decode}
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000.0
+
+def run_cold(model_path, batch_size, seed, decoder, preprocess):
+    """Первый вызов каждой стадии в этом процессе (запускается в подпроцессе)"""
+    pngs = synthetic_pngs(batch_size, seed)
+    timings = {'load': load_api(model_path, decoder, preprocess)}
+    for stage, fn in stage_calls(pngs).items():
+        timings[stage] = timed(fn)
+    return timings
+
+def run_warm(pngs, repeats, warmup=2):
+    """Медиана и p90 по repeats вызовам каждой стадии после прогрева"""
+    calls = stage_calls(pngs)
+    for _ in range(warmup):
+        for fn in calls.values():
+            fn()
+    samples = {stage: [] for stage in calls}
+    for _ in range(repeats):
+        for stage, fn in calls.items():
+            samples[stage].append(timed(fn))
+    return samples
+
+def summarize(samples, batch_size):
+    return {
+        'median_ms': float(np.median(samples)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'per_image_ms': float(np.median(samples)) / batch_size,
+        'runs': len(samples),
+    }
+
+def cold_in_subprocess(model_path, batch_size, seed, decoder, preprocess):
+    """Запускает run_cold в новом интерпретаторе и возвращает его замеры"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--cold-run', '--model-path', model_path,
+         '--batch-sizes', str(batch_size), '--seed', str(seed), '--decoder', decoder, '--preprocess', preprocess],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'tensorflow': tf.__version__,
+        'keras': keras.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def run_suite(batch_sizes, repeats, cold_runs, seed, decoder, preprocess):
+    """Все замеры: {'<стадия>/batch=<N>/<cold|warm>': summary}"""
+    results = {}
+    model_dir = tempfile.mkdtemp(prefix='captcha_benchmark_')
+    try:
+        model_path = prepare_model(model_dir, seed)
+        all_pngs = synthetic_pngs(max(batch_sizes), seed)
+        load_api(model_path, decoder, preprocess)
+
+        for batch_size in batch_sizes:
+            print(f"batch={batch_size}: cold ({cold_runs} процессов)...", flush=True)
+            cold = [cold_in_subprocess(model_path, batch_size, seed, decoder, preprocess) for _ in range(cold_runs)]
+            for stage in ('load',) + STAGES:
+                results[f"{stage}/batch={batch_size}/cold"] = summarize([run[stage] for run in cold], batch_size)
+
+            print(f"batch={batch_size}: warm ({repeats} повторов)...", flush=True)
+            samples = run_warm(all_pngs[:batch_size], repeats)
+            for stage in STAGES:
+                results[f"{stage}/batch={batch_size}/warm"] = summarize(samples[stage], batch_size)
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+    return results
+
+def print_results(results, baseline=None):
+    baseline_results = (baseline or {}).get('results', {})
+    print(f"\n{'benchmark':34s} | {'median, ms':>11} | {'p90, ms':>10} | {'ms / image':>10} | {'baseline, ms':>12} | change")
+    print("-" * 98)
+    for name, summary in results.items():
+        line = (f"{name:34s} | {summary['median_ms']:>11.3f} | {summary['p90_ms']:>10.3f} | "
+                f"{summary['per_image_ms']:>10.3f}")
+        reference = baseline_results.get(name)
+        if reference:
+            change = summary['median_ms'] / reference['median_ms'] - 1.0
+            line += f" | {reference['median_ms']:>12.3f} | {change:+.0%}"
+        print(line)
+
+def compare(results, baseline, threshold=THRESHOLD, min_delta_ms=MIN_DELTA_MS):
+    """Список регрессий [(name, baseline_ms, current_ms)] относительно baseline"""
+    regressions = []
+    for name, reference in baseline.get('results', {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        delta = current['median_ms'] - reference['median_ms']
+        if delta > min_delta_ms and current['median_ms'] > reference['median_ms'] * (1.0 + threshold):
+            regressions.append((name, reference['median_ms'], current['median_ms']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки инференса captcha_api.py')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES, help='Размеры батчей')
+    parser.add_argument('--repeats', type=int, default=10, help='Повторов warm замера')
+    parser.add_argument('--cold-runs', type=int, default=3, help='Подпроцессов для cold замера')
+    parser.add_argument('--seed', type=int, default=42, help='Seed весов модели и изображений')
+    parser.add_argument('--decoder', choices=['greedy', 'beam'], default='greedy', help='CTC декодер')
+    parser.add_argument('--preprocess', choices=['tf', 'cv2'], default='tf', help='Предобработка: TF или OpenCV/NumPy')
+    parser.add_argument('--output', default=RESULTS_FILE, help='Куда записать результаты (JSON)')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline для сравнения (JSON)')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='Допустимый рост медианы относительно baseline (0.25 = +25%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=MIN_DELTA_MS,
+                        help='Минимальный абсолютный рост медианы, считающийся регрессией')
+    parser.add_argument('--update-baseline', action='store_true', help='Записать результаты как новый baseline')
+    parser.add_argument('--cold-run', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--model-path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_run:
+        print(json.dumps(run_cold(args.model_path, args.batch_sizes[0], args.seed, args.decoder, args.preprocess)))
+        return
+
+    results = run_suite(args.batch_sizes, args.repeats, args.cold_runs, args.seed, args.decoder, args.preprocess)
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'config': {'batch_sizes': args.batch_sizes, 'repeats': args.repeats, 'cold_runs': args.cold_runs,
+                   'seed': args.seed, 'decoder': args.decoder, 'preprocess': args.preprocess},
+        'results': results,
+    }
+
+    baseline = None
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    output = args.baseline if args.update_baseline else args.output
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[OK] Результаты сохранены: {output}")
+
+    if baseline is None:
+        if not args.update_baseline:
+            print(f"[!] Baseline {args.baseline} не найден, сравнение пропущено")
+        return
+    if baseline.get('config', {}).get('decoder') != args.decoder:
+        print(f"[!] Baseline снят с декодером {baseline.get('config', {}).get('decoder')}, сейчас {args.decoder}")
+    if baseline.get('config', {}).get('preprocess', 'tf') != args.preprocess:
+        print(f"[!] Baseline снят с предобработкой {baseline.get('config', {}).get('preprocess', 'tf')}, "
+              f"сейчас {args.preprocess}")
+    changed = {key: (baseline.get('environment', {}).get(key), value)
+               for key, value in report['environment'].items()
+               if baseline.get('environment', {}).get(key) != value}
+    for key, (before, after) in changed.items():
+        print(f"[!] Окружение отличается от baseline: {key} {before} -> {after}")
+
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+    if not regressions:
+        print(f"[OK] Регрессий нет (порог +{args.threshold:.0%})")
+        return
+    print(f"[ERROR] Регрессии (порог +{args.threshold:.0%}):")
+    for name, before, after in regressions:
+        print(f"  {name}: {before:.3f} -> {after:.3f} ms ({after / before - 1.0:+.0%})")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бинарный формат запросов к /predict и /predict-batch (без base64 и JSON)
+
+Два content type (числа - little-endian uint32):
+
+    application/x-captcha-images   закодированные изображения (PNG, JPEG, ...)
+        [длина 1][байты 1][длина 2][байты 2]...
+
+    application/x-captcha-tensor   пиксели uint8 одним тензором
+        [batch][height][width][channels][batch * height * width * channels байт, порядок NHWC]
+        channels - 1, 3 или 4 (серый дублируется в RGB, альфа отбрасывается)
+
+Тензор читается через np.frombuffer прямо из тела запроса, без копии.
+/predict ждет ровно одно изображение, /predict-batch - одно или больше;
+ответы те же JSON, что и для base64.
+
+    curl -X POST -H "Content-Type: application/x-captcha-images" \\
+         --data-binary @<(python binary_protocol.py --encode a.png b.png) http://localhost:5000/predict-batch
+"""
+
+import sys
+import struct
+import argparse
+import numpy as np
+
+IMAGES_CONTENT_TYPE = 'application/x-captcha-images'
+TENSOR_CONTENT_TYPE = 'application/x-captcha-tensor'
+CONTENT_TYPES = (IMAGES_CONTENT_TYPE, TENSOR_CONTENT_TYPE)
+
+LENGTH = struct.Struct('<I')
+TENSOR_HEADER = struct.Struct('<4I')  # batch, height, width, channels
+MAX_IMAGES = 4096
+
+class BinaryFormatError(ValueError):
+    """Тело запроса не соответствует бинарному формату (ответ 400)"""
+
+def encode_images(images):
+    """Список bytes закодированных изображений -> тело application/x-captcha-images"""
+    return b''.join(LENGTH.pack(len(image)) + bytes(image) for image in images)
+
+def decode_images(body):
+    """Тело application/x-captcha-images -> список bytes"""
+    view = memoryview(body)
+    images, offset = [], 0
+    while offset < len(view):
+        if offset + LENGTH.size > len(view):
+            raise BinaryFormatError("Обрезанный заголовок длины изображения")
+        (length,) = LENGTH.unpack_from(view, offset)
+        offset += LENGTH.size
+        if offset + length > len(view):
+            raise BinaryFormatError(f"Изображение {len(images)}: заявлено {length} байт, доступно {len(view) - offset}")
+        # tf.io.decode_image принимает только bytes: здесь одна копия сжатых данных
+        images.append(view[offset:offset + length].tobytes())
+        offset += length
+        if len(images) > MAX_IMAGES:
+            raise BinaryFormatError(f"Больше {MAX_IMAGES} изображений в запросе")
+    return images
+
+def encode_tensor(pixels):
+    """uint8 массив (batch, height, width, channels) -> тело application/x-captcha-tensor"""
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    if pixels.ndim == 3:
+        pixels = pixels[None]
+    return TENSOR_HEADER.pack(*pixels.shape) + pixels.tobytes()
+
+def decode_tensor(body):
+    """Тело application/x-captcha-tensor -> uint8 (batch, height, width, 3), view на body без копии"""
+    if len(body) < TENSOR_HEADER.size:
+        raise BinaryFormatError("Нет заголовка тензора (batch, height, width, channels)")
+    batch, height, width, channels = TENSOR_HEADER.unpack_from(body)
+    if channels not in (1, 3, 4):
+        raise BinaryFormatError(f"channels должно быть 1, 3 или 4, получено {channels}")
+    if not 0 < batch <= MAX_IMAGES or height == 0 or width == 0:
+        raise BinaryFormatError(f"Недопустимая форма тензора {(batch, height, width, channels)}")
+    expected = batch * height * width * channels
+    if len(body) - TENSOR_HEADER.size != expected:
+        raise BinaryFormatError(f"Тензор {(batch, height, width, channels)}: ожидалось {expected} байт пикселей, "
+                                f"получено {len(body) - TENSOR_HEADER.size}")
+    pixels = np.frombuffer(body, dtype=np.uint8, count=expected, offset=TENSOR_HEADER.size)
+    pixels = pixels.reshape(batch, height, width, channels)
+    if channels == 1:
+        return np.repeat(pixels, 3, axis=-1)
+    return pixels[..., :3]
+
+def main():
+    parser = argparse.ArgumentParser(description='Бинарное тело запроса из файлов изображений (в stdout)')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--encode', action='store_true', help='application/x-captcha-images (по умолчанию)')
+    parser.add_argument('--tensor', action='store_true', help='application/x-captcha-tensor (декодированные пиксели)')
+    args = parser.parse_args()
+
+    if args.tensor:
+        from PIL import Image
+        body = encode_tensor(np.stack([np.asarray(Image.open(path).convert('RGB')) for path in args.files]))
+    else:
+        images = []
+        for path in args.files:
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        body = encode_images(images)
+    sys.stdout.buffer.write(body)
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,26 @@ Flask сервер для предсказания текста на CAPTCHA и
 
 Использование:
     python captcha_api.py --host 0.0.0.0 --port 5000
+    python captcha_api.py --port 5000 --max-batch-size 32 --max-batch-delay-ms 5
+    python captcha_api.py --port 5000 --decoder beam --beam-width 8 --top-k 3
+    python captcha_api.py --port 5000 --backend tflite --num-threads 4
+    python captcha_api.py --port 5000 --warmup-batch-sizes 1 8 32 64
+    python captcha_api.py --port 5000 --cache-size 50000 --cache-ttl 600   # --cache-size 0 выключает кеш
+    python captcha_api.py --port 5000 --preprocess cv2   # предобработка OpenCV/NumPy вместо TF (fast_preprocess.py)
+    
+    Бинарные тела без base64/JSON (формат - в binary_protocol.py):
+    curl -X POST -H "Content-Type: application/x-captcha-images" --data-binary @batch.bin http://localhost:5000/predict-batch
+    Тензор пикселей (application/x-captcha-tensor) идет в модель целиком, мимо кеша
+    результатов и без поиска одинаковых изображений.
+
+    Для production (несколько процессов, настройка потоков TF) - serve.py
     
     Затем вызывать через HTTP:
     curl -X POST -F "image=@test.png" http://localhost:5000/predict
+
+    Метрики Prometheus (задержки по стадиям, счетчики запросов и ошибок,
+    размеры батчей, запросы в обработке, время загрузки модели):
+    curl http://localhost:5000/metrics
 """
 
 import os
@@ -17,14 +34,27 @@ import sys
 import json
 import base64
 import argparse
+import threading
+import queue
+import time
+from collections import Counter
+from concurrent.futures import Future
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from PIL import Image
 import io
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 import logging
+from ctc_decoder import build_lookup, greedy_decode, beam_search_decode_batch
+from inference_backend import BACKENDS, DEFAULT_MODEL_PATHS, WARMUP_BATCH_SIZES, load_backend, warmup
+from model_metadata import load_metadata, metadata_path, char_mappings, file_checksum
+from api_metrics import Metrics, BATCH_SIZE_BUCKETS, CONTENT_TYPE
+from binary_protocol import (CONTENT_TYPES as BINARY_CONTENT_TYPES, IMAGES_CONTENT_TYPE,
+                             BinaryFormatError, decode_images, decode_tensor)
+from result_cache import ResultCache, content_hash
+import fast_preprocess
 
 # Настройки логирования
 logging.basicConfig(level=logging.INFO)
@@ -34,106 +64,511 @@ logger = logging.getLogger(__name__)
 IMG_WIDTH = 200
 IMG_HEIGHT = 60
 MAX_SEQUENCE_LENGTH = 7
-MODEL_PATH = "final-results/output/model.keras"
-LABELS_PATH = "images/labels.csv"
+INPUT_LAYOUT = 'WHC'  # 'HWC', если транспонирование встроено в модель (из метаданных)
+MODEL_BACKEND = "keras"  # keras | saved_model | tflite
+MODEL_PATH = DEFAULT_MODEL_PATHS[MODEL_BACKEND]
+NUM_THREADS = None  # Потоки TFLite интерпретатора (None = по умолчанию)
+PREPROCESSOR = 'tf'  # 'tf' или 'cv2' (fast_preprocess.py)
+
+# Настройки micro-batching для /predict (переопределяются флагами CLI)
+MAX_BATCH_SIZE = 32
+MAX_BATCH_DELAY_MS = 5.0
+# Максимальный размер одного вызова модели в /predict-batch
+BATCH_CHUNK_SIZE = 64
+
+# Настройки декодирования (переопределяются флагами CLI)
+DECODER = 'greedy'  # 'greedy' или 'beam'
+BEAM_WIDTH = 8
+BEAM_PRUNE_THRESHOLD = 1e-3
+TOP_K = 3
+
+# Кеш результатов по содержимому изображения (переопределяется флагами CLI)
+CACHE_SIZE = 10000  # Записей, 0 - кеш выключен
+CACHE_MAX_MB = 64.0
+CACHE_TTL = 3600.0  # Секунд
 
 app = Flask(__name__)
 CORS(app)  # Разрешить CORS для запросов с других серверов
 
+# Метрики для GET /metrics
+metrics = Metrics()
+metrics.counter('captcha_requests_total', 'Запросы по endpoint')
+metrics.counter('captcha_request_errors_total', 'Ответы с кодом 4xx/5xx по endpoint')
+metrics.histogram('captcha_request_duration_seconds', 'Время обработки запроса по endpoint')
+metrics.histogram('captcha_stage_duration_seconds',
+                  'Время стадий: base64_decode, binary_decode, image_decode, resize_transpose, model, ctc_decode')
+metrics.histogram('captcha_batch_size', 'Изображений в одном вызове модели', buckets=BATCH_SIZE_BUCKETS)
+metrics.gauge('captcha_requests_in_flight', 'Запросы в обработке')
+metrics.gauge('captcha_model_load_seconds', 'Время загрузки модели при старте')
+metrics.counter('captcha_cache_lookups_total', 'Обращения к кешу результатов (result: hit, miss)')
+
 # Глобальные переменные для кеша
 model = None
 char_to_num = None
 num_to_char = None
+char_lookup = None
+batcher = None
+warmup_stats = None
+result_cache = None
+MODEL_VERSION = None  # Начало sha256 модели: часть ключа кеша результатов
 
 def load_model_weights():
     """Загружает модель и словари символов"""
-    global model, char_to_num, num_to_char
+    global model, char_to_num, num_to_char, char_lookup, MAX_SEQUENCE_LENGTH, INPUT_LAYOUT, MODEL_VERSION
     
     try:
-        logger.info(f"Загружаем модель из {MODEL_PATH}...")
-        model = keras.models.load_model(MODEL_PATH)
-        logger.info("✓ Модель загружена успешно")
+        logger.info(f"Загружаем модель из {MODEL_PATH} (бэкенд: {MODEL_BACKEND})...")
+        start = time.perf_counter()
+        model = load_backend(MODEL_BACKEND, MODEL_PATH, NUM_THREADS)
+        load_seconds = time.perf_counter() - start
+        metrics.set('captcha_model_load_seconds', load_seconds, backend=MODEL_BACKEND)
+        logger.info(f"✓ Модель загружена успешно ({load_seconds:.2f} с)")
     except Exception as e:
         logger.error(f"❌ Ошибка загрузки модели: {e}")
         raise
     
-    # Загружаем словари символов
+    # Загружаем словари символов из метаданных модели
     try:
-        logger.info(f"Определяем алфавит из {LABELS_PATH}...")
-        with open(LABELS_PATH, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        all_chars = set()
-        for line in lines:
-            text = line.split(';')[0].strip()
-            all_chars.update(text)
+        logger.info(f"Читаем алфавит из {metadata_path(MODEL_PATH)}...")
+        metadata = load_metadata(MODEL_PATH, model.num_classes)
+        if (metadata['img_width'], metadata['img_height']) != (IMG_WIDTH, IMG_HEIGHT):
+            raise ValueError(f"Модель обучена на {metadata['img_width']}x{metadata['img_height']}, "
+                             f"а API ожидает {IMG_WIDTH}x{IMG_HEIGHT}")
+        char_to_num, num_to_char = char_mappings(metadata)
+        char_lookup = build_lookup(num_to_char, model.num_classes)
+        MAX_SEQUENCE_LENGTH = metadata['max_sequence_length']
+        INPUT_LAYOUT = metadata.get('input_layout', 'WHC')
+        checksum = metadata.get('checksums', {}).get(os.path.basename(os.path.normpath(MODEL_PATH)))
+        MODEL_VERSION = (checksum or file_checksum(MODEL_PATH))[:16]
         
-        characters = sorted(all_chars)
-        char_to_num = {v: i for i, v in enumerate(characters)}
-        num_to_char = {str(i): v for i, v in enumerate(characters)}
-        num_to_char['-1'] = 'UKN'
-        
-        logger.info(f"✓ Алфавит загружен: {len(characters)} символов")
+        logger.info(f"✓ Алфавит загружен: {len(metadata['characters'])} символов")
     except Exception as e:
         logger.error(f"❌ Ошибка загрузки словарей: {e}")
         raise
 
+def decode_base64(image_b64):
+    """base64 строка (возможно, data:image/...;base64,...) -> bytes"""
+    with metrics.timer('captcha_stage_duration_seconds', stage='base64_decode'):
+        # Удаляем префикс data:image если он есть
+        if ',' in image_b64:
+            image_b64 = image_b64.split(',')[1]
+        return base64.b64decode(image_b64)
+
 def preprocess_image(image_data, img_width=IMG_WIDTH, img_height=IMG_HEIGHT):
-    """Предобрабатывает изображение для модели"""
+    """Предобрабатывает изображение для модели: uint8 батч (1, W, H, C), нормализация внутри модели"""
+    if PREPROCESSOR == 'cv2' and isinstance(image_data, bytes):
+        out = fast_preprocess.allocate(1, img_width, img_height, INPUT_LAYOUT)
+        preprocess_into(image_data, out[0])
+        return out
     try:
-        # Если это bytes, декодируем
-        if isinstance(image_data, bytes):
-            img = tf.io.decode_image(image_data, channels=3)
-        else:
-            # Если это PIL Image
-            img = tf.convert_to_tensor(np.array(image_data))
-        
-        # Конвертируем в float32
-        img = tf.image.convert_image_dtype(img, tf.float32)
-        
-        # Транспонируем (width, height, channels)
-        img = tf.transpose(img, perm=[1, 0, 2])
+        with metrics.timer('captcha_stage_duration_seconds', stage='image_decode'):
+            # Если это bytes, декодируем
+            if isinstance(image_data, bytes):
+                img = tf.io.decode_image(image_data, channels=3, expand_animations=False)
+            else:
+                # Если это PIL Image
+                img = tf.convert_to_tensor(np.array(image_data))
         
-        # Изменяем размер
-        img = tf.image.resize(img, [img_width, img_height])
-        
-        # Добавляем batch dimension
-        img = tf.expand_dims(img, 0)
-        
-        return img.numpy()
+        with metrics.timer('captcha_stage_duration_seconds', stage='resize_transpose'):
+            # Изменяем размер только если нужно (остаемся в uint8)
+            if tuple(img.shape[:2]) != (img_height, img_width):
+                img = tf.image.resize(img, [img_height, img_width])
+                img = tf.saturate_cast(tf.round(img), tf.uint8)
+            
+            # Транспонируем (width, height, channels), если модель не делает этого сама
+            if INPUT_LAYOUT == 'WHC':
+                img = tf.transpose(img, perm=[1, 0, 2])
+            
+            # Добавляем batch dimension
+            img = tf.expand_dims(img, 0)
+            
+            return img.numpy()
+    except Exception as e:
+        logger.error(f"❌ Ошибка предобработки изображения: {e}")
+        raise
+
+def preprocess_into(image_data, out):
+    """Предобрабатывает изображение прямо в слот out батч-буфера (форма входа модели без batch)"""
+    if PREPROCESSOR != 'cv2' or not isinstance(image_data, bytes):
+        out[...] = preprocess_image(image_data)[0]
+        return
+    try:
+        # OpenCV/NumPy: без eager операций TF, одна копия в буфер
+        with metrics.timer('captcha_stage_duration_seconds', stage='image_decode'):
+            img = fast_preprocess.decode_image(image_data)
+        with metrics.timer('captcha_stage_duration_seconds', stage='resize_transpose'):
+            fast_preprocess.resize_into(img, out, INPUT_LAYOUT)
     except Exception as e:
         logger.error(f"❌ Ошибка предобработки изображения: {e}")
         raise
 
+def read_binary(body, content_type):
+    """Бинарное тело -> (список закодированных изображений, None) или (None, uint8 тензор NHWC)"""
+    with metrics.timer('captcha_stage_duration_seconds', stage='binary_decode'):
+        if content_type == IMAGES_CONTENT_TYPE:
+            return decode_images(body), None
+        return None, decode_tensor(body)
+
+def preprocess_pixels(pixels, img_width=IMG_WIDTH, img_height=IMG_HEIGHT):
+    """Предобрабатывает uint8 батч (N, H, W, 3) без декодирования: размер и раскладка, как в preprocess_image"""
+    with metrics.timer('captcha_stage_duration_seconds', stage='resize_transpose'):
+        if pixels.shape[1:3] != (img_height, img_width):
+            pixels = tf.image.resize(pixels, [img_height, img_width])
+            pixels = tf.saturate_cast(tf.round(pixels), tf.uint8).numpy()
+        if INPUT_LAYOUT == 'WHC':
+            # View без копии: непрерывный буфер для модели соберет бэкенд
+            pixels = pixels.transpose(0, 2, 1, 3)
+        return pixels
+
 def decode_predictions(predictions):
-    """Декодирует предсказания модели в текст"""
+    """
+    Декодирует предсказания модели в [{'prediction', 'confidence', 'char_confidences'}, ...].
+
+    greedy: confidence - произведение уверенностей символов.
+    beam:   confidence - вероятность лучшей строки, плюс top-k 'candidates'.
+    """
     try:
-        input_len = np.ones(predictions.shape[0]) * predictions.shape[1]
-        results = tf.keras.backend.ctc_decode(predictions, input_length=input_len, greedy=True)[0][0]
-        
-        texts = []
-        for result in results:
-            text = ""
-            for idx in result:
-                if idx != -1:
-                    char = num_to_char.get(str(idx.numpy()), '')
-                    if char != 'UKN':
-                        text += char
-            texts.append(text)
+        with metrics.timer('captcha_stage_duration_seconds', stage='ctc_decode'):
+            if DECODER == 'beam':
+                results = []
+                for candidates in beam_search_decode_batch(
+                    predictions, char_lookup, beam_width=BEAM_WIDTH,
+                    prune_threshold=BEAM_PRUNE_THRESHOLD, max_length=MAX_SEQUENCE_LENGTH, top_k=TOP_K
+                ):
+                    best = candidates[0]
+                    results.append({
+                        'prediction': best['text'],
+                        'confidence': float(np.exp(best['log_prob'])),
+                        'char_confidences': best['char_confidences'],
+                        'candidates': candidates
+                    })
+                return results
         
-        return texts
+            texts, char_confidences = greedy_decode(predictions, char_lookup, return_confidences=True)
+            return [{
+                'prediction': text,
+                'confidence': float(np.prod(confidences)) if confidences else 0.0,
+                'char_confidences': confidences
+            } for text, confidences in zip(texts, char_confidences)]
     except Exception as e:
         logger.error(f"❌ Ошибка декодирования: {e}")
         raise
 
+def predict_chunk(images):
+    """Один вызов модели (с метриками времени и размера батча)"""
+    metrics.observe('captcha_batch_size', len(images))
+    with metrics.timer('captcha_stage_duration_seconds', stage='model'):
+        return model.predict(images)
+
+def run_model(images, chunk_size=None):
+    """Один forward pass по батчу (кусками не больше chunk_size)"""
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    if len(images) <= chunk_size:
+        return predict_chunk(images)
+    return np.concatenate([
+        predict_chunk(images[start:start + chunk_size])
+        for start in range(0, len(images), chunk_size)
+    ])
+
+def infer_batch(images):
+    """Прогоняет батч изображений через модель и декодирует все выходы разом"""
+    return decode_predictions(run_model(images))
+
+class MicroBatcher:
+    """
+    Объединяет одновременные запросы /predict в один вызов модели.
+
+    Запросы складываются в очередь; фоновый поток ждет первый элемент,
+    затем добирает остальные, пока не наберется max_batch_size или не
+    истечет max_delay_ms, делает один вызов process_fn и раздает
+    каждому вызывающему его собственный результат.
+    """
+
+    def __init__(self, process_fn, max_batch_size=MAX_BATCH_SIZE, max_delay_ms=MAX_BATCH_DELAY_MS):
+        self.process_fn = process_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_delay = max(0.0, float(max_delay_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._submit_lock = threading.Lock()
+        self._stopped = False
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._thread = threading.Thread(target=self._worker, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Ставит одно изображение (без batch dimension) в очередь и ждет результат"""
+        return self.submit_async(item).result()
+
+    def submit_async(self, item):
+        """Ставит изображение в очередь и сразу возвращает concurrent.futures.Future результата"""
+        future = Future()
+        with self._submit_lock:
+            if self._stopped:
+                raise RuntimeError("Micro-batching остановлен")
+            self._queue.put((item, future))
+        return future
+
+    def stop(self, timeout=None):
+        """Останавливает фоновый поток; уже поставленные в очередь изображения обрабатываются"""
+        with self._submit_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(None)  # Метка остановки - после всех принятых изображений
+        self._thread.join(timeout)
+
+    def _collect(self):
+        """Собирает очередной батч из очереди; None - остановка"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        items = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    # Время вышло - забираем только то, что уже лежит в очереди
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Остановка - после этого батча
+                break
+            items.append(item)
+        return items
+
+    def _worker(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+            futures = [future for _, future in items]
+            with self._stats_lock:
+                self._batch_sizes[len(items)] += 1
+            try:
+                results = self.process_fn(np.stack([item for item, _ in items]))
+            except Exception as e:
+                logger.error(f"❌ Ошибка batch-инференса: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def stats(self):
+        """Фактически достигнутое распределение размеров батчей"""
+        with self._stats_lock:
+            distribution = dict(sorted(self._batch_sizes.items()))
+        batches = sum(distribution.values())
+        images = sum(size * count for size, count in distribution.items())
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_batch_delay_ms': self.max_delay * 1000.0,
+            'batches': batches,
+            'images': images,
+            'mean_batch_size': round(images / batches, 2) if batches else 0.0,
+            'batch_size_distribution': {str(size): count for size, count in distribution.items()}
+        }
+
+def cache_key(image_data):
+    """Ключ кеша результатов: версия модели + хеш сырых байтов изображения"""
+    return MODEL_VERSION, content_hash(image_data)
+
+def cached_result(key):
+    """Результат из кеша или None (промах или кеш выключен)"""
+    if result_cache is None or key is None:
+        return None
+    result = result_cache.get(key)
+    metrics.inc('captcha_cache_lookups_total', result='miss' if result is None else 'hit')
+    return result
+
+def cache_result(key, result):
+    if result_cache is not None and key is not None:
+        result_cache.put(key, result)
+
+def lookup_result(image_data):
+    """(ключ, результат из кеша или None); без кеша изображение не хешируется"""
+    if result_cache is None:
+        return None, None
+    key = cache_key(image_data)
+    return key, cached_result(key)
+
+def predict_image(image_data):
+    """Ответ /predict для одного изображения (bytes); повтор тех же байтов отдается из кеша"""
+    key, result = lookup_result(image_data)
+    if result is not None:
+        logger.info(f"Предсказание из кеша: '{result['prediction']}'")
+        return {'success': True, **result}
+    return predict_processed(preprocess_image(image_data), key)
+
+def predict_processed(processed_img, key=None):
+    """Ответ /predict для предобработанного изображения (батч из одного); key - ключ кеша для результата"""
+    # Делаем предсказание (через micro-batching, если он включен)
+    if batcher is not None:
+        result = batcher.submit(processed_img[0])
+    else:
+        result = infer_batch(processed_img)[0]
+    cache_result(key, result)
+    
+    logger.info(f"Предсказание: '{result['prediction']}'")
+    return {
+        'success': True,
+        **result
+    }
+
+def batch_result(index, result):
+    """Элемент results ответа /predict-batch"""
+    return {
+        'index': index,
+        'prediction': result['prediction'],
+        'confidence': result['confidence'],
+        'success': True
+    }
+
+def predict_images(images, decode=decode_base64):
+    """Ответ /predict-batch для списка base64 строк (decode=None - уже bytes изображений)"""
+    results = [None] * len(images)
+    
+    # Декодируем все payload'ы прямо в батч-буфер; ошибки остаются на своих индексах.
+    # Одинаковые изображения идут в модель один раз, известные кешу - не идут совсем
+    processed = fast_preprocess.allocate(len(images), IMG_WIDTH, IMG_HEIGHT, INPUT_LAYOUT)
+    use_cache = result_cache is not None
+    count = 0
+    hits, pending = {}, {}  # ключ -> результат из кеша / номер в processed
+    indices = []  # номер в processed -> индексы запроса с этим изображением
+    for i, image in enumerate(images):
+        try:
+            image_data = decode(image) if decode is not None else image
+            # Без кеша дубликаты ищутся по самим bytes (встроенный hash), без blake2b
+            key = cache_key(image_data) if use_cache else image_data
+            if key not in hits and key not in pending:
+                result = cached_result(key) if use_cache else None
+                if result is not None:
+                    hits[key] = result
+                else:
+                    preprocess_into(image_data, processed[count])
+                    pending[key] = count
+                    indices.append([])
+                    count += 1
+            if key in hits:
+                results[i] = batch_result(i, hits[key])
+            else:
+                indices[pending[key]].append(i)
+        except Exception as e:
+            results[i] = {
+                'index': i,
+                'error': str(e),
+                'success': False
+            }
+    
+    # Один forward pass и одно декодирование для всех уникальных изображений
+    if count:
+        try:
+            outputs = infer_batch(processed[:count])
+            for key, same_image, result in zip(pending, indices, outputs):
+                if use_cache:
+                    cache_result(key, result)
+                for i in same_image:
+                    results[i] = batch_result(i, result)
+        except Exception as e:
+            logger.error(f"❌ Ошибка batch-инференса: {e}")
+            for same_image in indices:
+                for i in same_image:
+                    results[i] = {
+                        'index': i,
+                        'error': str(e),
+                        'success': False
+                    }
+    
+    logger.info(f"Batch обработка: {len(images)} изображений "
+                f"({count} уникальных в модель, {len(hits)} из кеша)")
+    return {
+        'success': True,
+        'total': len(images),
+        'results': results
+    }
+
+def predict_pixels(pixels):
+    """
+    Ответ /predict-batch для uint8 тензора (N, H, W, 3): один вызов модели на весь тензор.
+    Кеш результатов и поиск дубликатов здесь не используются: ключ кеша - хеш
+    сжатых байтов изображения, а в тензоре приходят уже декодированные пиксели.
+    """
+    outputs = infer_batch(preprocess_pixels(pixels))
+    results = [batch_result(i, result) for i, result in enumerate(outputs)]
+    logger.info(f"Batch обработка: тензор {len(results)} изображений")
+    return {
+        'success': True,
+        'total': len(results),
+        'results': results
+    }
+
+def health_payload():
+    return {
+        'status': 'ok',
+        'model_loaded': model is not None,
+        'version': '1.0',
+        'batching': batcher.stats() if batcher is not None else {'enabled': False},
+        'warmup': {'batch_sizes': warmup_stats} if warmup_stats is not None else {'enabled': False},
+        'cache': result_cache.stats() if result_cache is not None else {'enabled': False}
+    }
+
+def info_payload():
+    return {
+        'name': 'CAPTCHA OCR API',
+        'version': '1.0',
+        'description': 'REST API for CAPTCHA text recognition',
+        'model': {
+            'path': MODEL_PATH,
+            'backend': MODEL_BACKEND,
+            'version': MODEL_VERSION,
+            'image_size': [IMG_HEIGHT, IMG_WIDTH],
+            'max_sequence_length': MAX_SEQUENCE_LENGTH,
+            'decoder': DECODER,
+            'preprocess': PREPROCESSOR,
+            'accuracy_kaggle': '95%'
+        },
+        'endpoints': {
+            'GET /health': 'Проверка статуса',
+            'GET /info': 'Информация об API',
+            'POST /predict': 'Предсказание для одного изображения',
+            'POST /predict-batch': 'Batch предсказание для множества изображений',
+            'GET /metrics': 'Метрики Prometheus'
+        }
+    }
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.inc('captcha_requests_in_flight')
+
+@app.after_request
+def record_request_metrics(response):
+    # Метка - шаблон маршрута, а не сырой путь: число рядов метрики не растет от 404
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.inc('captcha_requests_total', endpoint=endpoint, method=request.method)
+    if response.status_code >= 400:
+        metrics.inc('captcha_request_errors_total', endpoint=endpoint, status=response.status_code)
+    metrics.observe('captcha_request_duration_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    metrics.dec('captcha_requests_in_flight')
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Проверка здоровья API"""
-    return jsonify({
-        'status': 'ok',
-        'model_loaded': model is not None,
-        'version': '1.0'
-    })
+    return jsonify(health_payload())
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -156,31 +591,26 @@ def predict():
         elif request.is_json:
             data = request.get_json()
             if 'image' in data:
-                image_b64 = data['image']
-                # Удаляем префикс data:image если он есть
-                if ',' in image_b64:
-                    image_b64 = image_b64.split(',')[1]
-                image_data = base64.b64decode(image_b64)
+                image_data = decode_base64(data['image'])
                 logger.info(f"Получено base64 изображение ({len(image_data)} bytes)")
         
+        # Вариант 3: бинарное тело (binary_protocol.py)
+        elif request.mimetype in BINARY_CONTENT_TYPES:
+            images, pixels = read_binary(request.get_data(), request.mimetype)
+            count = len(images) if images is not None else len(pixels)
+            if count != 1:
+                return jsonify({'error': f'Exactly one image expected, got {count}'}), 400
+            if pixels is not None:
+                return jsonify(predict_processed(preprocess_pixels(pixels)))
+            image_data = images[0]
+        
         if image_data is None:
             return jsonify({'error': 'No image provided'}), 400
         
-        # Предобрабатываем изображение
-        processed_img = preprocess_image(image_data)
-        
-        # Делаем предсказание
-        predictions = model.predict(processed_img, verbose=0)
-        predicted_texts = decode_predictions(predictions)
-        predicted_text = predicted_texts[0] if predicted_texts else ""
-        
-        logger.info(f"Предсказание: '{predicted_text}'")
-        
-        return jsonify({
-            'success': True,
-            'prediction': predicted_text,
-            'confidence': float(np.max(predictions))
-        })
+        return jsonify(predict_image(image_data))
+    
+    except BinaryFormatError as e:
+        return jsonify({'error': str(e)}), 400
     
     except Exception as e:
         logger.error(f"❌ Ошибка: {str(e)}")
@@ -196,6 +626,13 @@ def predict_batch():
         if model is None:
             return jsonify({'error': 'Model not loaded'}), 500
         
+        # Бинарное тело: закодированные изображения или готовый тензор пикселей
+        if request.mimetype in BINARY_CONTENT_TYPES:
+            images, pixels = read_binary(request.get_data(), request.mimetype)
+            if pixels is not None:
+                return jsonify(predict_pixels(pixels))
+            return jsonify(predict_images(images, decode=None))
+        
         if not request.is_json:
             return jsonify({'error': 'JSON expected'}), 400
         
@@ -203,36 +640,10 @@ def predict_batch():
         if 'images' not in data or not isinstance(data['images'], list):
             return jsonify({'error': 'images array expected'}), 400
         
-        results = []
-        for i, image_b64 in enumerate(data['images']):
-            try:
-                # Удаляем префикс если есть
-                if ',' in image_b64:
-                    image_b64 = image_b64.split(',')[1]
-                
-                image_data = base64.b64decode(image_b64)
-                processed_img = preprocess_image(image_data)
-                predictions = model.predict(processed_img, verbose=0)
-                predicted_texts = decode_predictions(predictions)
-                
-                results.append({
-                    'index': i,
-                    'prediction': predicted_texts[0] if predicted_texts else "",
-                    'success': True
-                })
-            except Exception as e:
-                results.append({
-                    'index': i,
-                    'error': str(e),
-                    'success': False
-                })
-        
-        logger.info(f"Batch обработка: {len(data['images'])} изображений")
-        return jsonify({
-            'success': True,
-            'total': len(data['images']),
-            'results': results
-        })
+        return jsonify(predict_images(data['images']))
+    
+    except BinaryFormatError as e:
+        return jsonify({'error': str(e)}), 400
     
     except Exception as e:
         logger.error(f"❌ Ошибка batch: {str(e)}")
@@ -244,23 +655,7 @@ def predict_batch():
 @app.route('/info', methods=['GET'])
 def info():
     """Информация о модели и API"""
-    return jsonify({
-        'name': 'CAPTCHA OCR API',
-        'version': '1.0',
-        'description': 'REST API for CAPTCHA text recognition',
-        'model': {
-            'path': MODEL_PATH,
-            'image_size': [IMG_HEIGHT, IMG_WIDTH],
-            'max_sequence_length': MAX_SEQUENCE_LENGTH,
-            'accuracy_kaggle': '95%'
-        },
-        'endpoints': {
-            'GET /health': 'Проверка статуса',
-            'GET /info': 'Информация об API',
-            'POST /predict': 'Предсказание для одного изображения',
-            'POST /predict-batch': 'Batch предсказание для множества изображений'
-        }
-    })
+    return jsonify(info_payload())
 
 @app.errorhandler(404)
 def not_found(error):
@@ -270,17 +665,52 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
-def main():
+def build_parser():
+    """Аргументы сервера (общие для captcha_api.py и воркеров serve.py)"""
     parser = argparse.ArgumentParser(description='CAPTCHA OCR REST API Server')
     parser.add_argument('--host', default='127.0.0.1', help='Host address (default: 127.0.0.1)')
     parser.add_argument('--port', type=int, default=5000, help='Port number (default: 5000)')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--backend', choices=BACKENDS, default=MODEL_BACKEND,
+                        help=f'Inference backend (default: {MODEL_BACKEND})')
+    parser.add_argument('--model', default=None,
+                        help='Model path (default: final-results/output/model.{keras,tflite} or .../model for saved_model)')
+    parser.add_argument('--num-threads', type=int, default=None,
+                        help='Threads for the TFLite interpreter (default: TFLite default)')
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE,
+                        help=f'Max images per model call for /predict, 1 disables batching (default: {MAX_BATCH_SIZE})')
+    parser.add_argument('--max-batch-delay-ms', type=float, default=MAX_BATCH_DELAY_MS,
+                        help=f'Max time to wait for a batch to fill up (default: {MAX_BATCH_DELAY_MS})')
+    parser.add_argument('--batch-chunk-size', type=int, default=BATCH_CHUNK_SIZE,
+                        help=f'Max images per model call for /predict-batch (default: {BATCH_CHUNK_SIZE})')
+    parser.add_argument('--decoder', choices=['greedy', 'beam'], default=DECODER,
+                        help=f'CTC decoding mode (default: {DECODER})')
+    parser.add_argument('--beam-width', type=int, default=BEAM_WIDTH,
+                        help=f'Beam width for --decoder beam (default: {BEAM_WIDTH})')
+    parser.add_argument('--beam-prune-threshold', type=float, default=BEAM_PRUNE_THRESHOLD,
+                        help=f'Skip characters below this probability in beam search (default: {BEAM_PRUNE_THRESHOLD})')
+    parser.add_argument('--top-k', type=int, default=TOP_K,
+                        help=f'Number of beam search candidates returned by /predict (default: {TOP_K})')
+    parser.add_argument('--warmup-batch-sizes', type=int, nargs='*', default=list(WARMUP_BATCH_SIZES),
+                        help='Batch sizes to warm the model up with before serving, none disables '
+                             f'(default: {" ".join(map(str, WARMUP_BATCH_SIZES))})')
+    parser.add_argument('--preprocess', choices=['tf', 'cv2'], default=PREPROCESSOR,
+                        help=f'Image decoding and resizing: TensorFlow ops or OpenCV/NumPy (default: {PREPROCESSOR})')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help=f'Max cached results keyed by image content, 0 disables the cache (default: {CACHE_SIZE})')
+    parser.add_argument('--cache-max-mb', type=float, default=CACHE_MAX_MB,
+                        help=f'Approximate memory limit of the result cache in MB, 0 - no limit (default: {CACHE_MAX_MB:g})')
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL,
+                        help=f'Seconds a cached result stays valid, 0 - no expiry (default: {CACHE_TTL:g})')
+    return parser
+
+def configure(args):
+    """Применяет аргументы: загружает и прогревает модель, запускает micro-batching"""
+    global batcher, warmup_stats, result_cache, MODEL_BACKEND, MODEL_PATH, NUM_THREADS, PREPROCESSOR, BATCH_CHUNK_SIZE, DECODER, BEAM_WIDTH, BEAM_PRUNE_THRESHOLD, TOP_K
     
-    args = parser.parse_args()
-    
-    print("=" * 60)
-    print("*** CAPTCHA OCR REST API Server ***")
-    print("=" * 60)
+    MODEL_BACKEND = args.backend
+    MODEL_PATH = args.model or DEFAULT_MODEL_PATHS[MODEL_BACKEND]
+    NUM_THREADS = args.num_threads
     
     # Загружаем модель при старте
     try:
@@ -289,11 +719,60 @@ def main():
         logger.error(f"Failed to load model: {e}")
         sys.exit(1)
     
+    BATCH_CHUNK_SIZE = max(1, args.batch_chunk_size)
+    PREPROCESSOR = args.preprocess
+    DECODER = args.decoder
+    BEAM_WIDTH = max(1, args.beam_width)
+    BEAM_PRUNE_THRESHOLD = args.beam_prune_threshold
+    TOP_K = max(1, min(args.top_k, BEAM_WIDTH))
+    if args.warmup_batch_sizes:
+        # Трассировка графа и выделение памяти до первого запроса
+        warmup_stats = warmup(model, args.warmup_batch_sizes)
+        for stats in warmup_stats:
+            logger.info(f"Прогрев batch={stats['batch_size']}: первый вызов {stats['first_call_ms']:.1f} мс, "
+                        f"дальше {stats['steady_state_ms']:.1f} мс")
+    
+    # Повторная настройка (compat_check, воркеры): поток прежнего micro-batching не оставляем
+    if batcher is not None:
+        batcher.stop()
+        batcher = None
+    if args.max_batch_size > 1:
+        batcher = MicroBatcher(infer_batch, args.max_batch_size, args.max_batch_delay_ms)
+    
+    # Новый кеш при каждой настройке: результаты зависят и от декодера
+    result_cache = None
+    if args.cache_size > 0:
+        result_cache = ResultCache(args.cache_size, int(args.cache_max_mb * 1024 * 1024), args.cache_ttl)
+
+def main():
+    args = build_parser().parse_args()
+    
+    print("=" * 60)
+    print("*** CAPTCHA OCR REST API Server ***")
+    print("=" * 60)
+    
+    configure(args)
+    
     print(f"\n[*] Запускаем сервер на {args.host}:{args.port}")
     print(f"[*] Debug mode: {args.debug}")
+    if batcher is not None:
+        print(f"[*] Micro-batching: до {batcher.max_batch_size} изображений, ожидание до {args.max_batch_delay_ms} мс")
+    else:
+        print("[*] Micro-batching: выключен")
+    if DECODER == 'beam':
+        print(f"[*] Декодер: beam search (ширина {BEAM_WIDTH}, top-{TOP_K})")
+    else:
+        print("[*] Декодер: greedy")
+    print(f"[*] Предобработка: {'OpenCV/NumPy' if PREPROCESSOR == 'cv2' else 'TensorFlow'}")
+    if result_cache is not None:
+        print(f"[*] Кеш результатов: до {result_cache.max_entries} записей / {args.cache_max_mb:g} МБ, "
+              f"TTL {args.cache_ttl:g} с (модель {MODEL_VERSION})")
+    else:
+        print("[*] Кеш результатов: выключен")
     print(f"[*] Доступно на: http://{args.host}:{args.port}")
     print(f"[*] Информация: http://{args.host}:{args.port}/info")
     print(f"[*] Health check: http://{args.host}:{args.port}/health")
+    print(f"[*] Метрики Prometheus: http://{args.host}:{args.port}/metrics")
     print("\n" + "=" * 60)
     
     app.run(host=args.host, port=args.port, debug=args.debug)
@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Асинхронный (ASGI) вариант CAPTCHA OCR REST API
+
+Тот же контракт, что у captcha_api.py: /predict (файл multipart или base64
+в JSON), /predict-batch, /health, /info, /metrics - с теми же ответами и
+кодами (ответы собирают общие функции captcha_api.predict_images,
+health_payload, info_payload).
+
+Бинарные тела (application/x-captcha-images, application/x-captcha-tensor)
+разбираются так же, как во Flask сервере (binary_protocol.py).
+
+Отличия от Flask сервера:
+    - тело запроса читается асинхронно: медленный клиент не занимает поток
+    - разбор тела, предобработка и инференс выполняются в ограниченном пуле
+      потоков (--executor-workers); операции TF отпускают GIL, а пул
+      процессов дублировал бы модель в памяти. Задач в пуле и в очереди к
+      нему не больше --max-pending, остальные ждут в event loop
+    - /predict ждет результат micro-batching без занятого потока
+      (MicroBatcher.submit_async)
+    - простаивающие keep-alive соединения - это только сокеты в event loop
+      uvicorn, без потока на соединение
+
+Запуск (нужен uvicorn; остальные аргументы - как у captcha_api.py):
+    python captcha_asgi.py --host 0.0.0.0 --port 5000 --executor-workers 4
+    python captcha_asgi.py --port 5000 --backend tflite --keep-alive-timeout 120
+    uvicorn captcha_asgi:app --port 5000   # настройки captcha_api.py по умолчанию
+
+Сверка ответов с Flask сервером (без сети, оба приложения в одном процессе):
+    python captcha_asgi.py --compat-check --synthetic 8
+    python captcha_asgi.py --compat-check --images data/images --backend tflite
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import logging
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import HTTP
+
+import numpy as np
+
+import captcha_api
+from captcha_api import metrics, logger
+from binary_protocol import CONTENT_TYPES as BINARY_CONTENT_TYPES, BinaryFormatError, encode_images, encode_tensor
+
+EXECUTOR_WORKERS = 4
+MAX_PENDING = 64                  # Задач в пуле потоков и в очереди к нему
+MAX_BODY_SIZE = 16 * 1024 * 1024  # Байт в теле запроса
+KEEP_ALIVE_TIMEOUT = 75           # Секунд простоя keep-alive соединения
+ROUTES = {
+    '/predict': 'POST',
+    '/predict-batch': 'POST',
+    '/health': 'GET',
+    '/info': 'GET',
+    '/metrics': 'GET',
+}
+
+executor = None
+pending = None
+
+class RequestBodyTooLarge(Exception):
+    pass
+
+class ClientDisconnected(Exception):
+    pass
+
+def setup(executor_workers=EXECUTOR_WORKERS, max_pending=MAX_PENDING):
+    """Пул потоков для разбора тел запросов и инференса"""
+    global executor, pending
+    executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix='captcha-asgi')
+    pending = asyncio.Semaphore(max_pending)
+
+async def run_blocking(fn, *args):
+    """Выполняет fn в пуле потоков, не блокируя event loop"""
+    if executor is None:
+        setup()
+    async with pending:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+def json_response(payload, status=200):
+    # Та же сериализация, что у flask.jsonify: ключи по алфавиту, ASCII, компактно, с переводом строки
+    body = json.dumps(payload, ensure_ascii=True, sort_keys=True, separators=(',', ':')) + '\n'
+    return status, body.encode('utf-8'), 'application/json'
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+def mimetype(scope):
+    return header(scope, b'content-type').split(';', 1)[0].strip().lower()
+
+def is_json(scope):
+    """Как request.is_json во Flask"""
+    content_type = mimetype(scope)
+    return content_type == 'application/json' or (content_type.startswith('application/') and content_type.endswith('+json'))
+
+async def read_body(scope, receive, limit=None):
+    """Читает тело запроса по частям, не блокируя event loop"""
+    limit = MAX_BODY_SIZE if limit is None else limit
+    length = header(scope, b'content-length')
+    if length.isdigit() and int(length) > limit:
+        raise RequestBodyTooLarge()
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise RequestBodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+def parse_multipart_files(body, content_type):
+    """Файлы multipart/form-data: {имя поля: (имя файла, bytes)} (поля без filename - не файлы, как во Flask)"""
+    message = BytesParser(policy=HTTP).parsebytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    files = {}
+    if not message.is_multipart():
+        return files
+    for part in message.iter_parts():
+        filename = part.get_filename()
+        name = part.get_param('name', header='content-disposition')
+        if name and filename is not None and name not in files:
+            files[name] = (filename, part.get_payload(decode=True) or b'')
+    return files
+
+async def infer_one(processed_img):
+    """Результат модели для предобработанного изображения (батч из одного)"""
+    # Micro-batching: ждем результат в event loop, поток пула не занят
+    if captcha_api.batcher is not None:
+        result = await asyncio.wrap_future(captcha_api.batcher.submit_async(processed_img[0]))
+    else:
+        result = (await run_blocking(captcha_api.infer_batch, processed_img))[0]
+    logger.info(f"Предсказание: '{result['prediction']}'")
+    return result
+
+async def predict(scope, receive):
+    body = await read_body(scope, receive)
+    try:
+        # Проверяем что модель загружена
+        if captcha_api.model is None:
+            return json_response({'error': 'Model not loaded'}, 500)
+
+        image_data = None
+
+        # Вариант 1: загруженный файл
+        if mimetype(scope) == 'multipart/form-data':
+            files = await run_blocking(parse_multipart_files, body, header(scope, b'content-type'))
+            if 'image' in files:
+                filename, image_data = files['image']
+                logger.info(f"Получено изображение: {filename} ({len(image_data)} bytes)")
+
+        # Вариант 2: base64 в JSON
+        elif is_json(scope):
+            data = await run_blocking(json.loads, body)
+            if 'image' in data:
+                image_data = await run_blocking(captcha_api.decode_base64, data['image'])
+                logger.info(f"Получено base64 изображение ({len(image_data)} bytes)")
+
+        # Вариант 3: бинарное тело (binary_protocol.py)
+        elif mimetype(scope) in BINARY_CONTENT_TYPES:
+            images, pixels = await run_blocking(captcha_api.read_binary, body, mimetype(scope))
+            count = len(images) if images is not None else len(pixels)
+            if count != 1:
+                return json_response({'error': f'Exactly one image expected, got {count}'}, 400)
+            if pixels is not None:
+                processed_img = await run_blocking(captcha_api.preprocess_pixels, pixels)
+                return json_response({'success': True, **await infer_one(processed_img)})
+            image_data = images[0]
+
+        if image_data is None:
+            return json_response({'error': 'No image provided'}, 400)
+
+        # Повтор тех же байтов - из кеша результатов, без предобработки и модели
+        key, result = captcha_api.lookup_result(image_data)
+        if result is None:
+            processed_img = await run_blocking(captcha_api.preprocess_image, image_data)
+            result = await infer_one(processed_img)
+            captcha_api.cache_result(key, result)
+        return json_response({'success': True, **result})
+
+    except BinaryFormatError as e:
+        return json_response({'error': str(e)}, 400)
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка: {str(e)}")
+        return json_response({'success': False, 'error': str(e)}, 500)
+
+async def predict_batch(scope, receive):
+    body = await read_body(scope, receive)
+    try:
+        if captcha_api.model is None:
+            return json_response({'error': 'Model not loaded'}, 500)
+
+        # Бинарное тело: закодированные изображения или готовый тензор пикселей
+        if mimetype(scope) in BINARY_CONTENT_TYPES:
+            images, pixels = await run_blocking(captcha_api.read_binary, body, mimetype(scope))
+            if pixels is not None:
+                return json_response(await run_blocking(captcha_api.predict_pixels, pixels))
+            return json_response(await run_blocking(captcha_api.predict_images, images, None))
+
+        if not is_json(scope):
+            return json_response({'error': 'JSON expected'}, 400)
+
+        data = await run_blocking(json.loads, body)
+        if 'images' not in data or not isinstance(data['images'], list):
+            return json_response({'error': 'images array expected'}, 400)
+
+        return json_response(await run_blocking(captcha_api.predict_images, data['images']))
+
+    except BinaryFormatError as e:
+        return json_response({'error': str(e)}, 400)
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка batch: {str(e)}")
+        return json_response({'success': False, 'error': str(e)}, 500)
+
+async def health(scope, receive):
+    return json_response(captcha_api.health_payload())
+
+async def info(scope, receive):
+    return json_response(captcha_api.info_payload())
+
+async def prometheus_metrics(scope, receive):
+    return 200, metrics.render().encode('utf-8'), captcha_api.CONTENT_TYPE
+
+HANDLERS = {
+    '/predict': predict,
+    '/predict-batch': predict_batch,
+    '/health': health,
+    '/info': info,
+    '/metrics': prometheus_metrics,
+}
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Запуск через "uvicorn captcha_asgi:app": модель еще не загружена main()
+            if captcha_api.model is None:
+                await asyncio.to_thread(captcha_api.configure, captcha_api.build_parser().parse_args([]))
+            if executor is None:
+                setup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if executor is not None:
+                executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI приложение"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    handler = HANDLERS.get(path)
+    # Метка - маршрут, а не сырой путь: число рядов метрики не растет от 404
+    endpoint = path if handler is not None else 'unmatched'
+    extra_headers = [(b'access-control-allow-origin', b'*')]
+    start = time.perf_counter()
+    metrics.inc('captcha_requests_in_flight')
+    try:
+        if handler is None:
+            status, body, content_type = json_response({'error': 'Not found'}, 404)
+        elif method == 'OPTIONS':
+            # CORS preflight (как flask_cors в captcha_api.py)
+            status, body, content_type = 200, b'', 'text/html; charset=utf-8'
+            extra_headers += [
+                (b'access-control-allow-methods', f"{ROUTES[path]}, OPTIONS".encode()),
+                (b'access-control-allow-headers', header(scope, b'access-control-request-headers').encode('latin-1')),
+            ]
+        elif method != ROUTES[path] and not (method == 'HEAD' and ROUTES[path] == 'GET'):
+            status, body, content_type = json_response({'error': 'Method not allowed'}, 405)
+        else:
+            try:
+                status, body, content_type = await handler(scope, receive)
+            except RequestBodyTooLarge:
+                status, body, content_type = json_response({'error': 'Request body too large'}, 413)
+    except ClientDisconnected:
+        metrics.dec('captcha_requests_in_flight')
+        return
+    except Exception as e:
+        logger.error(f"❌ Ошибка: {e}")
+        status, body, content_type = json_response({'error': 'Internal server error'}, 500)
+
+    metrics.inc('captcha_requests_total', endpoint=endpoint, method=method)
+    if status >= 400:
+        metrics.inc('captcha_request_errors_total', endpoint=endpoint, status=status)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())] + extra_headers,
+    })
+    await send({'type': 'http.response.body', 'body': b'' if method == 'HEAD' else body})
+    metrics.observe('captcha_request_duration_seconds', time.perf_counter() - start, endpoint=endpoint)
+    metrics.dec('captcha_requests_in_flight')
+
+async def call_asgi(method, path, body=b'', content_type=None, chunk_size=4096):
+    """Запрос к app в этом же процессе (тело приходит частями, как от сервера)"""
+    headers = [(b'content-length', str(len(body)).encode())]
+    if content_type:
+        headers.append((b'content-type', content_type.encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': headers,
+        'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80),
+    }
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    headers = {key.decode(): value.decode() for key, value in sent[0]['headers']}
+    return sent[0]['status'], headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+def multipart_body(field, filename, data, boundary='captcha-compat-boundary'):
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: image/png\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def _same(a, b, tolerance=1e-5):
+    """Совпадение JSON (числа - с допуском: micro-batching может собрать разные батчи)"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[key], b[key], tolerance) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_same(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return isinstance(a, (int, float)) and isinstance(b, (int, float)) and abs(a - b) <= tolerance * max(1.0, abs(a))
+    return a == b
+
+def compat_cases(images):
+    """(название, метод, путь, тело, content-type) - типичные и ошибочные запросы"""
+    from PIL import Image
+    encoded = [base64.b64encode(image).decode('ascii') for image in images]
+    multipart, multipart_type = multipart_body('image', 'captcha.png', images[0])
+    pixels = [np.asarray(Image.open(BytesIO(image)).convert('RGB')) for image in images]
+    same_size = [image for image in pixels if image.shape == pixels[0].shape]
+    cases = [
+        ('health', 'GET', '/health', b'', None),
+        ('info', 'GET', '/info', b'', None),
+        ('metrics', 'GET', '/metrics', b'', None),
+        ('predict multipart', 'POST', '/predict', multipart, multipart_type),
+        ('predict base64', 'POST', '/predict', json.dumps({'image': encoded[0]}).encode(), 'application/json'),
+        ('predict data URI', 'POST', '/predict',
+         json.dumps({'image': 'data:image/png;base64,' + encoded[-1]}).encode(), 'application/json'),
+        ('predict без image', 'POST', '/predict', json.dumps({'img': encoded[0]}).encode(), 'application/json'),
+        ('predict битый base64', 'POST', '/predict', json.dumps({'image': '!!bad'}).encode(), 'application/json'),
+        ('predict не картинка', 'POST', '/predict',
+         json.dumps({'image': base64.b64encode(b'not an image').decode()}).encode(), 'application/json'),
+        ('predict text/plain', 'POST', '/predict', b'hello', 'text/plain'),
+        ('predict-batch', 'POST', '/predict-batch', json.dumps({'images': encoded + ['!!bad']}).encode(),
+         'application/json'),
+        ('predict-batch пустой', 'POST', '/predict-batch', json.dumps({'images': []}).encode(), 'application/json'),
+        ('predict-batch без images', 'POST', '/predict-batch', json.dumps({'image': encoded[0]}).encode(),
+         'application/json'),
+        ('predict-batch не JSON', 'POST', '/predict-batch', multipart, multipart_type),
+        ('predict images', 'POST', '/predict', encode_images(images[:1]), 'application/x-captcha-images'),
+        ('predict tensor', 'POST', '/predict', encode_tensor(pixels[0]), 'application/x-captcha-tensor'),
+        ('predict tensor серый', 'POST', '/predict', encode_tensor(pixels[0][..., :1]), 'application/x-captcha-tensor'),
+        ('predict images x2', 'POST', '/predict', encode_images(images[:1] * 2), 'application/x-captcha-images'),
+        ('predict images обрезано', 'POST', '/predict', encode_images(images[:1])[:-1],
+         'application/x-captcha-images'),
+        ('predict-batch images', 'POST', '/predict-batch', encode_images(images + [b'not an image']),
+         'application/x-captcha-images'),
+        ('predict-batch tensor', 'POST', '/predict-batch', encode_tensor(np.stack(same_size)),
+         'application/x-captcha-tensor'),
+        ('predict-batch tensor битый', 'POST', '/predict-batch', encode_tensor(np.stack(same_size))[:-1],
+         'application/x-captcha-tensor'),
+        ('404', 'GET', '/nope', b'', None),
+    ]
+    return cases
+
+def compat_check(images, concurrency=32):
+    """Сравнивает ответы Flask (test client) и ASGI приложения; True - все совпали"""
+    client = captcha_api.app.test_client()
+    ok = True
+
+    async def run_cases():
+        nonlocal ok
+        print(f"{'запрос':>26} | {'Flask':>5} | {'ASGI':>5} | результат")
+        print("-" * 56)
+        for name, method, path, body, content_type in compat_cases(images):
+            flask_response = client.open(path, method=method, data=body,
+                                         headers={'Content-Type': content_type} if content_type else {})
+            # Результат Flask из кеша не должен подменять собственный инференс ASGI
+            if captcha_api.result_cache is not None:
+                captcha_api.result_cache.clear()
+            status, headers, asgi_body = await call_asgi(method, path, body, content_type)
+            same = status == flask_response.status_code
+            if path == '/metrics':
+                same = same and headers['content-type'] == flask_response.content_type
+            else:
+                flask_json, asgi_json = flask_response.get_json(), json.loads(asgi_body)
+                if path == '/health':
+                    # Счетчики micro-batching и кеша растут между запросами: сравниваем только структуру
+                    for section in ('batching', 'cache'):
+                        flask_json[section] = sorted(flask_json[section])
+                        asgi_json[section] = sorted(asgi_json[section])
+                same = same and headers['content-type'] == flask_response.content_type and _same(flask_json, asgi_json)
+            ok = ok and same
+            print(f"{name:>26} | {flask_response.status_code:>5} | {status:>5} | {'OK' if same else 'MISMATCH'}")
+            if not same:
+                print(f"    Flask: {flask_response.get_data(as_text=True)[:300]}")
+                print(f"    ASGI:  {asgi_body.decode('utf-8', 'replace')[:300]}")
+
+        # Одновременные запросы: micro-batching и пул потоков дают те же ответы, что и по одному
+        encoded = [base64.b64encode(image).decode('ascii') for image in images]
+        bodies = [json.dumps({'image': encoded[i % len(encoded)]}).encode() for i in range(concurrency)]
+        expected = [client.post('/predict', data=body, content_type='application/json').get_json() for body in bodies]
+        responses = await asyncio.gather(*(call_asgi('POST', '/predict', body, 'application/json') for body in bodies))
+        same = all(status == 200 and _same(json.loads(body), reference)
+                   for (status, _, body), reference in zip(responses, expected))
+        ok = ok and same
+        print(f"{f'{concurrency} одновременных predict':>26} | {'':>5} | {'':>5} | {'OK' if same else 'MISMATCH'}")
+
+    asyncio.run(run_cases())
+    return ok
+
+def load_images(image_dir=None, synthetic=8, seed=42):
+    """PNG/JPEG bytes из папки или синтетические CAPTCHA"""
+    if image_dir:
+        names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(('.png', '.jpg', '.jpeg')))
+        images = []
+        for name in names[:synthetic or None]:
+            with open(os.path.join(image_dir, name), 'rb') as f:
+                images.append(f.read())
+        return images
+    from PIL import Image
+    from synthetic_captcha import generate_chunk
+    pixels, _ = generate_chunk(0, synthetic, seed)
+    images = []
+    for image in pixels:
+        buffer = BytesIO()
+        Image.fromarray(image).save(buffer, format='PNG')
+        images.append(buffer.getvalue())
+    return images
+
+def main():
+    global MAX_BODY_SIZE
+
+    parser = captcha_api.build_parser()
+    parser.description = 'CAPTCHA OCR REST API Server (ASGI)'
+    parser.add_argument('--executor-workers', type=int, default=EXECUTOR_WORKERS,
+                        help=f'Threads for body parsing, preprocessing and inference (default: {EXECUTOR_WORKERS})')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING,
+                        help=f'Max jobs running or queued in the thread pool (default: {MAX_PENDING})')
+    parser.add_argument('--max-body-mb', type=float, default=MAX_BODY_SIZE / 1024 / 1024,
+                        help='Max request body size in MB, larger requests get 413 (default: 16)')
+    parser.add_argument('--keep-alive-timeout', type=int, default=KEEP_ALIVE_TIMEOUT,
+                        help=f'Close idle keep-alive connections after N seconds (default: {KEEP_ALIVE_TIMEOUT})')
+    parser.add_argument('--compat-check', action='store_true', help='Compare responses with the Flask server and exit')
+    parser.add_argument('--images', default=None, help='Images for --compat-check (default: synthetic)')
+    parser.add_argument('--synthetic', type=int, default=8, help='Number of images for --compat-check')
+    args = parser.parse_args()
+
+    MAX_BODY_SIZE = int(args.max_body_mb * 1024 * 1024)
+    captcha_api.configure(args)
+
+    if args.compat_check:
+        logging.getLogger(captcha_api.__name__).setLevel(logging.WARNING)
+        setup(args.executor_workers, args.max_pending)
+        ok = compat_check(load_images(args.images, args.synthetic))
+        print("\n[OK] Ответы совпадают с Flask" if ok else "\n[ERROR] Ответы отличаются от Flask")
+        sys.exit(0 if ok else 1)
+
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("Для запуска ASGI сервера нужен uvicorn: pip install uvicorn")
+        sys.exit(1)
+
+    setup(args.executor_workers, args.max_pending)
+    print(f"[*] ASGI сервер на http://{args.host}:{args.port} "
+          f"(пул {args.executor_workers} потоков, до {args.max_pending} задач)")
+    uvicorn.run(app, host=args.host, port=args.port, timeout_keep_alive=args.keep_alive_timeout,
+                log_level='debug' if args.debug else 'info')
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@
 import tensorflow as tf
 from tensorflow import keras
 import numpy as np
+from model_metadata import load_metadata, metadata_path, char_mappings
 
 def check_model_alphabet(model_path="output/model.keras"):
     """Проверяет алфавит обученной модели"""
@@ -39,29 +40,20 @@ def check_model_alphabet(model_path="output/model.keras"):
         print(f"❌ Ошибка загрузки модели: {e}")
         return None
 
-def analyze_training_data():
-    """Анализирует данные, на которых обучалась модель"""
-    print("\n📊 Анализ данных обучения...")
+def analyze_model_metadata(model_path="output/model.keras"):
+    """Читает алфавит, сохраненный вместе с моделью (<модель>.meta.json)"""
+    print(f"\n📊 Анализ метаданных модели {metadata_path(model_path)}...")
     
-    # Читаем тестовые данные
     try:
-        with open("data/labels.csv", 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Извлекаем все символы
-        all_chars = set()
-        for line in lines:
-            text = line.split(';')[0].strip()
-            all_chars.update(text)
-        
-        characters = sorted(all_chars)
-        print(f"📝 Символы в данных: {characters}")
+        metadata = load_metadata(model_path)
+        characters = metadata['characters']
+        print(f"📝 Символы модели: {characters}")
         print(f"📊 Количество символов: {len(characters)}")
+        print(f"📐 Изображение: {metadata['img_width']}x{metadata['img_height']}x{metadata['img_channels']}, "
+              f"макс. длина {metadata['max_sequence_length']}, шагов {metadata['time_steps']}")
         
         # Создаем словари как в обучении
-        char_to_num = {v: i for i, v in enumerate(characters)}
-        num_to_char = {str(i): v for i, v in enumerate(characters)}
-        num_to_char['-1'] = 'UKN'
+        char_to_num, num_to_char = char_mappings(metadata)
         
         print(f"📝 Словарь char_to_num: {char_to_num}")
         print(f"📝 Словарь num_to_char: {num_to_char}")
@@ -69,7 +61,7 @@ def analyze_training_data():
         return characters, char_to_num, num_to_char
         
     except Exception as e:
-        print(f"❌ Ошибка анализа данных: {e}")
+        print(f"❌ Ошибка чтения метаданных: {e}")
         return None, None, None
 
 def main():
@@ -79,8 +71,8 @@ def main():
     # Проверяем модель
     model = check_model_alphabet()
     
-    # Анализируем данные
-    characters, char_to_num, num_to_char = analyze_training_data()
+    # Читаем алфавит из метаданных модели
+    characters, char_to_num, num_to_char = analyze_model_metadata()
     
     if model and characters:
         # Сравниваем количество классов
@@ -88,15 +80,15 @@ def main():
         expected_units = len(characters) + 1  # +1 для CTC blank
         
         print(f"\n🔍 Сравнение:")
-        print(f"   Символов в данных: {len(characters)}")
+        print(f"   Символов в метаданных: {len(characters)}")
         print(f"   Ожидаемых выходов: {expected_units}")
         print(f"   Фактических выходов: {last_layer_units}")
         
         if last_layer_units == expected_units:
-            print("✅ Количество выходов соответствует данным!")
+            print("✅ Количество выходов соответствует метаданным!")
         else:
             print("❌ Несоответствие количества выходов!")
-            print("   Возможно, модель обучалась на других данных")
+            print("   Метаданные не относятся к этой модели")
     
     print(f"\n📝 Правильный алфавит для predict.py:")
     if characters:
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CTC декодер на чистом NumPy
+Используется в predict.py и captcha_api.py вместо tf.keras.backend.ctc_decode.
+
+Greedy декодирование для всего батча сразу: argmax по классам, схлопывание
+повторов и удаление blank через маски, перевод индексов в символы через
+массив-таблицу (без строковых ключей и поэлементных .numpy()).
+
+Опционально - prefix beam search с ограничением ширины луча, порогом
+отсечения маловероятных символов и максимальной длиной строки. Возвращает
+top-k строк с log-вероятностями и уверенностью по каждому символу.
+
+Бенчмарки:
+    python ctc_decoder.py --benchmark                 # greedy против TF
+    python ctc_decoder.py --benchmark-beam            # задержка beam search по ширине луча
+"""
+
+import argparse
+import math
+import time
+import numpy as np
+
+# Ограничение длины строки при beam search (как в train.py)
+MAX_SEQUENCE_LENGTH = 7
+DEFAULT_BEAM_WIDTH = 8
+DEFAULT_PRUNE_THRESHOLD = 1e-3
+
+def build_lookup(num_to_char, num_classes=None):
+    """Строит массив index -> символ из словаря num_to_char (ключи - строки)"""
+    indices = [int(key) for key in num_to_char if int(key) >= 0]
+    size = max(num_classes or 0, max(indices, default=-1) + 1)
+    lookup = np.full(size, '', dtype=object)
+    for key, char in num_to_char.items():
+        idx = int(key)
+        if idx >= 0 and char != 'UKN':
+            lookup[idx] = char
+    return lookup
+
+def _pad_lookup(lookup, num_classes):
+    """Дополняет таблицу пустыми символами до числа классов модели"""
+    if len(lookup) < num_classes:
+        lookup = np.concatenate([lookup, np.full(num_classes - len(lookup), '', dtype=object)])
+    return lookup
+
+def greedy_decode(predictions, lookup, return_confidences=False):
+    """
+    Greedy CTC декодирование батча предсказаний (batch, time_steps, num_classes).
+    Blank - последний класс, как в tf.keras.backend.ctc_decode.
+
+    С return_confidences=True дополнительно возвращает для каждой строки
+    список уверенностей символов (максимум вероятности по кадрам символа).
+    """
+    predictions = np.asarray(predictions)
+    num_classes = predictions.shape[-1]
+    lookup = _pad_lookup(lookup, num_classes)
+
+    best = np.argmax(predictions, axis=-1)
+
+    # Оставляем первый элемент каждой серии повторов и убираем blank
+    keep = best != num_classes - 1
+    keep[:, 1:] &= best[:, 1:] != best[:, :-1]
+
+    chars = np.where(keep, lookup[best], '')
+    texts = [''.join(row) for row in chars]
+    if not return_confidences:
+        return texts
+
+    best_probs = np.max(predictions, axis=-1)
+    run_starts = np.ones_like(best, dtype=bool)
+    run_starts[:, 1:] = best[:, 1:] != best[:, :-1]
+    confidences = []
+    for row_best, row_probs, row_starts, row_keep in zip(best, best_probs, run_starts, keep):
+        starts = np.flatnonzero(row_starts)
+        run_max = np.maximum.reduceat(row_probs, starts)
+        run_keep = row_keep[starts] & (lookup[row_best[starts]] != '')
+        confidences.append([float(p) for p in run_max[run_keep]])
+    return texts, confidences
+
+def _log_add(a, b):
+    """log(exp(a) + exp(b)) для скаляров"""
+    if a == -math.inf:
+        return b
+    if b == -math.inf:
+        return a
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+def beam_search_decode(probs, lookup, beam_width=DEFAULT_BEAM_WIDTH,
+                       prune_threshold=DEFAULT_PRUNE_THRESHOLD,
+                       max_length=MAX_SEQUENCE_LENGTH, top_k=1):
+    """
+    Prefix beam search для одного примера probs (time_steps, num_classes).
+
+    На каждом шаге рассматриваются только символы с вероятностью не ниже
+    prune_threshold, префиксы длиннее max_length не строятся, в луче остается
+    beam_width лучших префиксов. Возвращает top_k кандидатов:
+    [{'text', 'log_prob', 'char_confidences'}, ...] по убыванию log_prob.
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    num_classes = probs.shape[-1]
+    blank = num_classes - 1
+    lookup = _pad_lookup(lookup, num_classes)
+    log_probs = np.log(np.maximum(probs, 1e-30))
+    neg_inf = -math.inf
+
+    # префикс -> [log P(заканчивается blank), log P(заканчивается символом)]
+    beams = {(): [0.0, neg_inf]}
+    confidences = {(): ()}
+
+    def score(item):
+        return _log_add(*item[1])
+
+    for t in range(probs.shape[0]):
+        step = log_probs[t].tolist()
+        step_probs = probs[t].tolist()
+        candidates = [int(c) for c in np.flatnonzero(probs[t] >= prune_threshold) if c != blank]
+        next_beams = {}
+        next_confidences = {}
+
+        def add(prefix, index, value, conf):
+            entry = next_beams.get(prefix)
+            if entry is None:
+                entry = next_beams[prefix] = [neg_inf, neg_inf]
+                next_confidences[prefix] = conf
+            else:
+                next_confidences[prefix] = tuple(max(a, b) for a, b in zip(next_confidences[prefix], conf))
+            entry[index] = _log_add(entry[index], value)
+
+        for prefix, (p_blank, p_char) in beams.items():
+            total = _log_add(p_blank, p_char)
+            conf = confidences[prefix]
+
+            # blank: префикс не меняется
+            add(prefix, 0, total + step[blank], conf)
+
+            for c in candidates:
+                if prefix and c == prefix[-1]:
+                    # Повтор без blank схлопывается в тот же символ
+                    if p_char != neg_inf:
+                        add(prefix, 1, p_char + step[c], conf[:-1] + (max(conf[-1], step_probs[c]),))
+                    source = p_blank
+                else:
+                    source = total
+                if len(prefix) >= max_length or source == neg_inf:
+                    continue
+                add(prefix + (c,), 1, source + step[c], conf + (step_probs[c],))
+
+        beams = dict(sorted(next_beams.items(), key=score, reverse=True)[:beam_width])
+        confidences = {prefix: next_confidences[prefix] for prefix in beams}
+
+    results = []
+    for prefix, (p_blank, p_char) in sorted(beams.items(), key=score, reverse=True)[:top_k]:
+        results.append({
+            'text': ''.join(lookup[c] for c in prefix),
+            'log_prob': _log_add(p_blank, p_char),
+            'char_confidences': [float(p) for c, p in zip(prefix, confidences[prefix]) if lookup[c] != '']
+        })
+    return results
+
+def beam_search_decode_batch(predictions, lookup, **options):
+    """beam_search_decode для каждого примера батча"""
+    return [beam_search_decode(probs, lookup, **options) for probs in np.asarray(predictions)]
+
+def _reference_decode(predictions, num_to_char):
+    """Старый путь через tf.keras.backend.ctc_decode (для сравнения)"""
+    import tensorflow as tf
+
+    input_len = np.ones(predictions.shape[0]) * predictions.shape[1]
+    results = tf.keras.backend.ctc_decode(predictions, input_length=input_len, greedy=True)[0][0]
+
+    texts = []
+    for result in results:
+        text = ""
+        for idx in result:
+            if idx != -1:
+                char = num_to_char.get(str(idx.numpy()), '')
+                if char != 'UKN':
+                    text += char
+        texts.append(text)
+    return texts
+
+def _synthetic_predictions(batch_size, time_steps, num_classes, rng):
+    """Softmax-выходы, похожие на выходы обученной модели (пики на символах и blank)"""
+    logits = rng.normal(0.0, 1.0, size=(batch_size, time_steps, num_classes))
+    blank = num_classes - 1
+    logits[:, :, blank] += 8.0
+    for b in range(batch_size):
+        length = rng.integers(4, 8)
+        positions = np.sort(rng.choice(np.arange(2, time_steps - 2, 6), size=length, replace=False))
+        for t in positions:
+            logits[b, t:t + 2, rng.integers(0, blank)] += rng.uniform(9.0, 14.0)
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return (exp / exp.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+def _time_call(fn, repeats):
+    """Среднее время вызова в миллисекундах (после одного прогревочного вызова)"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000.0
+
+def benchmark(batch_sizes, repeats, time_steps=50, seed=42):
+    """Сравнивает NumPy декодер со старым TF путем: совпадение и время"""
+    characters = sorted(set('абвгдежзийклмнопрстуфхцчшщъыьэюя0123456789'))
+    num_to_char = {str(i): v for i, v in enumerate(characters)}
+    num_to_char['-1'] = 'UKN'
+    num_classes = len(characters) + 1
+    lookup = build_lookup(num_to_char, num_classes)
+    rng = np.random.default_rng(seed)
+
+    print(f"{'batch':>6} | {'tf ctc_decode, ms':>18} | {'numpy greedy, ms':>17} | {'speedup':>8} | match")
+    print("-" * 68)
+    for batch_size in batch_sizes:
+        predictions = _synthetic_predictions(batch_size, time_steps, num_classes, rng)
+
+        expected = _reference_decode(predictions, num_to_char)
+        actual = greedy_decode(predictions, lookup)
+        match = expected == actual
+
+        tf_ms = _time_call(lambda: _reference_decode(predictions, num_to_char), repeats)
+        np_ms = _time_call(lambda: greedy_decode(predictions, lookup), repeats)
+        print(f"{batch_size:>6} | {tf_ms:>18.3f} | {np_ms:>17.3f} | {tf_ms / np_ms:>7.1f}x | {'OK' if match else 'MISMATCH'}")
+        if not match:
+            raise SystemExit(f"[ERROR] Результаты не совпадают для batch={batch_size}")
+
+def benchmark_beam(beam_widths, repeats, prune_threshold=DEFAULT_PRUNE_THRESHOLD,
+                   batch_size=32, time_steps=50, seed=42):
+    """Задержка beam search на одно изображение в зависимости от ширины луча"""
+    characters = sorted(set('абвгдежзийклмнопрстуфхцчшщъыьэюя0123456789'))
+    num_to_char = {str(i): v for i, v in enumerate(characters)}
+    num_classes = len(characters) + 1
+    lookup = build_lookup(num_to_char, num_classes)
+    rng = np.random.default_rng(seed)
+    predictions = _synthetic_predictions(batch_size, time_steps, num_classes, rng)
+
+    greedy_texts = greedy_decode(predictions, lookup)
+    greedy_ms = _time_call(lambda: greedy_decode(predictions, lookup, return_confidences=True), repeats) / batch_size
+
+    print(f"prune_threshold={prune_threshold}, batch={batch_size}, time_steps={time_steps}")
+    print(f"{'decoder':>10} | {'ms / image':>11} | {'p99 ms / image':>15} | same top-1 as greedy")
+    print("-" * 66)
+    print(f"{'greedy':>10} | {greedy_ms:>11.3f} | {'-':>15} | -")
+    for beam_width in beam_widths:
+        options = dict(beam_width=beam_width, prune_threshold=prune_threshold)
+        beam_search_decode_batch(predictions, lookup, **options)
+        per_image = []
+        for _ in range(repeats):
+            for probs in predictions:
+                start = time.perf_counter()
+                beam_search_decode(probs, lookup, **options)
+                per_image.append((time.perf_counter() - start) * 1000.0)
+        top1 = [candidates[0]['text'] for candidates in beam_search_decode_batch(predictions, lookup, **options)]
+        agree = sum(a == b for a, b in zip(top1, greedy_texts)) / batch_size * 100
+        print(f"{'beam=' + str(beam_width):>10} | {np.mean(per_image):>11.3f} | "
+              f"{np.percentile(per_image, 99):>15.3f} | {agree:.0f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='NumPy CTC decoder')
+    parser.add_argument('--benchmark', action='store_true', help='Сравнить с tf.keras.backend.ctc_decode')
+    parser.add_argument('--benchmark-beam', action='store_true', help='Задержка beam search по ширине луча')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 128], help='Размеры батчей')
+    parser.add_argument('--beam-widths', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32], help='Ширины луча')
+    parser.add_argument('--prune-threshold', type=float, default=DEFAULT_PRUNE_THRESHOLD,
+                        help='Порог отсечения символов при beam search')
+    parser.add_argument('--repeats', type=int, default=20, help='Повторов на замер')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.batch_sizes, args.repeats)
+    if args.benchmark_beam:
+        benchmark_beam(args.beam_widths, args.repeats, args.prune_threshold)
+    if not (args.benchmark or args.benchmark_beam):
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш предобработанного датасета для train.py
+
+Один раз декодирует все изображения (по умолчанию уже транспонированные в
+(width, height, channels)) в компактные uint8 шарды .npy и сохраняет
+закодированные и дополненные метки. Кеш лежит в папке, имя которой -
+отпечаток labels.csv, списка файлов (размеры и mtime) и параметров
+предобработки, поэтому пересобирается только при их изменении.
+
+Следующие запуски открывают шарды через np.load(mmap_mode='r'): данные
+не копируются в память целиком, читаются только нужные батчи.
+
+    cache/<fingerprint>/
+        images_00000.npy, images_00001.npy, ...   uint8 (N, W, H, C) или (N, H, W, C)
+        labels.npy                                int32 (N, MAX_SEQUENCE_LENGTH)
+        meta.json
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import tensorflow as tf
+
+CACHE_VERSION = 1
+SHARD_SIZE = 50000  # Изображений в одном шарде (~1.8 GB при 200x60x3)
+
+def dataset_fingerprint(labels_file, paths, params):
+    """Отпечаток датасета: содержимое labels.csv, размеры/mtime файлов и параметры предобработки"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'cache_version': CACHE_VERSION, **params}, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    with open(labels_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()[:20]
+
+class CachedDataset:
+    """Шарды изображений, открытые через mmap, и метки"""
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.shard_size = self.meta['shard_size']
+        self.shards = [np.load(os.path.join(cache_dir, name), mmap_mode='r') for name in self.meta['shards']]
+        self.labels = np.load(os.path.join(cache_dir, 'labels.npy'))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def gather(self, indices):
+        """Собирает батч изображений по индексам (копируются только эти изображения)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        first = self.shards[0]
+        batch = np.empty((len(indices),) + first.shape[1:], dtype=first.dtype)
+        shard_ids, offsets = np.divmod(indices, self.shard_size)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            batch[mask] = self.shards[shard_id][offsets[mask]]
+        return batch
+
+def _decode_uint8(img_path, image_shape, transpose):
+    """Декодирование как в encode_single_sample из train.py"""
+    img = tf.io.read_file(img_path)
+    img = tf.io.decode_image(img, channels=image_shape[-1], expand_animations=False)
+    if transpose:
+        img = tf.transpose(img, perm=[1, 0, 2])  # (width, height, channels)
+    return tf.ensure_shape(img, image_shape)
+
+def build_cache(cache_dir, paths, labels, image_shape, transpose, fingerprint, shard_size=SHARD_SIZE,
+                replace_existing=True):
+    """
+    Декодирует все изображения в uint8 шарды (параллельно через tf.data).
+    replace_existing=False: если кеш успел собрать другой процесс (воркер
+    распределенного обучения на той же машине), используется его кеш.
+    """
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    count = len(paths)
+    shard_names = [f"images_{i:05d}.npy" for i in range((count + shard_size - 1) // shard_size)]
+    shards = [
+        np.lib.format.open_memmap(
+            os.path.join(tmp_dir, name), mode='w+', dtype=np.uint8,
+            shape=(min(shard_size, count - i * shard_size),) + tuple(image_shape)
+        )
+        for i, name in enumerate(shard_names)
+    ]
+
+    dataset = tf.data.Dataset.from_tensor_slices(np.asarray(paths))
+    dataset = dataset.map(lambda p: _decode_uint8(p, image_shape, transpose),
+                          num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    dataset = dataset.batch(256).prefetch(tf.data.AUTOTUNE)
+
+    position = 0
+    for step, batch in enumerate(dataset.as_numpy_iterator(), 1):
+        written = 0
+        while written < len(batch):
+            shard_id, offset = divmod(position, shard_size)
+            size = min(len(batch) - written, shard_size - offset)
+            shards[shard_id][offset:offset + size] = batch[written:written + size]
+            written += size
+            position += size
+        if step % 40 == 0:
+            print(f"Кеш: декодировано {position}/{count} изображений...")
+    for shard in shards:
+        shard.flush()
+    del shards
+
+    np.save(os.path.join(tmp_dir, 'labels.npy'), np.asarray(labels, dtype=np.int32))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': CACHE_VERSION,
+            'fingerprint': fingerprint,
+            'count': count,
+            'shape': list(image_shape),
+            'transposed': transpose,
+            'shard_size': shard_size,
+            'shards': shard_names,
+        }, f, indent=2)
+
+    # Кеш появляется атомарно: прерванная сборка не оставит битую папку
+    if replace_existing:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # Папка уже собрана другим процессом
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def get_or_build_cache(cache_root, labels_file, paths, labels, image_shape, transpose=True,
+                       params=None, rebuild=False):
+    """
+    Открывает кеш для текущего отпечатка датасета или собирает его.
+    image_shape - форма одного изображения в кеше (после транспонирования, если transpose=True).
+    """
+    image_shape = tuple(int(d) for d in image_shape)
+    params = dict(params or {}, image_shape=list(image_shape), transpose=transpose,
+                  label_shape=list(np.shape(labels)))
+    fingerprint = dataset_fingerprint(labels_file, paths, params)
+    cache_dir = os.path.join(cache_root, fingerprint)
+
+    if rebuild or not os.path.exists(os.path.join(cache_dir, 'meta.json')):
+        print(f"Собираем кеш датасета в {cache_dir} ({len(paths)} изображений)...")
+        os.makedirs(cache_root, exist_ok=True)
+        build_cache(cache_dir, paths, labels, image_shape, transpose, fingerprint, replace_existing=rebuild)
+    else:
+        print(f"Используем кеш датасета {cache_dir}")
+
+    return CachedDataset(cache_dir)
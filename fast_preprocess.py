@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Предобработка изображений без TensorFlow (OpenCV + NumPy)
+
+Вместо цепочки eager операций TF (decode_image, resize, transpose,
+expand_dims, .numpy()) на каждое изображение: cv2.imdecode, при
+необходимости cv2.resize, и одна копия с переворотом BGR -> RGB и
+транспонированием прямо в слот заранее выделенного батч-буфера модели.
+Результат - тот же uint8 вход, что у preprocess_image в captcha_api.py
+и predict.py (resize - bilinear с half-pixel centers, как tf.image.resize;
+после округления пиксели отличаются не больше чем на 1).
+
+PNG, BMP и GIF декодируются так же, как tf.io.decode_image. JPEG OpenCV
+декодирует точным IDCT, а tf.io.decode_image - быстрым (INTEGER_FAST): на
+JPEG допуск свой, JPEG_TOLERANCE. Его хватает для обычного качества (до ~75);
+JPEG высокого качества отличается сильнее (быстрый IDCT TF теряет точность,
+при качестве 100 - вплоть до 255), и --check считает его несовпадением.
+
+Выбор в скриптах:
+    python captcha_api.py --preprocess cv2
+    python predict.py --folder images --preprocess cv2
+
+Сверка с TF путем и замер стоимости на изображение:
+    python fast_preprocess.py --check --images data/images
+    python fast_preprocess.py --benchmark --batch-sizes 1 32
+"""
+
+import os
+import sys
+import time
+import argparse
+from io import BytesIO
+
+import cv2
+import numpy as np
+
+IMG_WIDTH = 200
+IMG_HEIGHT = 60
+TOLERANCE = 1  # Допустимое отличие пикселя от TF пути (uint8)
+JPEG_TOLERANCE = 4  # То же для JPEG: точный IDCT OpenCV против быстрого в tf.io.decode_image
+# Как tf.io.decode_image: 3 канала, 8 бит, без поворота по EXIF
+IMREAD_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+
+def input_shape(img_width=IMG_WIDTH, img_height=IMG_HEIGHT, layout='WHC'):
+    """Форма одного изображения на входе модели"""
+    return (img_width, img_height, 3) if layout == 'WHC' else (img_height, img_width, 3)
+
+def allocate(batch_size, img_width=IMG_WIDTH, img_height=IMG_HEIGHT, layout='WHC'):
+    """Батч-буфер для preprocess_into / preprocess_batch"""
+    return np.empty((batch_size,) + input_shape(img_width, img_height, layout), dtype=np.uint8)
+
+def decode_image(data):
+    """bytes PNG/JPEG/BMP/... -> uint8 (H, W, 3) в порядке BGR"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), IMREAD_FLAGS) if len(data) else None
+    if image is None:
+        # GIF OpenCV не читает: первый кадр через PIL (как tf.io.decode_image с expand_animations=False)
+        from PIL import Image
+        try:
+            with Image.open(BytesIO(data)) as pil_image:
+                image = np.asarray(pil_image.convert('RGB'))[..., ::-1]
+        except Exception:
+            raise ValueError("Неизвестный формат изображения (нужен PNG, JPEG, BMP, GIF, WebP, ...)") from None
+    return image
+
+def resize_into(image, out, layout='WHC'):
+    """BGR (H, W, 3) -> слот out: размер модели, RGB, раскладка layout - одной копией"""
+    target = out.transpose(1, 0, 2) if layout == 'WHC' else out
+    height, width = target.shape[:2]
+    if image.shape[:2] != (height, width):
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+    np.copyto(target, image[..., ::-1])
+    return out
+
+def preprocess_into(data, out, layout='WHC'):
+    """Закодированное изображение -> слот out батч-буфера (форма input_shape)"""
+    return resize_into(decode_image(data), out, layout)
+
+def preprocess_batch(images, img_width=IMG_WIDTH, img_height=IMG_HEIGHT, layout='WHC', out=None):
+    """Список закодированных изображений -> uint8 батч; out - переиспользуемый буфер (не меньше len(images))"""
+    if out is None:
+        out = allocate(len(images), img_width, img_height, layout)
+    out = out[:len(images)]
+    for i, data in enumerate(images):
+        preprocess_into(data, out[i], layout)
+    return out
+
+def encode(pixels, image_format='PNG', size=None, mode=None):
+    """uint8 RGB -> bytes изображения (для --check и --benchmark)"""
+    from PIL import Image
+    image = Image.fromarray(pixels)
+    if size is not None:
+        image = image.resize(size)
+    if mode is not None:
+        image = image.convert(mode)
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+def check_images(image_dir=None, count=8, seed=42):
+    """(название, bytes): изображения нужного размера, другого размера и других форматов"""
+    if image_dir:
+        names = sorted(name for name in os.listdir(image_dir)
+                       if name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')))
+        cases = []
+        for name in names[:count]:
+            with open(os.path.join(image_dir, name), 'rb') as f:
+                cases.append((name, f.read()))
+        return cases
+    from synthetic_captcha import generate_chunk
+    pixels, _ = generate_chunk(0, count, seed)
+    cases = [(f"synthetic {i} png", encode(image)) for i, image in enumerate(pixels)]
+    cases += [
+        ('jpeg', encode(pixels[0], 'JPEG')),
+        ('bmp', encode(pixels[0], 'BMP')),
+        ('gif', encode(pixels[0], 'GIF')),
+        ('серый png', encode(pixels[0], mode='L')),
+        ('rgba png', encode(pixels[0], mode='RGBA')),
+        ('меньше 150x45', encode(pixels[1], size=(150, 45))),
+        ('больше 400x120', encode(pixels[1], size=(400, 120))),
+        ('другие пропорции 320x64', encode(pixels[2], size=(320, 64))),
+        ('jpeg 230x70', encode(pixels[3], 'JPEG', size=(230, 70))),
+    ]
+    return cases
+
+def tf_preprocess(layout):
+    """TF путь captcha_api.preprocess_image (эталон для сверки)"""
+    import logging
+    import captcha_api
+    logging.getLogger(captcha_api.__name__).setLevel(logging.WARNING)
+    captcha_api.INPUT_LAYOUT = layout
+    captcha_api.PREPROCESSOR = 'tf'
+    return captcha_api.preprocess_image
+
+def check(cases, layout='WHC', tolerance=TOLERANCE, jpeg_tolerance=JPEG_TOLERANCE):
+    """Сравнивает с TF путем (captcha_api.preprocess_image) попиксельно; True - все в пределах допуска"""
+    reference = tf_preprocess(layout)
+    ok = True
+    print(f"{'изображение':>26} | {'max diff':>8} | {'mean diff':>9} | {'>0, %':>6} | {'допуск':>6} | результат")
+    print("-" * 77)
+    for name, data in cases:
+        expected = reference(data)
+        actual = preprocess_batch([data], layout=layout)
+        if actual.shape != expected.shape:
+            ok = False
+            print(f"{name:>26} | форма {actual.shape} вместо {expected.shape} | MISMATCH")
+            continue
+        limit = jpeg_tolerance if data[:2] == b'\xff\xd8' else tolerance
+        diff = np.abs(actual.astype(np.int16) - expected.astype(np.int16))
+        same = int(diff.max()) <= limit
+        ok = ok and same
+        print(f"{name:>26} | {int(diff.max()):>8} | {diff.mean():>9.4f} | {np.mean(diff > 0) * 100:>6.2f} | "
+              f"{limit:>6} | {'OK' if same else 'MISMATCH'}")
+    return ok
+
+def timed_per_image(fn, batch_size, repeats):
+    """Медиана времени вызова fn, мс на изображение"""
+    fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(samples)) / batch_size
+
+def benchmark(cases, batch_sizes, layout='WHC', repeats=20):
+    """Стоимость на изображение: TF путь (+ склейка батча) против cv2 в переиспользуемый буфер"""
+    reference = tf_preprocess(layout)
+    groups = {
+        'размер модели': [data for name, data in cases if name.startswith('synthetic')] or [cases[0][1]],
+        'нужен resize': [encode(decode_image(data)[..., ::-1], size=(300, 90)) for _, data in cases[:4]],
+    }
+    print(f"{'изображения':>14} | {'batch':>5} | {'tf, мс/изобр.':>13} | {'cv2, мс/изобр.':>14} | ускорение")
+    print("-" * 68)
+    for group, images in groups.items():
+        for batch_size in batch_sizes:
+            batch = [images[i % len(images)] for i in range(batch_size)]
+            buffer = allocate(batch_size, layout=layout)
+            tf_ms = timed_per_image(lambda: np.concatenate([reference(data) for data in batch]), batch_size, repeats)
+            cv2_ms = timed_per_image(lambda: preprocess_batch(batch, layout=layout, out=buffer), batch_size, repeats)
+            print(f"{group:>14} | {batch_size:>5} | {tf_ms:>13.3f} | {cv2_ms:>14.3f} | x{tf_ms / cv2_ms:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Предобработка OpenCV/NumPy: сверка с TF путем и бенчмарк')
+    parser.add_argument('--check', action='store_true', help='Сравнить с TF путем captcha_api.preprocess_image')
+    parser.add_argument('--benchmark', action='store_true', help='Замерить стоимость на изображение (TF и cv2)')
+    parser.add_argument('--images', default=None, help='Папка с изображениями (по умолчанию: синтетические)')
+    parser.add_argument('--count', type=int, default=8, help='Сколько изображений взять')
+    parser.add_argument('--layout', choices=['WHC', 'HWC'], default='WHC', help='Раскладка входа модели')
+    parser.add_argument('--tolerance', type=int, default=TOLERANCE, help='Допустимое отличие пикселя для --check')
+    parser.add_argument('--jpeg-tolerance', type=int, default=JPEG_TOLERANCE,
+                        help='Допустимое отличие пикселя JPEG для --check')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32], help='Батчи для --benchmark')
+    parser.add_argument('--repeats', type=int, default=20, help='Повторов замера для --benchmark')
+    args = parser.parse_args()
+
+    if not args.check and not args.benchmark:
+        parser.error("нужен --check и/или --benchmark")
+    cases = check_images(args.images, args.count)
+    if not cases:
+        parser.error(f"нет изображений в {args.images}")
+
+    if args.benchmark:
+        benchmark(cases, args.batch_sizes, args.layout, args.repeats)
+    if args.check:
+        if args.benchmark:
+            print()
+        ok = check(cases, args.layout, args.tolerance, args.jpeg_tolerance)
+        print(f"\n[OK] Совпадает с TF путем (±{args.tolerance}, JPEG ±{args.jpeg_tolerance})" if ok
+              else "\n[ERROR] Отличие от TF пути больше допуска")
+        sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бэкенды инференса для predict.py и captcha_api.py
+
+    keras       - keras.models.load_model (output/model.keras)
+    saved_model - tf.saved_model.load (output/model, экспорт из train.py)
+    tflite      - tf.lite.Interpreter (output/model.tflite)
+
+Все бэкенды принимают батч (batch, width, height, channels) и возвращают
+выход softmax (batch, time_steps, num_classes).
+
+Новые модели из train.py принимают uint8 (0..255) и нормализуют внутри,
+старые экспортированные модели - float32 (0..1). Бэкенд знает тип входа
+модели (input_dtype) и сам приводит к нему батч через prepare_input,
+поэтому вызывающий код может всегда передавать uint8.
+
+Keras модель вызывается через tf.function с фиксированной сигнатурой
+(любой размер батча, фиксированный размер изображения): граф трассируется
+один раз, без data adapter и итератора model.predict на каждый вызов.
+warmup() прогоняет пустые батчи частых размеров при старте, чтобы первый
+запрос не платил за трассировку и выделение памяти.
+"""
+
+import time
+import threading
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+BACKENDS = ('keras', 'saved_model', 'tflite')
+
+# Пути к моделям по умолчанию для каждого бэкенда
+DEFAULT_MODEL_PATHS = {
+    'keras': 'final-results/output/model.keras',
+    'saved_model': 'final-results/output/model',
+    'tflite': 'final-results/output/model.tflite',
+}
+
+# Размеры батчей для прогрева при старте (одиночный /predict и типичные micro-batch)
+WARMUP_BATCH_SIZES = (1, 8, 32)
+
+def prepare_input(images, input_dtype):
+    """Приводит батч к типу входа модели: uint8 (0..255) <-> float32 (0..1)"""
+    images = np.asarray(images)
+    if images.dtype == input_dtype:
+        return images
+    if input_dtype == np.uint8:
+        # Старый float вход (0..1) для uint8 модели
+        return np.clip(np.rint(images * 255.0), 0, 255).astype(np.uint8)
+    if images.dtype == np.uint8:
+        # uint8 вход для старой float модели
+        return images.astype(input_dtype) / np.asarray(255.0, dtype=input_dtype)
+    return images.astype(input_dtype)
+
+class KerasBackend:
+    """Полная Keras модель"""
+    name = 'keras'
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.model = keras.models.load_model(model_path)
+        self.num_classes = int(self.model.output_shape[-1])
+        self.input_dtype = np.dtype(tf.as_dtype(self.model.inputs[0].dtype).as_numpy_dtype)
+        self.input_shape = tuple(self.model.inputs[0].shape[1:])
+        # Одна трассировка на все размеры батча; model.predict строил бы итератор на каждый вызов.
+        # autograph=False: вызов Keras модели не нуждается в конвертации Python кода
+        self._predict = tf.function(
+            self._call, autograph=False,
+            input_signature=[tf.TensorSpec((None,) + self.input_shape, self.input_dtype)],
+        )
+
+    def _call(self, images):
+        return self.model(images, training=False)
+
+    def predict(self, images):
+        return self._predict(tf.constant(prepare_input(images, self.input_dtype))).numpy()
+
+class SavedModelBackend:
+    """SavedModel, экспортированный через prediction_model.export()"""
+    name = 'saved_model'
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.model = tf.saved_model.load(model_path)
+        self._fn = getattr(self.model, 'serve', None) or self.model.signatures['serving_default']
+        signature = self.model.signatures['serving_default']
+        spec = signature.structured_outputs
+        if isinstance(spec, dict):
+            spec = next(iter(spec.values()))
+        self.num_classes = int(spec.shape[-1])
+        input_spec = tf.nest.flatten(signature.structured_input_signature)[0]
+        self.input_dtype = np.dtype(input_spec.dtype.as_numpy_dtype)
+        self.input_shape = tuple(input_spec.shape[1:])
+
+    def predict(self, images):
+        outputs = self._fn(tf.constant(prepare_input(images, self.input_dtype)))
+        if isinstance(outputs, dict):
+            outputs = next(iter(outputs.values()))
+        return outputs.numpy()
+
+class TFLiteBackend:
+    """
+    TensorFlow Lite интерпретатор.
+
+    Тензоры интерпретатора выделяются один раз под размер батча и
+    переиспользуются; при другом размере батча входной тензор
+    перевыделяется через resize_tensor_input. Для полностью целочисленных
+    (int8) моделей вход квантуется из float (0..1), а выход деквантуется
+    по параметрам тензоров.
+    """
+    name = 'tflite'
+
+    def __init__(self, model_path=None, num_threads=None, model_content=None):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, model_content=model_content,
+                                               num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._tensor_dtype = np.dtype(self._input['dtype'])
+        # Для int8 входа модель "видит" float, который квантуется в _quantize_input
+        self.input_dtype = np.dtype(np.float32) if self._is_quantized_input() else self._tensor_dtype
+        self.num_classes = int(self._output['shape'][-1])
+        self.input_shape = tuple(int(size) for size in self._input['shape'][1:])
+        self._batch_size = None
+        # Интерпретатор не потокобезопасен (batcher и /predict-batch работают из разных потоков)
+        self._lock = threading.Lock()
+
+    def _ensure_batch_size(self, batch_size):
+        """Перевыделяет тензоры только при смене размера батча"""
+        if batch_size != self._batch_size:
+            shape = [batch_size] + list(self._input['shape'][1:])
+            self.interpreter.resize_tensor_input(self._input['index'], shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = batch_size
+
+    def _is_quantized_input(self):
+        scale, _ = self._input['quantization']
+        return self._tensor_dtype.kind == 'i' and bool(scale)
+
+    def _quantize_input(self, images):
+        if not self._is_quantized_input():
+            return images
+        scale, zero_point = self._input['quantization']
+        info = np.iinfo(self._tensor_dtype)
+        return np.clip(np.round(images / scale + zero_point), info.min, info.max).astype(self._tensor_dtype)
+
+    def _dequantize_output(self, outputs):
+        scale, zero_point = self._output['quantization']
+        if np.dtype(self._output['dtype']).kind != 'i' or not scale:
+            return outputs
+        return (outputs.astype(np.float32) - zero_point) * scale
+
+    def predict(self, images):
+        images = self._quantize_input(prepare_input(images, self.input_dtype))
+        with self._lock:
+            self._ensure_batch_size(len(images))
+            # Пишем прямо во входной буфер интерпретатора (без промежуточной копии)
+            self.interpreter.tensor(self._input['index'])()[...] = images
+            self.interpreter.invoke()
+            outputs = self.interpreter.get_tensor(self._output['index'])
+        return self._dequantize_output(outputs)
+
+def warmup(backend, batch_sizes=WARMUP_BATCH_SIZES, repeats=3):
+    """
+    Прогревает бэкенд пустыми uint8 батчами.
+    Возвращает [{'batch_size', 'first_call_ms', 'steady_state_ms'}, ...]:
+    время первого вызова и медиану следующих repeats вызовов.
+    """
+    stats = []
+    for batch_size in batch_sizes:
+        images = np.zeros((batch_size,) + backend.input_shape, dtype=np.uint8)
+        timings = []
+        for _ in range(repeats + 1):
+            start = time.perf_counter()
+            backend.predict(images)
+            timings.append((time.perf_counter() - start) * 1000.0)
+        stats.append({
+            'batch_size': batch_size,
+            'first_call_ms': timings[0],
+            'steady_state_ms': float(np.median(timings[1:])),
+        })
+    return stats
+
+def _clone_with_config(model, update):
+    """Копия модели с теми же весами; update(config) правит каждый словарь конфига слоев"""
+    def walk(config):
+        if isinstance(config, dict):
+            update(config)
+            for value in config.values():
+                walk(value)
+        elif isinstance(config, list):
+            for value in config:
+                walk(value)
+
+    config = model.get_config()
+    walk(config)
+    clone = model.__class__.from_config(config)
+    clone.set_weights(model.get_weights())
+    return clone
+
+def unroll_lstm_layers(model):
+    """
+    Копия модели с развернутыми (unroll=True) LSTM слоями для экспорта в TFLite.
+
+    Развернутые LSTM конвертируются в обычные TFLite операции с динамическим
+    размером батча, без Select TF ops (FlexTensorListReserve), которые не
+    поддерживаются стандартным tf.lite.Interpreter.
+    """
+    def unroll(config):
+        if config.get('class_name') == 'LSTM':
+            config['config']['unroll'] = True
+
+    return _clone_with_config(model, unroll)
+
+def float32_layers(model):
+    """
+    Копия модели, обученной в mixed precision (mixed_bfloat16 / mixed_float16),
+    со всеми слоями в float32: экспортированные модели и TFLite не зависят
+    от поддержки bfloat16 на сервере.
+    """
+    def to_float32(config):
+        if config.get('class_name') == 'DTypePolicy' and config['config'].get('name', '').startswith('mixed_'):
+            config['config']['name'] = 'float32'
+
+    return _clone_with_config(model, to_float32)
+
+def load_backend(backend='keras', model_path=None, num_threads=None):
+    """Загружает модель выбранным бэкендом"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд '{backend}', доступны: {', '.join(BACKENDS)}")
+    model_path = model_path or DEFAULT_MODEL_PATHS[backend]
+    if backend == 'tflite':
+        return TFLiteBackend(model_path, num_threads=num_threads)
+    if backend == 'saved_model':
+        return SavedModelBackend(model_path)
+    return KerasBackend(model_path)
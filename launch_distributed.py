@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальный запуск распределенного обучения train.py
+
+Запускает несколько воркеров MultiWorkerMirroredStrategy на localhost
+(каждый - отдельный процесс со своим портом), печатает их вывод с префиксом
+[worker N] и ждет завершения. Модели в output/ сохраняет только worker 0 (chief).
+
+Использование:
+    python launch_distributed.py --workers 2
+    python launch_distributed.py --workers 4 --base-port 23456 -- --no-cache --xla
+
+Для нескольких машин train.py запускается на каждой с общим списком воркеров:
+    python train.py --worker-hosts node1:12345,node2:12345 --task-index 0   # на node1
+    python train.py --worker-hosts node1:12345,node2:12345 --task-index 1   # на node2
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+
+def free_port():
+    """Свободный TCP порт на localhost"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def stream_output(process, prefix):
+    """Печатает вывод воркера построчно с префиксом"""
+    for line in iter(process.stdout.readline, b''):
+        sys.stdout.write(f"{prefix} {line.decode('utf-8', errors='replace')}")
+        sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный запуск нескольких воркеров train.py')
+    parser.add_argument('--workers', '-n', type=int, default=2, help='Число воркеров')
+    parser.add_argument('--base-port', type=int, default=None,
+                        help='Порт первого воркера (следующие +1); по умолчанию - свободные порты')
+    parser.add_argument('--script', default='train.py', help='Скрипт обучения')
+    parser.add_argument('--gpu', action='store_true', help='Не скрывать GPU от воркеров (по умолчанию только CPU)')
+    parser.add_argument('train_args', nargs=argparse.REMAINDER, help='Аргументы для train.py (после --)')
+    args = parser.parse_args()
+
+    if args.base_port:
+        ports = [args.base_port + i for i in range(args.workers)]
+    else:
+        ports = [free_port() for _ in range(args.workers)]
+    hosts = ','.join(f"localhost:{port}" for port in ports)
+    train_args = [a for a in args.train_args if a != '--']
+
+    env = dict(os.environ)
+    env.pop('TF_CONFIG', None)
+    if not args.gpu:
+        env['CUDA_VISIBLE_DEVICES'] = ''
+
+    print(f"[*] Запускаем {args.workers} воркеров: {hosts}")
+    processes, threads = [], []
+    for index in range(args.workers):
+        command = [sys.executable, args.script, '--worker-hosts', hosts, '--task-index', str(index)] + train_args
+        process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        thread = threading.Thread(target=stream_output, args=(process, f"[worker {index}]"), daemon=True)
+        thread.start()
+        processes.append(process)
+        threads.append(thread)
+
+    try:
+        # Если один воркер упал, остальные зависнут в all-reduce: останавливаем всех
+        while any(process.poll() is None for process in processes):
+            if any(process.poll() not in (None, 0) for process in processes):
+                print("[ERROR] Один из воркеров упал, останавливаем остальные")
+                break
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    codes = [process.wait() for process in processes]
+    for thread in threads:
+        thread.join()
+
+    failed = [i for i, code in enumerate(codes) if code != 0]
+    if failed:
+        print(f"[ERROR] Воркеры завершились с ошибкой: {failed} (коды {[codes[i] for i in failed]})")
+        sys.exit(1)
+    print(f"[OK] Все {args.workers} воркера завершили обучение, модели в output/")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочное тестирование captcha_api.py
+
+Гоняет /predict и /predict-batch на нескольких уровнях конкурентности
+(число одновременных клиентов) и, при необходимости, с фиксированной
+частотой запросов. Для каждого уровня считает пропускную способность
+(запросов и изображений в секунду), задержку p50/p95/p99 и долю ошибок.
+
+Режимы нагрузки:
+    --rate 0   замкнутый цикл: каждый клиент шлет следующий запрос сразу
+               после ответа (максимальная пропускная способность)
+    --rate N   открытый цикл: N запросов/сек по расписанию; задержка
+               считается от запланированного момента отправки, поэтому
+               очередь на стороне клиентов тоже попадает в p99
+
+Изображения берутся из папки (--images) или генерируются
+synthetic_captcha.py (--synthetic N). Сервер можно запустить из скрипта
+(--start-server, аргументы после -- передаются captcha_api.py) или
+указать уже работающий (--url). Корпус повторяется, поэтому в запущенном
+скриптом сервере кеш результатов выключен (--cache-size 0; вернуть можно
+аргументом после --), иначе замер покажет скорость кеша, а не модели.
+
+Использование:
+    python load_test.py --images data/images --concurrency 1 4 16 --duration 30
+    python load_test.py --synthetic 200 --start-server -- --backend tflite --max-batch-size 32
+    python load_test.py --url http://127.0.0.1:5000 --images data/images --endpoints predict --rate 50 100 200
+    python load_test.py --synthetic 200 --start-server --format images   # бинарные тела без base64/JSON
+
+Результаты: output/load_test.json (--output)
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+import requests
+
+from binary_protocol import IMAGES_CONTENT_TYPE, encode_images
+
+ENDPOINTS = ('predict', 'predict-batch')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+SERVER_START_TIMEOUT = 180  # Секунд на загрузку модели при --start-server
+FORMATS = {'json': 'application/json', 'images': IMAGES_CONTENT_TYPE}
+
+def load_corpus(image_dir=None, synthetic=0, limit=None, seed=42):
+    """Список base64 строк изображений из папки или синтетических CAPTCHA"""
+    if image_dir:
+        files = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+        if limit:
+            files = files[:limit]
+        encoded = []
+        for name in files:
+            with open(os.path.join(image_dir, name), 'rb') as f:
+                encoded.append(base64.b64encode(f.read()).decode('ascii'))
+    else:
+        from PIL import Image
+        from synthetic_captcha import generate_chunk
+        images, _ = generate_chunk(0, synthetic, seed)
+        encoded = []
+        for pixels in images:
+            buffer = BytesIO()
+            Image.fromarray(pixels).save(buffer, format='PNG')
+            encoded.append(base64.b64encode(buffer.getvalue()).decode('ascii'))
+    if not encoded:
+        raise SystemExit("[ERROR] Нет изображений для нагрузки (--images или --synthetic)")
+    return encoded
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_server(url, timeout, process=None):
+    """Ждет, пока /health ответит model_loaded"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"[ERROR] captcha_api.py завершился с кодом {process.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=2).json().get('model_loaded'):
+                return
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"[ERROR] Сервер {url} не ответил за {timeout} с")
+
+def start_server(server_args, log_path):
+    """Запускает captcha_api.py на свободном порту; возвращает (process, url)"""
+    port = free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'captcha_api.py')
+    log = open(log_path, 'w')
+    # --cache-size 0 до server_args: явно заданный размер кеша важнее
+    process = subprocess.Popen([sys.executable, script, '--host', '127.0.0.1', '--port', str(port),
+                                '--cache-size', '0'] + server_args, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    print(f"[*] Запущен captcha_api.py (pid {process.pid}), лог: {log_path}")
+    try:
+        wait_for_server(url, SERVER_START_TIMEOUT, process)
+    except BaseException:
+        process.terminate()
+        raise
+    return process, url
+
+def request_bodies(corpus, endpoint, batch_size, count=64, body_format='json'):
+    """Заранее сериализованные тела запросов (кодирование не нагружает клиента во время теста)"""
+    bodies = []
+    for i in range(min(count, len(corpus))):
+        if endpoint == 'predict':
+            images = [corpus[i]]
+        else:
+            images = [corpus[(i * batch_size + j) % len(corpus)] for j in range(batch_size)]
+        if body_format == 'images':
+            bodies.append(encode_images(base64.b64decode(image) for image in images))
+        elif endpoint == 'predict':
+            bodies.append(json.dumps({'image': images[0]}))
+        else:
+            bodies.append(json.dumps({'images': images}))
+    return bodies
+
+def send(session, url, body, timeout, content_type='application/json'):
+    """Один запрос: (ok, число изображений с ошибкой)"""
+    response = session.post(url, data=body, headers={'Content-Type': content_type}, timeout=timeout)
+    if response.status_code != 200:
+        return False, 0
+    data = response.json()
+    if 'results' in data:
+        return data.get('success', False), sum(not result.get('success') for result in data['results'])
+    return data.get('success', False), 0
+
+def run_level(url, endpoint, bodies, images_per_request, concurrency, rate, duration, warmup, timeout,
+              content_type='application/json'):
+    """Нагрузка одним уровнем: concurrency клиентов, rate запросов/сек (0 - без ограничения)"""
+    target = f"{url}/{endpoint}"
+    lock = threading.Lock()
+    counter = [0]
+    records = []  # (завершение, задержка, ok, ошибок изображений)
+    start = time.perf_counter() + 0.1
+    measure_from = start + warmup
+    stop = measure_from + duration
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                index = counter[0]
+                counter[0] += 1
+            if rate:
+                scheduled = start + index / rate
+                # Сервер не успевает: после конца замера новые запросы не отправляются
+                if scheduled >= stop or time.perf_counter() >= stop:
+                    return
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+                if scheduled >= stop:
+                    return
+            try:
+                ok, image_errors = send(session, target, bodies[index % len(bodies)], timeout, content_type)
+            except (requests.RequestException, ValueError):
+                ok, image_errors = False, 0
+            finished = time.perf_counter()
+            # В открытом цикле задержка считается от расписания: опоздание отправки тоже ожидание клиента
+            if scheduled >= measure_from:
+                with lock:
+                    records.append((finished, finished - scheduled, ok, image_errors))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = summarize(records, endpoint, images_per_request, concurrency, rate, measure_from)
+    if rate:
+        summary['scheduled'] = int(duration * rate)
+    return summary
+
+def summarize(records, endpoint, images_per_request, concurrency, rate, measure_from):
+    summary = {'endpoint': endpoint, 'concurrency': concurrency, 'target_rate': rate or None,
+               'images_per_request': images_per_request, 'requests': len(records)}
+    if not records:
+        return summary
+    latencies = np.array([record[1] for record in records]) * 1000.0
+    errors = sum(not record[2] for record in records)
+    elapsed = max(record[0] for record in records) - measure_from
+    summary.update({
+        'errors': errors,
+        'error_rate': errors / len(records),
+        'image_errors': sum(record[3] for record in records),
+        'throughput_rps': len(records) / elapsed,
+        'images_per_sec': len(records) * images_per_request / elapsed,
+        'latency_ms': {
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(latencies.max()),
+        },
+    })
+    return summary
+
+def print_summary(summary):
+    rate = f"{summary['target_rate']:g}" if summary['target_rate'] else '-'
+    if not summary['requests']:
+        print(f"{summary['endpoint']:>14} | {summary['concurrency']:>5} | {rate:>6} | нет завершенных запросов")
+    else:
+        latency = summary['latency_ms']
+        print(f"{summary['endpoint']:>14} | {summary['concurrency']:>5} | {rate:>6} | {summary['requests']:>7} | "
+              f"{summary['throughput_rps']:>8.1f} | {summary['images_per_sec']:>8.1f} | {latency['p50']:>8.1f} | "
+              f"{latency['p95']:>8.1f} | {latency['p99']:>8.1f} | {summary['error_rate']:>6.1%}")
+    if summary.get('scheduled') and summary['requests'] < 0.95 * summary['scheduled']:
+        print(f"{'':>14}   [!] завершено {summary['requests']} из {summary['scheduled']} запланированных: "
+              f"сервер не держит {rate} запросов/сек")
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест captcha_api.py')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Адрес работающего сервера')
+    parser.add_argument('--start-server', action='store_true',
+                        help='Запустить captcha_api.py (аргументы сервера - после --)')
+    parser.add_argument('--images', default=None, help='Папка с изображениями')
+    parser.add_argument('--synthetic', type=int, default=0, help='Сгенерировать N синтетических CAPTCHA вместо --images')
+    parser.add_argument('--limit', type=int, default=None, help='Взять не больше N изображений из папки')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='Уровни конкурентности')
+    parser.add_argument('--rate', type=float, nargs='+', default=[0],
+                        help='Запросов/сек на уровень (0 - замкнутый цикл без ограничения)')
+    parser.add_argument('--format', choices=FORMATS, default='json',
+                        help='Тело запроса: base64 в JSON или бинарное application/x-captcha-images')
+    parser.add_argument('--batch-size', type=int, default=8, help='Изображений в запросе /predict-batch')
+    parser.add_argument('--duration', type=float, default=20.0, help='Секунд замера на уровень')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Секунд прогрева перед замером (не учитываются)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Таймаут запроса, секунд')
+    parser.add_argument('--output', default='output/load_test.json', help='Файл результатов (JSON)')
+    parser.add_argument('server_args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.images and not args.synthetic:
+        parser.error("нужен --images или --synthetic")
+    corpus = load_corpus(args.images, args.synthetic, args.limit)
+    print(f"[*] Изображений в корпусе: {len(corpus)}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    process = None
+    url = args.url.rstrip('/')
+    server_args = args.server_args[1:] if args.server_args[:1] == ['--'] else args.server_args
+    if args.start_server:
+        process, url = start_server(server_args, os.path.splitext(args.output)[0] + '_server.log')
+    else:
+        wait_for_server(url, 10)
+
+    try:
+        server_info = requests.get(f"{url}/info", timeout=5).json()
+        levels = []
+        print(f"\n{'endpoint':>14} | {'conc.':>5} | {'rate':>6} | {'req.':>7} | {'req/s':>8} | {'img/s':>8} | "
+              f"{'p50, ms':>8} | {'p95, ms':>8} | {'p99, ms':>8} | {'errors':>6}")
+        print("-" * 110)
+        for endpoint in args.endpoints:
+            images_per_request = args.batch_size if endpoint == 'predict-batch' else 1
+            bodies = request_bodies(corpus, endpoint, args.batch_size, body_format=args.format)
+            for concurrency in args.concurrency:
+                for rate in args.rate:
+                    summary = run_level(url, endpoint, bodies, images_per_request, concurrency, rate,
+                                        args.duration, args.warmup, args.timeout, FORMATS[args.format])
+                    print_summary(summary)
+                    levels.append(summary)
+        health = requests.get(f"{url}/health", timeout=5).json()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'url': url,
+        'server_args': server_args if args.start_server else None,
+        'config': {'duration': args.duration, 'warmup': args.warmup, 'batch_size': args.batch_size,
+                   'format': args.format, 'corpus_size': len(corpus), 'client_cpu_count': os.cpu_count()},
+        'server_info': server_info,
+        'server_health': health,
+        'levels': levels,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n[OK] Результаты сохранены: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метаданные модели (sidecar файл рядом с моделью)
+
+train.py сохраняет рядом с моделями файл <имя модели>.meta.json:
+алфавит, размер изображения, число каналов, максимальную длину строки,
+число временных шагов и контрольные суммы сохраненных артефактов.
+predict.py, captcha_api.py и check_model_alphabet.py читают только его,
+без повторного сканирования labels.csv.
+
+    output/model.keras, output/model.h5, output/model.tflite, output/model
+        -> output/model.meta.json
+
+Для уже обученной модели без sidecar файла:
+    python model_metadata.py --model final-results/output/model.keras --labels images/labels.csv
+"""
+
+import os
+import json
+import hashlib
+import argparse
+from datetime import datetime
+
+METADATA_VERSION = 1
+MODEL_EXTENSIONS = ('.keras', '.h5', '.tflite')
+
+def metadata_path(model_path):
+    """Путь к sidecar файлу для модели (общий для .keras/.h5/.tflite/SavedModel)"""
+    base = os.path.normpath(model_path)
+    root, ext = os.path.splitext(base)
+    if ext in MODEL_EXTENSIONS:
+        base = root
+    return base + '.meta.json'
+
+def file_checksum(path):
+    """sha256 файла или всех файлов папки (для SavedModel)"""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+                with open(file_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def save_metadata(model_paths, characters, img_width, img_height, img_channels,
+                  max_sequence_length, time_steps, **extra):
+    """Сохраняет sidecar файл с контрольными суммами всех существующих артефактов"""
+    model_paths = [path for path in model_paths if os.path.exists(path)]
+    if not model_paths:
+        raise FileNotFoundError("Нет сохраненных моделей для записи метаданных")
+    metadata = {
+        'version': METADATA_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'characters': list(characters),
+        'num_classes': len(characters) + 1,
+        'img_width': img_width,
+        'img_height': img_height,
+        'img_channels': img_channels,
+        'max_sequence_length': max_sequence_length,
+        'time_steps': time_steps,
+        'checksums': {os.path.basename(os.path.normpath(path)): file_checksum(path) for path in model_paths},
+    }
+    metadata.update(extra)
+
+    path = metadata_path(model_paths[0])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    return path
+
+def load_metadata(model_path, num_classes=None, verify_checksum=True):
+    """
+    Читает sidecar файл модели и проверяет его.
+
+    Падает сразу, если файла нет, версия неизвестна, контрольная сумма
+    модели не совпадает или ширина выходного слоя (num_classes) не равна
+    len(characters) + 1.
+    """
+    path = metadata_path(model_path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"Не найден файл метаданных {path}. Создайте его: "
+            f"python model_metadata.py --model {model_path} --labels <labels.csv>"
+        )
+    with open(path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    if metadata.get('version', 0) > METADATA_VERSION:
+        raise ValueError(f"Версия метаданных {metadata.get('version')} новее поддерживаемой ({METADATA_VERSION})")
+
+    if verify_checksum:
+        name = os.path.basename(os.path.normpath(model_path))
+        expected = metadata.get('checksums', {}).get(name)
+        if expected is not None and expected != file_checksum(model_path):
+            raise ValueError(f"Контрольная сумма {model_path} не совпадает с {path}: модель изменилась после обучения")
+
+    expected_classes = len(metadata['characters']) + 1
+    if num_classes is not None and num_classes != expected_classes:
+        raise ValueError(
+            f"Выходной слой модели имеет {num_classes} классов, а алфавит в {path} "
+            f"дает {expected_classes} ({len(metadata['characters'])} символов + blank)"
+        )
+    return metadata
+
+def char_mappings(metadata):
+    """Словари char_to_num / num_to_char в формате train.py"""
+    characters = metadata['characters']
+    char_to_num = {v: i for i, v in enumerate(characters)}
+    num_to_char = {str(i): v for i, v in enumerate(characters)}
+    num_to_char['-1'] = 'UKN'  # Для CTC декодирования
+    return char_to_num, num_to_char
+
+def main():
+    parser = argparse.ArgumentParser(description='Создает sidecar метаданные для уже обученной модели')
+    parser.add_argument('--model', '-m', required=True, help='Путь к модели (.keras/.h5/.tflite или папка SavedModel)')
+    parser.add_argument('--labels', required=True, help='labels.csv, на котором обучалась модель')
+    parser.add_argument('--img-width', type=int, default=200)
+    parser.add_argument('--img-height', type=int, default=60)
+    parser.add_argument('--img-channels', type=int, default=3)
+    parser.add_argument('--max-sequence-length', type=int, default=7)
+    parser.add_argument('--time-steps', type=int, default=50)
+    args = parser.parse_args()
+
+    # Алфавит строится так же, как в train.py (БЛОК 1-2)
+    texts = {}
+    with open(args.labels, 'r', encoding='utf-8') as f:
+        for line in f:
+            text = line.split(';')[0].strip()
+            if text:
+                texts[text] = True
+    characters = sorted(set(''.join(texts)))
+
+    path = save_metadata([args.model], characters, args.img_width, args.img_height, args.img_channels,
+                         args.max_sequence_length, args.time_steps, labels=args.labels)
+    print(f"[OK] Метаданные сохранены в {path} ({len(characters)} символов)")
+
+if __name__ == "__main__":
+    main()
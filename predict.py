@@ -14,70 +14,53 @@ import matplotlib.pyplot as plt
 from PIL import Image
 import argparse
 import glob
+from inference_backend import BACKENDS, DEFAULT_MODEL_PATHS, load_backend, warmup
+from model_metadata import load_metadata, metadata_path, char_mappings
+from ctc_decoder import build_lookup, greedy_decode, beam_search_decode, DEFAULT_PRUNE_THRESHOLD
+import fast_preprocess
 
 # Настройки модели
 IMG_WIDTH = 200
 IMG_HEIGHT = 60
 MAX_SEQUENCE_LENGTH = 7
+INPUT_LAYOUT = 'WHC'  # 'HWC', если транспонирование встроено в модель (из метаданных)
+PREPROCESSOR = 'tf'  # 'tf' или 'cv2' (fast_preprocess.py)
 
-def load_model(model_path="final-results/output/model.keras"):
-    """Загружает обученную модель"""
+def load_model(model_path=None, backend='keras', num_threads=None):
+    """Загружает обученную модель выбранным бэкендом (keras | saved_model | tflite)"""
+    model_path = model_path or DEFAULT_MODEL_PATHS[backend]
     try:
-        print(f"[*] Загружаем модель из {model_path}...")
-        model = keras.models.load_model(model_path)
+        print(f"[*] Загружаем модель из {model_path} (бэкенд: {backend})...")
+        model = load_backend(backend, model_path, num_threads)
         print("[OK] Модель успешно загружена")
         return model
     except Exception as e:
         print(f"[ERROR] Ошибка загрузки модели: {e}")
         return None
 
-def load_char_mappings():
-    """Загружает словари символов"""
-    # Пытаемся определить алфавит из данных обучения
-    characters = None
+def load_char_mappings(model_path, num_classes):
+    """Загружает словари символов, длину строки и раскладку входа из метаданных модели (<модель>.meta.json)"""
+    global INPUT_LAYOUT, MAX_SEQUENCE_LENGTH
+    print(f"[*] Читаем алфавит из {metadata_path(model_path)}...")
+    metadata = load_metadata(model_path, num_classes)
+    if (metadata['img_width'], metadata['img_height']) != (IMG_WIDTH, IMG_HEIGHT):
+        raise ValueError(f"Модель обучена на {metadata['img_width']}x{metadata['img_height']}, "
+                         f"а predict.py ожидает {IMG_WIDTH}x{IMG_HEIGHT}")
+    char_to_num, num_to_char = char_mappings(metadata)
+    MAX_SEQUENCE_LENGTH = metadata['max_sequence_length']
+    INPUT_LAYOUT = metadata.get('input_layout', 'WHC')
     
-    # Проверяем, есть ли файл с метками
-    possible_labels = [
-        "images/labels.csv",
-        "labels.csv", 
-        "input/labels.csv"
-    ]
-    
-    for labels_file in possible_labels:
-        if os.path.exists(labels_file):
-            try:
-                print(f"[*] Определяем алфавит из {labels_file}...")
-                with open(labels_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                
-                # Извлекаем все символы из данных
-                all_chars = set()
-                for line in lines:
-                    text = line.split(';')[0].strip()
-                    all_chars.update(text)
-                
-                characters = sorted(all_chars)
-                print(f"[OK] Алфавит определен из данных: {len(characters)} символов")
-                break
-            except Exception as e:
-                print(f"[!] Ошибка чтения {labels_file}: {e}")
-                continue
-    
-    # Если не удалось определить из данных, используем полный алфавит
-    if characters is None:
-        print("[!] Не удалось определить алфавит из данных, используем полный набор")
-        characters = sorted(set('абвгдежзийклмнопрстуфхцчшщъыьэюя0123456789'))
-    
-    char_to_num = {v: i for i, v in enumerate(characters)}
-    num_to_char = {str(i): v for i, v in enumerate(characters)}
-    num_to_char['-1'] = 'UKN'  # Для CTC декодирования
-    
-    print(f"[INFO] Алфавит ({len(characters)} символов): {characters}")
+    print(f"[INFO] Алфавит ({len(metadata['characters'])} символов): {metadata['characters']}")
     return char_to_num, num_to_char
 
-def preprocess_image(image_path, img_width=IMG_WIDTH, img_height=IMG_HEIGHT):
-    """Предобрабатывает изображение для модели"""
+def preprocess_image(image_path, img_width=IMG_WIDTH, img_height=IMG_HEIGHT, layout=None):
+    """Предобрабатывает изображение для модели (uint8, нормализация внутри модели)"""
     try:
+        # OpenCV/NumPy: декодирование, resize и транспонирование без eager операций TF
+        if PREPROCESSOR == 'cv2':
+            with open(image_path, 'rb') as f:
+                return fast_preprocess.preprocess_batch([f.read()], img_width, img_height, layout or INPUT_LAYOUT)
+        
         # Загружаем изображение
         img = tf.io.read_file(image_path)
         
@@ -87,14 +70,14 @@ def preprocess_image(image_path, img_width=IMG_WIDTH, img_height=IMG_HEIGHT):
         except:
             img = tf.io.decode_jpeg(img, channels=3)
         
-        # Конвертируем в float32 и нормализуем
-        img = tf.image.convert_image_dtype(img, tf.float32)
+        # Изменяем размер если нужно (остаемся в uint8)
+        if tuple(img.shape[:2]) != (img_height, img_width):
+            img = tf.image.resize(img, [img_height, img_width])
+            img = tf.saturate_cast(tf.round(img), tf.uint8)
         
-        # Транспонируем (width, height, channels)
-        img = tf.transpose(img, perm=[1, 0, 2])
-        
-        # Изменяем размер если нужно
-        img = tf.image.resize(img, [img_width, img_height])
+        # Транспонируем (width, height, channels), если модель не делает этого сама
+        if (layout or INPUT_LAYOUT) == 'WHC':
+            img = tf.transpose(img, perm=[1, 0, 2])
         
         # Добавляем batch dimension
         img = tf.expand_dims(img, 0)
@@ -106,25 +89,12 @@ def preprocess_image(image_path, img_width=IMG_WIDTH, img_height=IMG_HEIGHT):
 
 def decode_predictions(predictions, num_to_char):
     """Декодирует предсказания модели в текст"""
-    # Получаем индексы с максимальной вероятностью
-    input_len = np.ones(predictions.shape[0]) * predictions.shape[1]
-    results = tf.keras.backend.ctc_decode(predictions, input_length=input_len, greedy=True)[0][0]
-    
-    # Конвертируем в текст
-    texts = []
-    for result in results:
-        text = ""
-        for idx in result:
-            if idx != -1:  # -1 означает padding
-                char = num_to_char.get(str(idx.numpy()), '')
-                if char != 'UKN':
-                    text += char
-        texts.append(text)
-    
-    return texts
+    lookup = build_lookup(num_to_char, predictions.shape[-1])
+    return greedy_decode(predictions, lookup)
 
-def predict_single_image(model, image_path, char_to_num, num_to_char):
-    """Предсказывает текст для одного изображения"""
+def predict_single_image(model, image_path, char_to_num, num_to_char,
+                         beam_width=0, top_k=1, prune_threshold=DEFAULT_PRUNE_THRESHOLD):
+    """Предсказывает текст для одного изображения (beam search при beam_width > 0)"""
     print(f"\n[*] Анализируем: {os.path.basename(image_path)}")
     
     # Предобрабатываем изображение
@@ -134,8 +104,19 @@ def predict_single_image(model, image_path, char_to_num, num_to_char):
     
     # Делаем предсказание
     try:
-        predictions = model.predict(processed_img, verbose=0)
-        predicted_text = decode_predictions(predictions, num_to_char)[0]
+        predictions = model.predict(processed_img)
+        
+        if beam_width > 0:
+            lookup = build_lookup(num_to_char, predictions.shape[-1])
+            candidates = beam_search_decode(predictions[0], lookup, beam_width=beam_width,
+                                            prune_threshold=prune_threshold,
+                                            max_length=MAX_SEQUENCE_LENGTH, top_k=top_k)
+            predicted_text = candidates[0]['text']
+            for rank, candidate in enumerate(candidates, 1):
+                confidences = ' '.join(f"{c:.2f}" for c in candidate['char_confidences'])
+                print(f"[BEAM {rank}] '{candidate['text']}' log_prob={candidate['log_prob']:.3f} [{confidences}]")
+        else:
+            predicted_text = decode_predictions(predictions, num_to_char)[0]
         
         print(f"[RESULT] Предсказанный текст: '{predicted_text}'")
         return predicted_text
@@ -166,11 +147,22 @@ def visualize_prediction(image_path, predicted_text, save_path=None):
         print(f"[ERROR] Ошибка визуализации: {e}")
 
 def main():
+    global PREPROCESSOR
+    
     parser = argparse.ArgumentParser(description='CAPTCHA OCR Prediction')
     parser.add_argument('--image', '-i', type=str, help='Путь к изображению')
     parser.add_argument('--folder', '-f', type=str, help='Папка с изображениями')
-    parser.add_argument('--model', '-m', type=str, default='final-results/output/model.keras', help='Путь к модели')
+    parser.add_argument('--model', '-m', type=str, default=None,
+                        help='Путь к модели (по умолчанию: final-results/output/model.keras / model.tflite / model)')
+    parser.add_argument('--backend', '-b', choices=BACKENDS, default='keras', help='Бэкенд инференса')
+    parser.add_argument('--num-threads', type=int, default=None, help='Потоки TFLite интерпретатора')
     parser.add_argument('--output', '-o', type=str, help='Папка для сохранения результатов')
+    parser.add_argument('--beam-width', type=int, default=0, help='Ширина луча для beam search (0 = greedy)')
+    parser.add_argument('--beam-prune-threshold', type=float, default=DEFAULT_PRUNE_THRESHOLD,
+                        help='Порог отсечения символов при beam search')
+    parser.add_argument('--top-k', type=int, default=1, help='Сколько кандидатов beam search показывать')
+    parser.add_argument('--preprocess', choices=['tf', 'cv2'], default=PREPROCESSOR,
+                        help='Предобработка: операции TensorFlow или OpenCV/NumPy')
     
     args = parser.parse_args()
     
@@ -178,13 +170,24 @@ def main():
     print("*** CAPTCHA OCR Prediction Script ***")
     print("=" * 60)
     
+    PREPROCESSOR = args.preprocess
+    
     # Загружаем модель
-    model = load_model(args.model)
+    model_path = args.model or DEFAULT_MODEL_PATHS[args.backend]
+    model = load_model(model_path, args.backend, args.num_threads)
     if model is None:
         return
     
-    # Загружаем словари символов
-    char_to_num, num_to_char = load_char_mappings()
+    # Загружаем словари символов и параметры модели (ошибка, если метаданные не совпадают с моделью)
+    try:
+        char_to_num, num_to_char = load_char_mappings(model_path, model.num_classes)
+    except Exception as e:
+        print(f"[ERROR] Ошибка загрузки метаданных модели: {e}")
+        return
+    
+    # Трассировка графа до первого изображения (изображения идут по одному: batch=1)
+    stats = warmup(model, (1,))[0]
+    print(f"[INFO] Прогрев: первый вызов {stats['first_call_ms']:.1f} мс, дальше {stats['steady_state_ms']:.1f} мс")
     
     # Создаем папку для результатов
     if args.output:
@@ -197,7 +200,8 @@ def main():
             print(f"[ERROR] Файл не найден: {args.image}")
             return
         
-        predicted_text = predict_single_image(model, args.image, char_to_num, num_to_char)
+        predicted_text = predict_single_image(model, args.image, char_to_num, num_to_char,
+                                              args.beam_width, args.top_k, args.beam_prune_threshold)
         
         if predicted_text and args.output:
             output_path = os.path.join(args.output, f"result_{os.path.basename(args.image)}")
@@ -226,7 +230,8 @@ def main():
         # Обрабатываем каждое изображение
         results = []
         for i, image_path in enumerate(image_files, 1):
-            predicted_text = predict_single_image(model, image_path, char_to_num, num_to_char)
+            predicted_text = predict_single_image(model, image_path, char_to_num, num_to_char,
+                                                  args.beam_width, args.top_k, args.beam_prune_threshold)
             if predicted_text:
                 results.append((os.path.basename(image_path), predicted_text))
                 print(f"[{i}/{len(image_files)}] OK")
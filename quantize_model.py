@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Post-training int8 квантизация prediction model
+
+Строит полностью целочисленную (int8) TFLite модель из output/model.keras,
+калибруя ее на изображениях из labels.csv / IMG_FOLDER, затем прогоняет
+валидационную выборку через float и int8 модели и пишет отчет:
+точность (exact match), CER, размер модели и задержку на изображение.
+
+Использование:
+    python quantize_model.py
+    python quantize_model.py --model output/model.keras --labels data/labels.csv --images data/images
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from tensorflow import keras
+from sklearn.model_selection import train_test_split
+
+from ctc_decoder import build_lookup, greedy_decode
+from inference_backend import TFLiteBackend, prepare_input, unroll_lstm_layers
+from model_metadata import load_metadata, save_metadata, char_mappings
+
+# Параметры как в train.py
+IMG_WIDTH = 200
+IMG_HEIGHT = 60
+TEST_SIZE = 0.1
+RANDOM_STATE = 42
+
+POSSIBLE_LABELS = [
+    "../input/russian-captcha-images-base64/labels.csv",  # Kaggle
+    "data/labels.csv",
+    "labels.csv",
+    "input/labels.csv",
+]
+
+POSSIBLE_IMG_FOLDERS = [
+    "../input/russian-captcha-images-base64/translit/images",  # Kaggle
+    "data/images",
+    "images",
+    "input/images",
+]
+
+def find_first(paths):
+    """Первый существующий путь из списка"""
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_split(labels_file):
+    """Читает labels.csv и делит на train/val так же, как train.py"""
+    df = pd.read_csv(labels_file, header=None, encoding='utf-8', delimiter=';', names=['text', 'filename'])
+    data = {row.text: row.filename for row in df.itertuples()}
+    items = list(data.items())
+    return train_test_split(items, test_size=TEST_SIZE, shuffle=True, random_state=RANDOM_STATE)
+
+def load_image(img_folder, filename, layout='WHC'):
+    """Загружает uint8 изображение как в encode_single_sample из train.py"""
+    img = tf.io.read_file(os.path.join(img_folder, filename))
+    img = tf.io.decode_image(img, channels=3, expand_animations=False)
+    if tuple(img.shape[:2]) != (IMG_HEIGHT, IMG_WIDTH):
+        img = tf.saturate_cast(tf.round(tf.image.resize(img, [IMG_HEIGHT, IMG_WIDTH])), tf.uint8)
+    if layout == 'WHC':
+        img = tf.transpose(img, perm=[1, 0, 2])  # (width, height, channels)
+    return img.numpy()
+
+def convert(model, representative_images=None):
+    """
+    Конвертирует модель в TFLite: float32 или полностью int8 (если даны калибровочные данные).
+    Модели с uint8 входом (нормализация внутри модели) сохраняют uint8 вход,
+    у старых float моделей вход квантуется в int8.
+    """
+    input_dtype = np.dtype(tf.as_dtype(model.inputs[0].dtype).as_numpy_dtype)
+    converter = tf.lite.TFLiteConverter.from_keras_model(unroll_lstm_layers(model))
+    if representative_images is not None:
+        def representative_dataset():
+            for img in prepare_input(representative_images, input_dtype):
+                yield [img[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8 if input_dtype == np.uint8 else tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+def levenshtein(a, b):
+    """Расстояние редактирования между строками"""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def evaluate(backend, images, texts, lookup, batch_size):
+    """Точность, CER и задержка на изображение для одного бэкенда"""
+    predictions = []
+    for start in range(0, len(images), batch_size):
+        predictions.extend(greedy_decode(backend.predict(images[start:start + batch_size]), lookup))
+
+    # Задержка на одно изображение (батч из 1, после прогрева)
+    backend.predict(images[:1])
+    latencies = []
+    for img in images:
+        start = time.perf_counter()
+        backend.predict(img[np.newaxis])
+        latencies.append((time.perf_counter() - start) * 1000.0)
+
+    correct = sum(p == t for p, t in zip(predictions, texts))
+    errors = sum(levenshtein(p, t) for p, t in zip(predictions, texts))
+    total_chars = sum(len(t) for t in texts)
+    return {
+        'accuracy': correct / len(texts) * 100,
+        'cer': errors / max(total_chars, 1) * 100,
+        'latency_ms_mean': float(np.mean(latencies)),
+        'latency_ms_p50': float(np.percentile(latencies, 50)),
+        'latency_ms_p95': float(np.percentile(latencies, 95)),
+    }, predictions
+
+def main():
+    parser = argparse.ArgumentParser(description='Post-training int8 quantization')
+    parser.add_argument('--model', '-m', default='output/model.keras', help='Keras prediction model')
+    parser.add_argument('--labels', default=None, help='labels.csv (по умолчанию ищется как в train.py)')
+    parser.add_argument('--images', default=None, help='Папка с изображениями (по умолчанию ищется как в train.py)')
+    parser.add_argument('--output', '-o', default='output/model_int8.tflite', help='Куда сохранить int8 модель')
+    parser.add_argument('--report', default='output/quantization_report.json', help='Куда сохранить отчет')
+    parser.add_argument('--calibration-samples', type=int, default=300, help='Изображений для калибровки')
+    parser.add_argument('--max-val-samples', type=int, default=None, help='Ограничить валидационную выборку')
+    parser.add_argument('--batch-size', type=int, default=32, help='Батч для оценки точности')
+    parser.add_argument('--num-threads', type=int, default=None, help='Потоки TFLite интерпретатора')
+    parser.add_argument('--max-accuracy-drop', type=float, default=1.0,
+                        help='Допустимое падение точности int8 в процентных пунктах')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("*** Post-training int8 квантизация ***")
+    print("=" * 60)
+
+    labels_file = args.labels or find_first(POSSIBLE_LABELS)
+    img_folder = args.images or find_first(POSSIBLE_IMG_FOLDERS)
+    if labels_file is None or img_folder is None:
+        raise SystemExit("[ERROR] Не найдены labels.csv или папка с изображениями, укажите --labels/--images")
+
+    print(f"[*] Загружаем модель из {args.model}...")
+    model = keras.models.load_model(args.model)
+
+    metadata = load_metadata(args.model, model.output_shape[-1])
+    _, num_to_char = char_mappings(metadata)
+    lookup = build_lookup(num_to_char, model.output_shape[-1])
+
+    train_items, val_items = load_split(labels_file)
+    if args.max_val_samples:
+        val_items = val_items[:args.max_val_samples]
+
+    # Калибровочные данные - из train части, чтобы не подсматривать в валидацию
+    rng = np.random.default_rng(RANDOM_STATE)
+    calibration_count = min(args.calibration_samples, len(train_items))
+    calibration_items = [train_items[i] for i in rng.choice(len(train_items), calibration_count, replace=False)]
+    print(f"[*] Калибровка на {calibration_count} изображениях из {img_folder}...")
+    layout = metadata.get('input_layout', 'WHC')
+    calibration_images = np.stack([load_image(img_folder, fn, layout) for _, fn in calibration_items])
+
+    print("[*] Конвертируем float32 модель...")
+    float_model = convert(model)
+    print("[*] Конвертируем int8 модель...")
+    int8_model = convert(model, calibration_images)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'wb') as f:
+        f.write(int8_model)
+    save_metadata([args.output], metadata['characters'], metadata['img_width'], metadata['img_height'],
+                  metadata['img_channels'], metadata['max_sequence_length'], metadata['time_steps'],
+                  quantization='int8', source_model=args.model,
+                  input_dtype=metadata.get('input_dtype', 'float32'), input_layout=layout)
+    print(f"[SAVE] int8 модель сохранена в {args.output}")
+
+    print(f"[*] Оценка на {len(val_items)} валидационных изображениях...")
+    val_texts = [text for text, _ in val_items]
+    val_images = np.stack([load_image(img_folder, fn, layout) for _, fn in val_items])
+
+    float_metrics, float_predictions = evaluate(
+        TFLiteBackend(model_content=float_model, num_threads=args.num_threads),
+        val_images, val_texts, lookup, args.batch_size)
+    int8_metrics, int8_predictions = evaluate(
+        TFLiteBackend(model_content=int8_model, num_threads=args.num_threads),
+        val_images, val_texts, lookup, args.batch_size)
+    float_metrics['size_bytes'] = len(float_model)
+    int8_metrics['size_bytes'] = len(int8_model)
+
+    accuracy_drop = float_metrics['accuracy'] - int8_metrics['accuracy']
+    report = {
+        'model': args.model,
+        'int8_model': args.output,
+        'labels': labels_file,
+        'calibration_samples': calibration_count,
+        'validation_samples': len(val_items),
+        'float32': float_metrics,
+        'int8': int8_metrics,
+        'accuracy_drop': accuracy_drop,
+        'prediction_agreement': sum(a == b for a, b in zip(float_predictions, int8_predictions)) / len(val_items) * 100,
+        'max_accuracy_drop': args.max_accuracy_drop,
+        'safe_to_serve': accuracy_drop <= args.max_accuracy_drop,
+    }
+
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'':<16}{'float32':>12}{'int8':>12}")
+    print("-" * 40)
+    print(f"{'Точность, %':<16}{float_metrics['accuracy']:>12.2f}{int8_metrics['accuracy']:>12.2f}")
+    print(f"{'CER, %':<16}{float_metrics['cer']:>12.2f}{int8_metrics['cer']:>12.2f}")
+    print(f"{'Размер, KB':<16}{float_metrics['size_bytes'] / 1024:>12.1f}{int8_metrics['size_bytes'] / 1024:>12.1f}")
+    print(f"{'Задержка, ms':<16}{float_metrics['latency_ms_mean']:>12.2f}{int8_metrics['latency_ms_mean']:>12.2f}")
+    print("-" * 40)
+    verdict = "[OK] int8 можно использовать" if report['safe_to_serve'] else "[!] int8 теряет слишком много точности"
+    print(f"{verdict} (падение точности {accuracy_drop:.2f} п.п., порог {args.max_accuracy_drop})")
+    print(f"[SAVE] Отчет сохранен в {args.report}")
+
+if __name__ == "__main__":
+    main()
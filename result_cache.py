@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш результатов распознавания по содержимому изображения
+
+Клиенты повторяют запросы с теми же байтами изображения; повторный
+запрос отдает готовый результат без декодирования и инференса.
+
+Ключ - (версия модели, blake2b-128 сырых байтов изображения): после
+замены модели старые записи не находятся. Записи вытесняются по TTL
+и по LRU при превышении числа записей или приблизительного объема.
+Кеш у каждого процесса свой (воркеры serve.py не делят его).
+
+    cache = ResultCache(max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=3600)
+    key = (model_version, content_hash(image_bytes))
+    result = cache.get(key)
+    if result is None:
+        result = ...
+        cache.put(key, result)
+"""
+
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 10000
+MAX_BYTES = 64 * 1024 * 1024
+TTL = 3600.0  # Секунд
+ENTRY_OVERHEAD = 256  # Байт на ключ, OrderedDict и dict результата сверх JSON размера
+
+def content_hash(data):
+    """Быстрый 128-битный хеш байтов изображения (bytes, memoryview или непрерывный массив)"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def entry_size(value):
+    """Приблизительный объем записи в памяти"""
+    return ENTRY_OVERHEAD + len(json.dumps(value, ensure_ascii=False))
+
+class ResultCache:
+    """Потокобезопасный LRU кеш с TTL и ограничением по числу записей и объему"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL, clock=time.monotonic):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (истекает, размер, значение)
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def get(self, key):
+        """Значение или None (промах или запись устарела)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[2]
+
+    def put(self, key, value):
+        """Сохраняет значение; вытесняет давно не использованные записи сверх лимитов"""
+        size = entry_size(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expires = self._clock() + self.ttl if self.ttl else float('inf')
+            self._entries[key] = (expires, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': True,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+            }
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Production запуск captcha_api.py: несколько процессов-воркеров на одном порту
+
+Родительский процесс только открывает слушающий сокет и следит за
+воркерами (TensorFlow в нем не импортируется). Каждый воркер:
+    - наследует сокет (ядро распределяет соединения между воркерами)
+    - задает свои пулы потоков TF (intra-op / inter-op) и, при
+      --cpu-affinity, привязывается к своему набору ядер
+    - загружает и прогревает модель и только после этого начинает
+      принимать соединения (до этого они ждут в backlog сокета)
+    - обслуживает запросы production WSGI сервером waitress (пул из
+      --http-threads потоков; dev сервер Flask/werkzeug не используется)
+
+Упавший воркер перезапускается; если воркеры падают сразу после старта,
+пауза перед перезапуском растет (до MAX_RESTART_DELAY). SIGTERM / SIGINT
+останавливают всех воркеров.
+
+Метрики (/metrics, /health) у каждого воркера свои: запрос попадает в
+случайный воркер.
+
+Использование (аргументы после -- передаются captcha_api.py):
+    python serve.py --workers 4 --intra-op-threads 1 --port 5000 -- --backend tflite
+    python serve.py --workers 2 --intra-op-threads 2 --cpu-affinity auto -- --max-batch-size 32
+    python serve.py --workers 2 --cpu-affinity "0-3;4-7" --port 5000
+
+Сравнение раскладок воркеры x потоки на локальной машине:
+    python serve.py --benchmark --layouts 1x4 2x2 4x1 --synthetic 100 -- --backend tflite
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import selectors
+import threading
+import subprocess
+from datetime import datetime
+
+DEFAULT_WORKERS = 2
+DEFAULT_INTRA_OP_THREADS = 1
+DEFAULT_INTER_OP_THREADS = 1
+DEFAULT_HTTP_THREADS = 16  # Потоков waitress на воркер (одновременных запросов для micro-batching)
+BACKLOG = 1024
+RESTART_DELAY = 1.0       # Пауза перед перезапуском упавшего воркера, секунд
+MAX_RESTART_DELAY = 30.0
+MIN_UPTIME = 10.0         # Воркер, упавший раньше, считается падающим при старте (пауза удваивается)
+SHUTDOWN_TIMEOUT = 10.0
+READY_MESSAGE = "[OK] Все воркеры готовы"
+
+def parse_cpu_list(text):
+    """'0-3,6' -> [0, 1, 2, 3, 6]"""
+    cpus = []
+    for part in filter(None, text.split(',')):
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def cpu_sets(workers, affinity):
+    """
+    Наборы ядер для воркеров:
+        none           - без привязки
+        auto           - доступные ядра делятся на workers непрерывных групп
+        '0-3;4-7'      - явные наборы через ';' (по кругу, если воркеров больше)
+    """
+    if affinity == 'none':
+        return [None] * workers
+    if affinity == 'auto':
+        available = sorted(os.sched_getaffinity(0))
+        if len(available) < workers:
+            return [[available[i % len(available)]] for i in range(workers)]
+        size = len(available) // workers
+        return [available[i * size:(i + 1) * size] for i in range(workers)]
+    sets = [parse_cpu_list(part) for part in affinity.split(';')]
+    return [sets[i % len(sets)] for i in range(workers)]
+
+def create_socket(host, port, backlog=BACKLOG):
+    """Слушающий сокет, который наследуют воркеры"""
+    sock = socket.create_server((host, port), backlog=backlog)
+    sock.set_inheritable(True)
+    return sock
+
+class Supervisor:
+    """Запускает воркеров на общем сокете и перезапускает упавших"""
+
+    def __init__(self, args, server_args):
+        self.args = args
+        self.server_args = server_args
+        self.cpus = cpu_sets(args.workers, args.cpu_affinity)
+        self.socket = create_socket(args.host, args.port)
+        self.selector = selectors.DefaultSelector()
+        self.workers = {}  # id -> {'process', 'started', 'ready', 'delay', 'restart_at'}
+        self.stopping = False
+        self.all_ready = False
+
+    def spawn(self, worker_id):
+        read_fd, write_fd = os.pipe()
+        command = [
+            sys.executable, os.path.abspath(__file__), '--worker',
+            '--worker-id', str(worker_id), '--fd', str(self.socket.fileno()), '--ready-fd', str(write_fd),
+            '--host', self.args.host, '--port', str(self.args.port),
+            '--intra-op-threads', str(self.args.intra_op_threads),
+            '--inter-op-threads', str(self.args.inter_op_threads),
+            '--http-threads', str(self.args.http_threads),
+        ]
+        if self.cpus[worker_id] is not None:
+            command += ['--cpus', ','.join(map(str, self.cpus[worker_id]))]
+        process = subprocess.Popen(command + ['--'] + self.server_args,
+                                   pass_fds=(self.socket.fileno(), write_fd))
+        os.close(write_fd)
+        self.selector.register(read_fd, selectors.EVENT_READ, worker_id)
+        state = self.workers.setdefault(worker_id, {'delay': RESTART_DELAY})
+        state.update(process=process, started=time.monotonic(), ready=False, restart_at=None, ready_fd=read_fd)
+        cpus = f", ядра {self.cpus[worker_id]}" if self.cpus[worker_id] is not None else ""
+        print(f"[*] Воркер {worker_id} запущен (pid {process.pid}{cpus})", flush=True)
+
+    def _close_ready_fd(self, state):
+        if state.get('ready_fd') is not None:
+            self.selector.unregister(state['ready_fd'])
+            os.close(state['ready_fd'])
+            state['ready_fd'] = None
+
+    def _poll_ready(self, timeout):
+        for key, _ in self.selector.select(timeout):
+            state = self.workers[key.data]
+            if os.read(key.fd, 1):
+                state['ready'] = True
+                print(f"[OK] Воркер {key.data} готов ({time.monotonic() - state['started']:.1f} с)", flush=True)
+            self._close_ready_fd(state)
+        if not self.all_ready and all(state['ready'] for state in self.workers.values()):
+            self.all_ready = True
+            print(f"{READY_MESSAGE}: {len(self.workers)} на http://{self.args.host}:{self.args.port}", flush=True)
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker_id, state in self.workers.items():
+            if state['restart_at'] is not None:
+                if now >= state['restart_at']:
+                    self.spawn(worker_id)
+                continue
+            code = state['process'].poll()
+            if code is None:
+                continue
+            self._close_ready_fd(state)
+            uptime = now - state['started']
+            # Падение сразу после старта (например, нет модели): не перезапускаем в цикле без паузы
+            state['delay'] = min(state['delay'] * 2, MAX_RESTART_DELAY) if uptime < MIN_UPTIME else RESTART_DELAY
+            state['restart_at'] = now + state['delay']
+            print(f"[!] Воркер {worker_id} (pid {state['process'].pid}) завершился с кодом {code} "
+                  f"после {uptime:.1f} с, перезапуск через {state['delay']:.0f} с", flush=True)
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.args.workers):
+            self.spawn(worker_id)
+        try:
+            while not self.stopping:
+                self._poll_ready(0.5)
+                self._check_workers()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        print("[*] Останавливаем воркеров...", flush=True)
+        processes = [state['process'] for state in self.workers.values() if state['process'].poll() is None]
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.socket.close()
+
+def _exit_with_parent():
+    """Воркер завершается, если супервизор умер (иначе он держал бы порт)"""
+    parent = os.getppid()
+    while True:
+        time.sleep(1.0)
+        if os.getppid() != parent:
+            os._exit(1)
+
+def run_worker(args, server_args):
+    """Процесс-воркер: потоки TF, привязка к ядрам, загрузка модели, затем прием соединений"""
+    # Ctrl+C получает вся группа процессов; останавливает воркеров супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if args.cpus:
+        os.sched_setaffinity(0, parse_cpu_list(args.cpus))
+    if args.intra_op_threads:
+        # Пул OpenMP (oneDNN) читает переменную при импорте TF
+        os.environ['OMP_NUM_THREADS'] = str(args.intra_op_threads)
+    threading.Thread(target=_exit_with_parent, daemon=True).start()
+
+    import tensorflow as tf
+    from waitress import create_server
+
+    tf.config.threading.set_intra_op_parallelism_threads(args.intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(args.inter_op_threads)
+
+    import captcha_api
+    server_args = captcha_api.build_parser().parse_args(server_args)
+    if server_args.num_threads is None and args.intra_op_threads:
+        server_args.num_threads = args.intra_op_threads  # Потоки TFLite интерпретатора
+    captcha_api.configure(server_args)
+
+    server = create_server(captcha_api.app, sockets=[socket.socket(fileno=args.fd)], threads=args.http_threads)
+    with os.fdopen(args.ready_fd, 'wb') as ready:
+        ready.write(b'1')
+    server.run()
+
+def parse_layout(text):
+    """'2x4' -> (2 воркера, 4 intra-op потока)"""
+    workers, _, threads = text.lower().partition('x')
+    return int(workers), int(threads or DEFAULT_INTRA_OP_THREADS)
+
+def default_layouts():
+    """Раскладки воркеры x потоки, покрывающие все ядра, и один процесс с потоками TF по умолчанию"""
+    cores = len(os.sched_getaffinity(0))
+    layouts = [f"{workers}x{cores // workers}" for workers in range(1, cores + 1) if cores % workers == 0]
+    return layouts + ["1x0"]
+
+def start_layout(layout, port, affinity, server_args, log_path, timeout):
+    """Запускает serve.py с раскладкой и ждет готовности всех воркеров"""
+    workers, threads = parse_layout(layout)
+    log = open(log_path, 'w')
+    # Кеш результатов выключен: корпус load_test.py повторяется (явный --cache-size в server_args важнее)
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--workers', str(workers), '--intra-op-threads', str(threads),
+         '--port', str(port), '--cpu-affinity', affinity, '--', '--cache-size', '0'] + server_args,
+        stdout=subprocess.PIPE, stderr=log, text=True,
+    )
+    ready = threading.Event()
+
+    def forward_output():
+        for line in process.stdout:
+            log.write(line)
+            log.flush()
+            if line.startswith(READY_MESSAGE):
+                ready.set()
+
+    threading.Thread(target=forward_output, daemon=True).start()
+    deadline = time.monotonic() + timeout
+    while not ready.wait(0.5):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise SystemExit(f"[ERROR] Раскладка {layout} не запустилась, лог: {log_path}")
+    return process
+
+def benchmark(args, server_args):
+    """Нагрузочный тест (load_test.py) для каждой раскладки воркеры x потоки"""
+    from load_test import load_corpus, request_bodies, run_level, free_port, print_summary, SERVER_START_TIMEOUT
+
+    corpus = load_corpus(args.images, args.synthetic or (0 if args.images else 100))
+    layouts = args.layouts or default_layouts()
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    results = []
+    print(f"[*] Раскладки: {', '.join(layouts)}; cpu-affinity: {args.cpu_affinity}")
+    for layout in layouts:
+        port = free_port()
+        log_path = f"{os.path.splitext(args.output)[0]}_{layout}.log"
+        process = start_layout(layout, port, args.cpu_affinity, server_args, log_path, SERVER_START_TIMEOUT)
+        try:
+            print(f"\n[{layout}] воркеры x intra-op потоки (0 - по умолчанию TF)")
+            print(f"{'endpoint':>14} | {'conc.':>5} | {'rate':>6} | {'req.':>7} | {'req/s':>8} | {'img/s':>8} | "
+                  f"{'p50, ms':>8} | {'p95, ms':>8} | {'p99, ms':>8} | {'errors':>6}")
+            for endpoint in args.endpoints:
+                images_per_request = args.batch_size if endpoint == 'predict-batch' else 1
+                bodies = request_bodies(corpus, endpoint, args.batch_size)
+                for concurrency in args.concurrency:
+                    summary = run_level(f"http://127.0.0.1:{port}", endpoint, bodies, images_per_request,
+                                        concurrency, 0, args.duration, args.warmup, 30.0)
+                    summary['layout'] = layout
+                    print_summary(summary)
+                    results.append(summary)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+    print(f"\n{'layout':>8} | {'endpoint':>14} | {'conc.':>5} | {'img/s':>8} | {'p99, ms':>8}")
+    for summary in sorted(results, key=lambda item: -item.get('images_per_sec', 0)):
+        if summary['requests']:
+            print(f"{summary['layout']:>8} | {summary['endpoint']:>14} | {summary['concurrency']:>5} | "
+                  f"{summary['images_per_sec']:>8.1f} | {summary['latency_ms']['p99']:>8.1f}")
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'cpu_count': len(os.sched_getaffinity(0)),
+            'cpu_affinity': args.cpu_affinity,
+            'server_args': server_args,
+            'results': results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\n[OK] Результаты сохранены: {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Production запуск captcha_api.py (несколько воркеров)')
+    parser.add_argument('--host', default='127.0.0.1', help='Host address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5000, help='Port number (default: 5000)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Число процессов-воркеров')
+    parser.add_argument('--intra-op-threads', type=int, default=DEFAULT_INTRA_OP_THREADS,
+                        help='Потоки внутри одной операции TF на воркер (0 - по умолчанию TF)')
+    parser.add_argument('--inter-op-threads', type=int, default=DEFAULT_INTER_OP_THREADS,
+                        help='Параллельно выполняемые операции TF на воркер (0 - по умолчанию TF)')
+    parser.add_argument('--http-threads', type=int, default=DEFAULT_HTTP_THREADS,
+                        help=f'Потоков обработки запросов waitress на воркер (default: {DEFAULT_HTTP_THREADS})')
+    parser.add_argument('--cpu-affinity', default='none',
+                        help="Привязка воркеров к ядрам: none, auto или наборы '0-3;4-7'")
+    benchmark_group = parser.add_argument_group('benchmark')
+    benchmark_group.add_argument('--benchmark', action='store_true', help='Сравнить раскладки воркеры x потоки')
+    benchmark_group.add_argument('--layouts', nargs='+', default=None,
+                                 help='Раскладки WxT (по умолчанию - все делители числа ядер и 1x0)')
+    benchmark_group.add_argument('--images', default=None, help='Папка с изображениями для нагрузки')
+    benchmark_group.add_argument('--synthetic', type=int, default=0, help='Синтетических CAPTCHA для нагрузки')
+    benchmark_group.add_argument('--endpoints', nargs='+', choices=['predict', 'predict-batch'], default=['predict'])
+    benchmark_group.add_argument('--concurrency', type=int, nargs='+', default=[8], help='Уровни конкурентности')
+    benchmark_group.add_argument('--batch-size', type=int, default=8, help='Изображений в запросе /predict-batch')
+    benchmark_group.add_argument('--duration', type=float, default=15.0, help='Секунд замера на уровень')
+    benchmark_group.add_argument('--warmup', type=float, default=3.0, help='Секунд прогрева на уровень')
+    benchmark_group.add_argument('--output', default='output/serve_benchmark.json', help='Файл результатов')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-id', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--cpus', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('server_args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    server_args = args.server_args[1:] if args.server_args[:1] == ['--'] else args.server_args
+
+    if args.worker:
+        run_worker(args, server_args)
+    elif args.benchmark:
+        benchmark(args, server_args)
+    else:
+        Supervisor(args, server_args).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Генератор синтетических CAPTCHA
+
+Рисует CAPTCHA в стиле бывшего create_test_data() из train.py (символы с
+поворотом и смещением, шум), но:
+    - шрифт и повернутые глифы кешируются, а не загружаются на каждое изображение
+    - шум и искажения (синусоидальный сдвиг столбцов) - векторно в NumPy
+    - изображения рисуются в пуле процессов (fork; в процессе с TensorFlow
+      пул создается start_pool() до первой операции TF)
+    - результат детерминирован: изображение i зависит только от (seed, i),
+      а не от числа процессов
+
+Режимы:
+    write_dataset()  - PNG + labels.csv (формат train.py) или шарды .npz
+    tf_dataset()     - бесконечный поток батчей для tf.data (без записи на диск)
+
+Использование:
+    python synthetic_captcha.py --output data --count 1000 --seed 42
+    python synthetic_captcha.py --output synth --count 200000 --format npz --shard-size 20000 --workers 8
+    python synthetic_captcha.py --benchmark --count 2000
+"""
+
+import os
+import csv
+import time
+import atexit
+import argparse
+import warnings
+import functools
+import threading
+import multiprocessing
+from collections import deque
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_ALPHABET = "абвгдежзийклмнопрстуфхцчшщъыьэюя0123456789"
+IMG_WIDTH = 200
+IMG_HEIGHT = 60
+MIN_LENGTH = 4
+MAX_LENGTH = 6
+FONT_SIZE = 24
+NOISE_POINTS = 50
+WARP_AMPLITUDE = 2.0  # Максимальный вертикальный сдвиг столбцов, px
+CHUNK_SIZE = 64       # Изображений в одной задаче пула
+
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "C:/Windows/Fonts/arialbd.ttf",
+]
+
+@functools.lru_cache(maxsize=None)
+def _load_font(size=FONT_SIZE):
+    """Шрифт загружается один раз на процесс"""
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=4096)
+def _glyph(char, angle, size=FONT_SIZE):
+    """Повернутый глиф символа (RGBA), кешируется по (символ, угол)"""
+    glyph = Image.new('RGBA', (30, 40), (0, 0, 0, 0))
+    ImageDraw.Draw(glyph).text((0, 0), char, font=_load_font(size), fill='black')
+    return glyph.rotate(angle, expand=1)
+
+def random_text(rng, alphabet=DEFAULT_ALPHABET, min_length=MIN_LENGTH, max_length=MAX_LENGTH):
+    """Случайная строка длиной min_length..max_length"""
+    length = int(rng.integers(min_length, max_length + 1))
+    return ''.join(alphabet[i] for i in rng.integers(0, len(alphabet), size=length))
+
+def render_captcha(text, rng, width=IMG_WIDTH, height=IMG_HEIGHT):
+    """Рисует одну CAPTCHA: uint8 массив (height, width, 3)"""
+    img = Image.new('RGB', (width, height), color='white')
+    x = 10
+    for char in text:
+        glyph = _glyph(char, int(rng.integers(-10, 11)))
+        img.paste(glyph, (x, int(rng.integers(5, 16))), glyph)
+        x += 25 + int(rng.integers(-5, 6))
+    pixels = np.asarray(img).copy()
+
+    # Синусоидальный вертикальный сдвиг столбцов
+    amplitude = rng.uniform(0, WARP_AMPLITUDE)
+    if amplitude >= 0.5:
+        phase = rng.uniform(0, 2 * np.pi)
+        period = rng.uniform(0.5, 1.5) * width
+        shift = np.rint(amplitude * np.sin(2 * np.pi * np.arange(width) / period + phase)).astype(np.int64)
+        rows = np.clip(np.arange(height)[:, None] - shift[None, :], 0, height - 1)
+        pixels = pixels[rows, np.arange(width)[None, :]]
+
+    # Шумовые точки
+    ys = rng.integers(0, height, size=NOISE_POINTS)
+    xs = rng.integers(0, width, size=NOISE_POINTS)
+    pixels[ys, xs] = 128
+    return pixels
+
+def generate_chunk(start, count, seed, alphabet=DEFAULT_ALPHABET, min_length=MIN_LENGTH,
+                   max_length=MAX_LENGTH, width=IMG_WIDTH, height=IMG_HEIGHT, image_dir=None):
+    """
+    Изображения start..start+count-1 (выполняется в процессе пула).
+    Без image_dir возвращает (images uint8 (count, height, width, 3), texts),
+    с image_dir сохраняет PNG в воркере и возвращает (filenames, texts).
+    """
+    texts, images, filenames = [], [], []
+    for index in range(start, start + count):
+        # seed - число или кортеж чисел (например (seed, эпоха) в tf_dataset)
+        rng = np.random.default_rng([*np.atleast_1d(seed), index])
+        text = random_text(rng, alphabet, min_length, max_length)
+        pixels = render_captcha(text, rng, width, height)
+        texts.append(text)
+        if image_dir is None:
+            images.append(pixels)
+        else:
+            filename = f"captcha_{index:06d}.png"
+            path = os.path.join(image_dir, filename)
+            # Через временный файл: параллельные процессы не увидят недописанный PNG
+            tmp_path = f"{path}.tmp{os.getpid()}.png"
+            Image.fromarray(pixels).save(tmp_path)
+            os.replace(tmp_path, path)
+            filenames.append(filename)
+    if image_dir is not None:
+        return filenames, texts
+    return np.stack(images), texts
+
+_pools = {}
+
+def _thread_count():
+    """Потоков ОС в процессе (включая потоки TF, которых не видит threading)"""
+    try:
+        return len(os.listdir('/proc/self/task'))
+    except OSError:
+        return threading.active_count()
+
+def _pool_workers(workers):
+    workers = os.cpu_count() if workers is None else workers
+    return workers if 'fork' in multiprocessing.get_all_start_methods() else 1
+
+def start_pool(workers=None):
+    """
+    Создает пул процессов заранее, пока в процессе один поток.
+
+    fork копирует только вызывающий поток: если в этот момент потоки TF
+    держат блокировки, дочерний процесс может на них зависнуть. train.py
+    вызывает start_pool до первой операции TF, tf_dataset потом берет
+    готовый пул.
+    """
+    workers = _pool_workers(workers)
+    if workers > 1 and workers not in _pools:
+        _pools[workers] = multiprocessing.get_context('fork').Pool(workers)
+    return workers
+
+def _get_pool(workers):
+    """Пул процессов (один на число воркеров, закрывается при выходе); None - fork уже небезопасен"""
+    if workers not in _pools:
+        if _thread_count() > 1:
+            return None
+        start_pool(workers)
+    return _pools[workers]
+
+@atexit.register
+def _close_pools():
+    for pool in _pools.values():
+        pool.terminate()
+    _pools.clear()
+
+def generate(count=None, seed=0, workers=None, chunk_size=CHUNK_SIZE, start=0, **options):
+    """
+    Генератор чанков generate_chunk по порядку индексов; count=None - бесконечно.
+    В работе одновременно не больше 2 * workers чанков (ограничение памяти).
+    """
+    workers = _pool_workers(workers)
+    end = None if count is None else start + count
+
+    def chunks():
+        position = start
+        while end is None or position < end:
+            size = chunk_size if end is None else min(chunk_size, end - position)
+            yield position, size
+            position += size
+
+    pool = _get_pool(workers) if workers > 1 else None
+    if pool is None:
+        if workers > 1:
+            warnings.warn(f"Пул из {workers} процессов не создан заранее (start_pool), а в процессе уже "
+                          "несколько потоков: fork небезопасен, генерация в одном процессе")
+        for position, size in chunks():
+            yield generate_chunk(position, size, seed, **options)
+        return
+
+    pending = deque()
+    for position, size in chunks():
+        pending.append(pool.apply_async(generate_chunk, (position, size, seed), options))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def write_dataset(output_dir, count, seed=0, workers=None, output_format='png', shard_size=10000, **options):
+    """
+    Записывает датасет:
+        png - output_dir/images/captcha_XXXXXX.png + output_dir/labels.csv (формат train.py)
+        npz - output_dir/shard_XXXXX.npz (images uint8 (N, height, width, 3), texts)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if output_format == 'png':
+        image_dir = os.path.join(output_dir, 'images')
+        os.makedirs(image_dir, exist_ok=True)
+        rows = []
+        for filenames, texts in generate(count, seed, workers, image_dir=image_dir, **options):
+            reported = len(rows) // 1000
+            rows.extend(zip(texts, filenames))
+            if len(rows) // 1000 > reported:
+                print(f"Создано {len(rows)}/{count} изображений...")
+        labels_file = os.path.join(output_dir, 'labels.csv')
+        tmp_file = f"{labels_file}.tmp{os.getpid()}"
+        with open(tmp_file, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f, delimiter=';').writerows(rows)
+        os.replace(tmp_file, labels_file)
+        return labels_file, image_dir
+
+    if output_format != 'npz':
+        raise ValueError(f"Неизвестный формат '{output_format}', доступны: png, npz")
+    shard_paths = []
+    for shard_id, shard_start in enumerate(range(0, count, shard_size)):
+        size = min(shard_size, count - shard_start)
+        images, texts = [], []
+        for chunk_images, chunk_texts in generate(size, seed, workers, start=shard_start, **options):
+            images.append(chunk_images)
+            texts.extend(chunk_texts)
+        path = os.path.join(output_dir, f"shard_{shard_id:05d}.npz")
+        np.savez(path, images=np.concatenate(images), texts=np.asarray(texts))
+        shard_paths.append(path)
+        print(f"Шард {path}: {size} изображений")
+    return shard_paths
+
+def encode_labels(texts, char_to_num, max_sequence_length):
+    """Тексты -> метки int32 (N, max_sequence_length), дополненные -1 как в train.py"""
+    labels = np.full((len(texts), max_sequence_length), -1, dtype=np.int32)
+    for i, text in enumerate(texts):
+        encoded = [char_to_num[c] for c in text[:max_sequence_length]]
+        labels[i, :len(encoded)] = encoded
+    return labels
+
+def tf_dataset(batch_size, char_to_num, max_sequence_length, seed=0, workers=None, transpose=True,
+               epoch=None, **options):
+    """
+    Бесконечный tf.data поток батчей {'image': uint8, 'label': int32} для model.fit.
+
+    Каждый проход по датасету (эпоха) начинается с нового seed (seed, эпоха),
+    поэтому dataset.take(steps) дает новые изображения в каждой эпохе.
+    transpose=True - изображения (width, height, 3), как в encode_single_sample.
+    epoch - функция, возвращающая номер текущей эпохи (например, при возобновлении
+    обучения); по умолчанию эпохи считаются с нуля.
+    """
+    import tensorflow as tf
+
+    width = options.get('width', IMG_WIDTH)
+    height = options.get('height', IMG_HEIGHT)
+    image_shape = (width, height, 3) if transpose else (height, width, 3)
+    counter = [0]
+
+    def batches():
+        current = epoch() if epoch is not None else counter[0]
+        counter[0] += 1
+        epoch_seed = (*np.atleast_1d(seed), current)
+        for images, texts in generate(None, epoch_seed, workers, chunk_size=batch_size, **options):
+            if transpose:
+                images = images.transpose(0, 2, 1, 3)
+            yield {'image': images, 'label': encode_labels(texts, char_to_num, max_sequence_length)}
+
+    return tf.data.Dataset.from_generator(batches, output_signature={
+        'image': tf.TensorSpec((batch_size,) + image_shape, tf.uint8),
+        'label': tf.TensorSpec((batch_size, max_sequence_length), tf.int32),
+    }).prefetch(tf.data.AUTOTUNE)
+
+def _legacy_render(text, width=IMG_WIDTH, height=IMG_HEIGHT):
+    """Рисование как в старом create_test_data (для сравнения скорости)"""
+    import random
+    img = Image.new('RGB', (width, height), color='white')
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.truetype(FONT_PATHS[0], FONT_SIZE)
+    except OSError:
+        font = ImageFont.load_default()
+    x = 10
+    for char in text:
+        char_img = Image.new('RGBA', (30, 40), (0, 0, 0, 0))
+        ImageDraw.Draw(char_img).text((0, 0), char, font=font, fill='black')
+        char_img = char_img.rotate(random.randint(-10, 10), expand=1)
+        img.paste(char_img, (x, random.randint(5, 15)), char_img)
+        x += 25 + random.randint(-5, 5)
+    for _ in range(NOISE_POINTS):
+        draw.point((random.randint(0, width - 1), random.randint(0, height - 1)), fill='gray')
+    return img
+
+def benchmark(count, workers):
+    """Изображений/сек: старый цикл create_test_data vs генератор (1 процесс и пул)"""
+    rng = np.random.default_rng(0)
+    texts = [random_text(rng) for _ in range(count)]
+    start = time.perf_counter()
+    for text in texts:
+        _legacy_render(text)
+    legacy = count / (time.perf_counter() - start)
+    print(f"create_test_data (старый):      {legacy:>10.0f} изображений/сек")
+
+    for n in sorted({1, workers}):
+        start = time.perf_counter()
+        total = sum(len(texts) for _, texts in generate(count, seed=0, workers=n))
+        rate = total / (time.perf_counter() - start)
+        print(f"synthetic_captcha ({n} процесс.): {rate:>10.0f} изображений/сек ({rate / legacy:.1f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор синтетических CAPTCHA')
+    parser.add_argument('--output', '-o', default='data', help='Папка для датасета')
+    parser.add_argument('--count', '-n', type=int, default=1000, help='Число изображений')
+    parser.add_argument('--seed', type=int, default=42, help='Seed (одинаковый seed - одинаковый датасет)')
+    parser.add_argument('--workers', type=int, default=None, help='Процессов (по умолчанию - все ядра)')
+    parser.add_argument('--format', choices=['png', 'npz'], default='png',
+                        help='png + labels.csv (для train.py) или шарды .npz')
+    parser.add_argument('--shard-size', type=int, default=10000, help='Изображений в шарде .npz')
+    parser.add_argument('--alphabet', default=DEFAULT_ALPHABET, help='Алфавит')
+    parser.add_argument('--min-length', type=int, default=MIN_LENGTH, help='Минимальная длина текста')
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH, help='Максимальная длина текста')
+    parser.add_argument('--benchmark', action='store_true', help='Сравнить скорость со старым create_test_data')
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count()
+    if args.benchmark:
+        benchmark(args.count, workers)
+        return
+
+    start = time.perf_counter()
+    write_dataset(args.output, args.count, seed=args.seed, workers=workers, output_format=args.format,
+                  shard_size=args.shard_size, alphabet=args.alphabet,
+                  min_length=args.min_length, max_length=args.max_length)
+    elapsed = time.perf_counter() - start
+    print(f"[OK] {args.count} изображений в {args.output} за {elapsed:.1f} с ({args.count / elapsed:.0f} изображений/сек)")
+
+if __name__ == "__main__":
+    main()
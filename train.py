@@ -1,5 +1,3 @@
-
-
 """
 CAPTCHA OCR Model - Adapted from Kaggle notebook
 Версия для современного TensorFlow и локального запуска
@@ -9,6 +7,12 @@ CAPTCHA OCR Model - Adapted from Kaggle notebook
 # КОНСТАНТЫ И НАСТРОЙКИ
 # ========================================
 import os
+import csv
+import json
+import time
+import argparse
+import resource
+from collections import deque
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -50,84 +54,15 @@ for path in possible_img_folders:
         IMG_FOLDER = path
         break
 
-def create_test_data():
-    """Создает тестовые CAPTCHA данные для демонстрации"""
-    import random
-    import string
-    from PIL import Image, ImageDraw, ImageFont
-    import csv
-    
-    print("Создаем тестовые CAPTCHA изображения...")
-    
-    # Русские символы для CAPTCHA
-    russian_chars = "абвгдежзийклмнопрстуфхцчшщъыьэюя0123456789"
-    
-    # Создаем 1000 тестовых изображений
-    labels_data = []
-    
-    for i in range(1000):
-        # Генерируем случайный текст длиной 4-6 символов
-        text_length = random.randint(4, 6)
-        text = ''.join(random.choices(russian_chars, k=text_length))
-        
-        # Создаем изображение
-        img = Image.new('RGB', (200, 60), color='white')
-        draw = ImageDraw.Draw(img)
-        
-        # Пытаемся использовать системный шрифт
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 24)
-        except:
-            font = ImageFont.load_default()
-        
-        # Рисуем текст с небольшими искажениями
-        x = 10
-        for char in text:
-            y = random.randint(5, 15)
-            angle = random.randint(-10, 10)
-            
-            # Поворачиваем символ
-            char_img = Image.new('RGBA', (30, 40), (0, 0, 0, 0))
-            char_draw = ImageDraw.Draw(char_img)
-            char_draw.text((0, 0), char, font=font, fill='black')
-            char_img = char_img.rotate(angle, expand=1)
-            
-            img.paste(char_img, (x, y), char_img)
-            x += 25 + random.randint(-5, 5)
-        
-        # Добавляем шум
-        for _ in range(50):
-            x = random.randint(0, 199)
-            y = random.randint(0, 59)
-            draw.point((x, y), fill='gray')
-        
-        # Сохраняем изображение
-        filename = f"captcha_{i:04d}.png"
-        img_path = os.path.join(IMG_FOLDER, filename)
-        img.save(img_path)
-        
-        labels_data.append([text, filename])
-        
-        if (i + 1) % 100 == 0:
-            print(f"Создано {i + 1}/1000 изображений...")
-    
-    # Сохраняем метки
-    with open(LABELS_FILE, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f, delimiter=';')
-        writer.writerows(labels_data)
-    
-    print(f"✓ Создано 1000 тестовых изображений в {IMG_FOLDER}")
-    print(f"✓ Создан файл меток {LABELS_FILE}")
-
 # Если данные не найдены, создаем тестовые
 if LABELS_FILE is None or IMG_FOLDER is None:
     print("⚠ Данные не найдены! Создаем тестовые данные...")
-    os.makedirs("data/images", exist_ok=True)
-    LABELS_FILE = "data/labels.csv"
-    IMG_FOLDER = "data/images"
+    from synthetic_captcha import write_dataset
     
-    # Создаем тестовые данные
-    create_test_data()
+    # Создаем тестовые данные (детерминированно: одинаковые у всех воркеров распределенного обучения)
+    LABELS_FILE, IMG_FOLDER = write_dataset("data", count=1000, seed=42)
+    print(f"✓ Создано 1000 тестовых изображений в {IMG_FOLDER}")
+    print(f"✓ Создан файл меток {LABELS_FILE}")
 
 # Параметры обучения
 EPOCHS = 15  # Увеличено для лучшей точности
@@ -150,14 +85,167 @@ IMG_WIDTH = 200
 IMG_HEIGHT = 60
 IMG_CHANNELS = 3
 
+# Изображения хранятся и подаются в модель как uint8, деление на 255 - слой модели.
+# TRANSPOSE_IN_MODEL=True переносит в модель и транспонирование (height, width) -> (width, height):
+# тогда вход модели - обычное изображение (height, width, channels).
+TRANSPOSE_IN_MODEL = False
+INPUT_SHAPE = (IMG_HEIGHT, IMG_WIDTH, IMG_CHANNELS) if TRANSPOSE_IN_MODEL else (IMG_WIDTH, IMG_HEIGHT, IMG_CHANNELS)
+
+# Кеш предобработанного датасета (uint8 шарды, см. dataset_cache.py)
+USE_DATASET_CACHE = True
+CACHE_DIR = "cache"
+REBUILD_CACHE = False
+
+# Ускорение обучения (сравнивайте режимы по изображениям/сек в output/throughput.json)
+USE_XLA = False          # XLA (jit_compile) для conv/dense части; CTC loss остается вне XLA
+MIXED_PRECISION = False  # bfloat16 mixed precision (если CPU поддерживает bf16), softmax и CTC в float32
+
+# Распределенное обучение (MultiWorkerMirroredStrategy): включается флагом --distributed,
+# переменной окружения TF_CONFIG или флагами --worker-hosts/--task-index.
+# BATCH_SIZE - батч одного воркера, глобальный батч = BATCH_SIZE * число воркеров.
+# Локальный запуск нескольких воркеров: python launch_distributed.py --workers 2
+DISTRIBUTED = False
+
+# Синтетические данные на лету (synthetic_captcha.py): если > 0, обучение идет на бесконечном
+# потоке сгенерированных CAPTCHA, SYNTHETIC_STEPS_PER_EPOCH батчей за эпоху; валидация - реальные данные
+SYNTHETIC_STEPS_PER_EPOCH = 0
+SYNTHETIC_WORKERS = None  # Процессов генератора (None = все ядра)
+
+# Аугментация обучающих батчей внутри tf.data (augmentation.py): сдвиг/поворот, шум, размытие,
+# контраст, линии. Вероятности преобразований: None = augmentation.DEFAULT_PROBABILITIES
+AUGMENT = False
+AUGMENT_PROBABILITIES = None
+
+# Чекпоинты для возобновления обучения (training_checkpoint.py): в конце каждой эпохи и каждые
+# CHECKPOINT_EVERY_STEPS батчей (0 = только по эпохам), хранятся последние CHECKPOINT_KEEP.
+# После перезапуска обучение продолжается с того же батча; после успешного завершения папка удаляется
+USE_CHECKPOINTS = True
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_EVERY_STEPS = 500
+CHECKPOINT_KEEP = 3
+
+# Инструментирование обучения: время каждого шага, ожидание входного пайплайна, изображений/сек
+# и пиковая память процесса пишутся в INSTRUMENT_FILE (.csv или .jsonl). PROFILE_STEPS = "START-END"
+# (глобальные шаги) - трасса TensorBoard profiler в PROFILE_DIR: tensorboard --logdir output/profile
+INSTRUMENT = False
+INSTRUMENT_FILE = "output/training_steps.csv"
+PROFILE_STEPS = None
+PROFILE_DIR = "output/profile"
+
+# Параметры командной строки (parse_known_args - чтобы скрипт работал и в Jupyter/Kaggle)
+parser = argparse.ArgumentParser(description='CAPTCHA OCR training')
+parser.add_argument('--no-cache', action='store_true', help='Декодировать изображения из файлов без кеша')
+parser.add_argument('--rebuild-cache', action='store_true', help='Пересобрать кеш датасета')
+parser.add_argument('--cache-dir', default=CACHE_DIR, help=f'Папка кеша (по умолчанию: {CACHE_DIR})')
+parser.add_argument('--xla', action='store_true', help='XLA компиляция conv/dense части модели')
+parser.add_argument('--mixed-precision', action='store_true', help='bfloat16 mixed precision')
+parser.add_argument('--distributed', action='store_true', help='MultiWorkerMirroredStrategy (кластер из TF_CONFIG)')
+parser.add_argument('--worker-hosts', default=None, help='Воркеры через запятую: host1:port,host2:port (вместо TF_CONFIG)')
+parser.add_argument('--task-index', type=int, default=0, help='Индекс этого воркера в --worker-hosts')
+parser.add_argument('--synthetic-steps', type=int, default=SYNTHETIC_STEPS_PER_EPOCH,
+                    help='Обучать на синтетических CAPTCHA: число батчей за эпоху (0 = выключено)')
+parser.add_argument('--augment', action='store_true', help='Аугментация обучающих батчей')
+parser.add_argument('--augment-probs', default=None,
+                    help='Вероятности преобразований, например affine=0.5,noise=0.3,blur=0,contrast=0.3,occlusion=0.2')
+parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR, help=f'Папка чекпоинтов (по умолчанию: {CHECKPOINT_DIR})')
+parser.add_argument('--checkpoint-steps', type=int, default=CHECKPOINT_EVERY_STEPS,
+                    help='Чекпоинт каждые N батчей (0 = только в конце эпохи)')
+parser.add_argument('--checkpoint-keep', type=int, default=CHECKPOINT_KEEP, help='Сколько последних чекпоинтов хранить')
+parser.add_argument('--no-checkpoints', action='store_true', help='Не сохранять чекпоинты')
+parser.add_argument('--no-resume', action='store_true', help='Удалить старые чекпоинты и начать обучение заново')
+parser.add_argument('--instrument', action='store_true', help='Метрики каждого шага обучения в --instrument-file')
+parser.add_argument('--instrument-file', default=INSTRUMENT_FILE,
+                    help=f'Файл метрик шагов, .csv или .jsonl (по умолчанию: {INSTRUMENT_FILE})')
+parser.add_argument('--profile-steps', default=PROFILE_STEPS,
+                    help=f'Трасса TensorBoard profiler для глобальных шагов START-END (в {PROFILE_DIR})')
+ARGS, _ = parser.parse_known_args()
+
+USE_DATASET_CACHE = USE_DATASET_CACHE and not ARGS.no_cache
+CACHE_DIR = ARGS.cache_dir
+REBUILD_CACHE = REBUILD_CACHE or ARGS.rebuild_cache
+USE_XLA = USE_XLA or ARGS.xla
+MIXED_PRECISION = MIXED_PRECISION or ARGS.mixed_precision
+SYNTHETIC_STEPS_PER_EPOCH = ARGS.synthetic_steps
+if SYNTHETIC_STEPS_PER_EPOCH:
+    # Пул генератора - до первой операции TF: fork процесса с запущенными потоками TF может зависнуть
+    from synthetic_captcha import start_pool
+    start_pool(SYNTHETIC_WORKERS)
+AUGMENT = AUGMENT or ARGS.augment or ARGS.augment_probs is not None
+if ARGS.augment_probs is not None:
+    from augmentation import parse_probabilities
+    AUGMENT_PROBABILITIES = parse_probabilities(ARGS.augment_probs)
+USE_CHECKPOINTS = USE_CHECKPOINTS and not ARGS.no_checkpoints
+CHECKPOINT_DIR = ARGS.checkpoint_dir
+CHECKPOINT_EVERY_STEPS = ARGS.checkpoint_steps
+CHECKPOINT_KEEP = ARGS.checkpoint_keep
+INSTRUMENT = INSTRUMENT or ARGS.instrument or ARGS.profile_steps is not None
+INSTRUMENT_FILE = ARGS.instrument_file
+PROFILE_STEPS = ARGS.profile_steps
+
+if ARGS.worker_hosts:
+    os.environ['TF_CONFIG'] = json.dumps({
+        'cluster': {'worker': ARGS.worker_hosts.split(',')},
+        'task': {'type': 'worker', 'index': ARGS.task_index},
+    })
+DISTRIBUTED = DISTRIBUTED or ARGS.distributed or 'TF_CONFIG' in os.environ
+
+# Стратегию нужно создать до любых других операций TensorFlow
+if DISTRIBUTED:
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    resolver = strategy.cluster_resolver
+    cluster = resolver.cluster_spec().as_dict()
+    NUM_WORKERS = len(cluster.get('worker', [])) + len(cluster.get('chief', []))
+    WORKER_NAME = f"{resolver.task_type}:{resolver.task_id}"
+    # Chief - задача 'chief' или worker:0, если отдельного chief в кластере нет
+    IS_CHIEF = resolver.task_type == 'chief' or (
+        resolver.task_type == 'worker' and resolver.task_id == 0 and 'chief' not in cluster
+    )
+else:
+    strategy = tf.distribute.get_strategy()
+    NUM_WORKERS = 1
+    WORKER_NAME = "local"
+    IS_CHIEF = True
+GLOBAL_BATCH_SIZE = BATCH_SIZE * strategy.num_replicas_in_sync
+
+def cpu_supports_bf16():
+    """Есть ли у CPU инструкции bfloat16 (AVX512_BF16 / AMX_BF16)"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+if MIXED_PRECISION:
+    if cpu_supports_bf16():
+        keras.mixed_precision.set_global_policy("mixed_bfloat16")
+    else:
+        print("⚠ CPU не поддерживает bfloat16, mixed precision отключен")
+        MIXED_PRECISION = False
+
 print("="*60)
 print("КОНФИГУРАЦИЯ")
 print("="*60)
 print(f"EPOCHS: {EPOCHS}")
 print(f"BATCH_SIZE: {BATCH_SIZE}")
+if DISTRIBUTED:
+    print(f"DISTRIBUTED: {WORKER_NAME} из {NUM_WORKERS} воркеров (chief: {IS_CHIEF}), "
+          f"глобальный батч {GLOBAL_BATCH_SIZE}")
 print(f"USE_FULL_DATASET: {USE_FULL_DATASET}")
+print(f"USE_DATASET_CACHE: {USE_DATASET_CACHE}" + (f" ({CACHE_DIR})" if USE_DATASET_CACHE else ""))
+print(f"XLA: {USE_XLA}, MIXED_PRECISION: {'mixed_bfloat16' if MIXED_PRECISION else 'float32'}")
 if not USE_FULL_DATASET:
     print(f"MAX_SAMPLES: {MAX_SAMPLES}")
+if SYNTHETIC_STEPS_PER_EPOCH:
+    print(f"SYNTHETIC: {SYNTHETIC_STEPS_PER_EPOCH} батчей синтетических CAPTCHA за эпоху")
+if AUGMENT:
+    print(f"AUGMENT: {AUGMENT_PROBABILITIES or 'вероятности по умолчанию'}")
+if INSTRUMENT:
+    print(f"INSTRUMENT: {INSTRUMENT_FILE}" + (f", профилирование шагов {PROFILE_STEPS}" if PROFILE_STEPS else ""))
+if USE_CHECKPOINTS:
+    print(f"CHECKPOINTS: {CHECKPOINT_DIR} (каждую эпоху" +
+          (f" и каждые {CHECKPOINT_EVERY_STEPS} батчей" if CHECKPOINT_EVERY_STEPS else "") +
+          f", хранить {CHECKPOINT_KEEP})")
 print("="*60)
 
 # ========================================
@@ -199,22 +287,18 @@ print(f"Алфавит ({len(characters)} символов): {characters}")
 
 print("\n[БЛОК 3] Определение функций предобработки...")
 
-def encode_single_sample(filename):
-    """Загружает и предобрабатывает изображение"""
-    img_path = os.path.join(IMG_FOLDER, filename)
+def encode_single_sample(img_path, label):
+    """Загружает изображение как uint8 (выполняется внутри графа tf.data, нормализация - в модели)"""
     img = tf.io.read_file(img_path)
     
-    try:
-        img = tf.io.decode_png(img, channels=3)
-    except Exception as e:
-        print(f"Ошибка с файлом {img_path}: {e}")
-        # Пробуем JPEG
-        img = tf.io.decode_jpeg(img, channels=3)
+    # decode_image сам определяет PNG / JPEG
+    img = tf.io.decode_image(img, channels=IMG_CHANNELS, expand_animations=False)
     
-    img = tf.image.convert_image_dtype(img, tf.float32)
-    img = tf.transpose(img, perm=[1, 0, 2])  # (width, height, channels)
+    if not TRANSPOSE_IN_MODEL:
+        img = tf.transpose(img, perm=[1, 0, 2])  # (width, height, channels)
+    img = tf.ensure_shape(img, INPUT_SHAPE)
     
-    return img.numpy()
+    return {'image': img, 'label': label}
 
 print("Функции предобработки определены")
 
@@ -226,8 +310,7 @@ print("Функции предобработки определены")
 print("\n[БЛОК 4] Создание обучающих данных...")
 
 def create_train_and_validation_datasets():
-    X, y = [], []
-    
+    """Пути к файлам, закодированные метки и индексы train/val; изображения декодируются в БЛОКЕ 8"""
     items = list(data.items())
     
     if USE_FULL_DATASET:
@@ -243,7 +326,7 @@ def create_train_and_validation_datasets():
     
     y_texts, filenames = zip(*train_dataset)
     
-    print(f"Кодируем {len(filenames)} изображений...")
+    print(f"Кодируем метки {len(filenames)} изображений...")
     
     # Сначала создаем y_list, фильтруя невалидные данные
     y_list = []
@@ -263,25 +346,37 @@ def create_train_and_validation_datasets():
     if skipped > 0:
         print(f"Всего пропущено: {skipped} записей с невалидными символами")
     
-    # Теперь загружаем только валидные изображения
-    X = np.asarray([encode_single_sample(fn) for fn in valid_filenames])
+    # Изображения не загружаем: храним только пути к файлам
+    paths = np.asarray([os.path.join(IMG_FOLDER, fn) for fn in valid_filenames])
     
     # Применяем padding
     y = tf.keras.preprocessing.sequence.pad_sequences(y_list, MAX_SEQUENCE_LENGTH, padding='post', value=-1)
     
-    print(f"Форма X: {X.shape}")
+    print(f"Файлов: {len(paths)}")
     print(f"Форма y: {y.shape}")
     
-    # Разделение на train/val
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=TEST_SIZE, shuffle=True, random_state=RANDOM_STATE
+    # Разделение на train/val по индексам (пиксели не копируются)
+    train_idx, val_idx = train_test_split(
+        np.arange(len(paths)), test_size=TEST_SIZE, shuffle=True, random_state=RANDOM_STATE
     )
     
-    return X_train, X_val, y_train, y_val, test_dataset
+    return paths, y, train_idx, val_idx, test_dataset
 
-X_train, X_val, y_train, y_val, test_dataset = create_train_and_validation_datasets()
+paths, y, train_idx, val_idx, test_dataset = create_train_and_validation_datasets()
+y_train, y_val = y[train_idx], y[val_idx]
 
-print(f"Разделение на train/val: X_train={X_train.shape}, X_val={X_val.shape}")
+print(f"Разделение на train/val: train={len(train_idx)}, val={len(val_idx)}")
+
+# Кеш: декодируем все изображения один раз, следующие запуски читают uint8 шарды через mmap
+cached_dataset = None
+if USE_DATASET_CACHE:
+    from dataset_cache import get_or_build_cache
+    
+    cached_dataset = get_or_build_cache(
+        CACHE_DIR, LABELS_FILE, paths, y, INPUT_SHAPE, transpose=not TRANSPOSE_IN_MODEL,
+        params={'characters': characters, 'max_sequence_length': MAX_SEQUENCE_LENGTH},
+        rebuild=REBUILD_CACHE
+    )
 
 # ========================================
 # БЛОК 5: Визуализация данных
@@ -291,33 +386,35 @@ print(f"Разделение на train/val: X_train={X_train.shape}, X_val={X_v
 print("\n[БЛОК 5] Визуализация примеров...")
 
 # Проверяем что данные загружены
-if 'X_train' not in globals() or 'X_val' not in globals():
+if 'train_idx' not in globals() or 'val_idx' not in globals():
     print("❌ ОШИБКА: Данные не загружены!")
     print("Вы должны сначала запустить ячейки БЛОК 1-4 (cells 1-5)")
     print("Пожалуйста, запустите все предыдущие ячейки по порядку")
-    raise NameError("X_train не определен. Запустите ячейки 1-5 перед этой ячейкой.")
+    raise NameError("train_idx не определен. Запустите ячейки 1-5 перед этой ячейкой.")
 
-fig, axes = plt.subplots(2, 4, figsize=(20, 10))
-axes[0, 0].imshow(X_train[0], cmap='gray')
-axes[0, 0].set_title(f'X_train[0]: {list(y_train[0])}')
-axes[0, 0].axis('off')
+def sample_image(index):
+    """Один пример для визуализации (из кеша или из файла)"""
+    if cached_dataset is not None:
+        return cached_dataset.gather([index])[0]
+    return encode_single_sample(paths[index], y[index])['image'].numpy()
 
-axes[0, 1].imshow(X_train[min(135, len(X_train)-1)], cmap='gray')
-axes[0, 1].set_title(f'X_train[135]: {list(y_train[min(135, len(y_train)-1)])}')
-axes[0, 1].axis('off')
-
-axes[1, 0].imshow(X_val[0], cmap='gray')
-axes[1, 0].set_title(f'X_val[0]: {list(y_val[0])}')
-axes[1, 0].axis('off')
-
-axes[1, 1].imshow(X_val[min(23, len(X_val)-1)], cmap='gray')
-axes[1, 1].set_title(f'X_val[23]: {list(y_val[min(23, len(y_val)-1)])}')
-axes[1, 1].axis('off')
+fig, axes = plt.subplots(2, 4, figsize=(20, 10))
+for ax, (name, indices, position) in zip(
+    [axes[0, 0], axes[0, 1], axes[1, 0], axes[1, 1]],
+    [('train', train_idx, 0), ('train', train_idx, 135), ('val', val_idx, 0), ('val', val_idx, 23)]
+):
+    position = min(position, len(indices) - 1)
+    index = indices[position]
+    img, label = sample_image(index), list(y[index])
+    ax.imshow(img, cmap='gray')
+    ax.set_title(f'{name}[{position}]: {label}')
+    ax.axis('off')
 
 plt.tight_layout()
-os.makedirs("output", exist_ok=True)
-plt.savefig('output/dataset_samples.png')
-print("Примеры сохранены в output/dataset_samples.png")
+if IS_CHIEF:
+    os.makedirs("output", exist_ok=True)
+    plt.savefig('output/dataset_samples.png')
+    print("Примеры сохранены в output/dataset_samples.png")
 
 # ========================================
 # БЛОК 6: Определение CTCLayer
@@ -328,8 +425,8 @@ print("\n[БЛОК 6] Определение CTCLayer...")
 
 class CTCLayer(layers.Layer):
     """CTC Loss Layer для обучения"""
-    def __init__(self, name=None):
-        super().__init__(name=name)
+    def __init__(self, name=None, **kwargs):
+        super().__init__(name=name, **kwargs)
         self.loss_fn = keras.backend.ctc_batch_cost
 
     def call(self, y_true, y_pred):
@@ -356,12 +453,22 @@ print("\n[БЛОК 7] Построение модели...")
 
 def build_model():
     """Создает OCR CNN-LSTM модель"""
-    input_img = layers.Input(shape=(IMG_WIDTH, IMG_HEIGHT, IMG_CHANNELS), name="image", dtype="float32") 
+    input_img = layers.Input(shape=INPUT_SHAPE, name="image", dtype="uint8")
     labels = layers.Input(name="label", shape=(MAX_SEQUENCE_LENGTH,), dtype="float32")
 
+    # При XLA conv/dense часть - отдельная подмодель, которая компилируется целиком
+    features_input = input_img
+    if USE_XLA:
+        features_input = layers.Input(shape=INPUT_SHAPE, name="features_image", dtype="uint8")
+
+    # Нормализация (и при необходимости транспонирование) внутри модели
+    x = layers.Rescaling(1.0 / 255, name="rescale")(features_input)
+    if TRANSPOSE_IN_MODEL:
+        x = layers.Permute((2, 1, 3), name="transpose")(x)  # (width, height, channels)
+
     # Первый conv блок
     x = layers.Conv2D(32, (3, 3), activation="relu", kernel_initializer="he_normal", 
-                      padding="same", name="Conv1")(input_img)
+                      padding="same", name="Conv1")(x)
     x = layers.MaxPooling2D((2, 2), name="pool1")(x)
 
     # Второй conv блок
@@ -372,17 +479,24 @@ def build_model():
     # Reshape для RNN
     x = layers.Reshape(target_shape=(50, 960), name="reshape")(x)
     x = layers.Dense(64, activation="relu", name="dense1")(x)
+
+    if USE_XLA:
+        # CTC loss не компилируется XLA, поэтому jit_compile только для этой части
+        features = keras.models.Model(features_input, x, name="features")
+        features.call = tf.function(features.call, jit_compile=True)
+        x = features(input_img)
+
     x = layers.Dropout(0.2)(x)
 
     # RNN слои
     x = layers.Bidirectional(layers.LSTM(128, return_sequences=True, dropout=0.25))(x)
     x = layers.Bidirectional(layers.LSTM(64, return_sequences=True, dropout=0.25))(x)
 
-    # Output layer
-    x = layers.Dense(len(characters) + 1, activation="softmax", name="dense2")(x)
+    # Output layer (softmax и CTC всегда в float32, в том числе при mixed precision)
+    x = layers.Dense(len(characters) + 1, activation="softmax", name="dense2", dtype="float32")(x)
 
     # CTC layer
-    output = CTCLayer(name="ctc_loss")(labels, x)
+    output = CTCLayer(name="ctc_loss", dtype="float32")(labels, x)
 
     # Определяем модель
     model = keras.models.Model(inputs=[input_img, labels], outputs=output, name="ocr_cnn_lstm_model")
@@ -391,7 +505,9 @@ def build_model():
     model.compile(optimizer=keras.optimizers.Adam())
     return model
 
-model = build_model()
+# Переменные модели и оптимизатора создаются в scope стратегии (зеркалируются между воркерами)
+with strategy.scope():
+    model = build_model()
 print("\nСводка модели:")
 model.summary()
 
@@ -402,15 +518,114 @@ model.summary()
 
 print("\n[БЛОК 8] Создание TensorFlow datasets...")
 
-train_dataset = tf.data.Dataset.from_tensor_slices((X_train, y_train))
-train_dataset = train_dataset.map(
-    lambda x, y: {'image': x, 'label': y}
-).batch(BATCH_SIZE).prefetch(buffer_size=tf.data.AUTOTUNE)
-
-validation_dataset = tf.data.Dataset.from_tensor_slices((X_val, y_val))
-validation_dataset = validation_dataset.map(
-    lambda x, y: {'image': x, 'label': y}
-).batch(BATCH_SIZE).prefetch(buffer_size=tf.data.AUTOTUNE)
+def load_cached_batch(indices):
+    """Батч uint8 изображений из кеша по индексам"""
+    images = tf.numpy_function(cached_dataset.gather, [indices], tf.uint8)
+    images = tf.ensure_shape(images, (None,) + INPUT_SHAPE)
+    return {'image': images, 'label': tf.gather(cached_labels, indices)}
+
+if AUGMENT:
+    from augmentation import make_augmenter, measure_throughput
+    augment_images = make_augmenter(AUGMENT_PROBABILITIES, transposed=not TRANSPOSE_IN_MODEL)
+
+def augment_batch(batch):
+    """Аугментация батча: uint8 той же формы, что и после encode_single_sample"""
+    return {'image': augment_images(batch['image']), 'label': batch['label']}
+
+# Порядок обучающих примеров зависит только от (RANDOM_STATE, эпоха): pipeline_epoch читается
+# при каждом проходе по датасету, его выставляет ResumableCheckpoint (БЛОК 9). Поэтому после
+# перезапуска эпоха повторяется в том же порядке и ее можно продолжить с нужного батча
+pipeline_epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+def epoch_order(indices, skip=0):
+    """Индексы эпохи pipeline_epoch в детерминированном порядке, без первых skip примеров"""
+    indices = tf.constant(indices, tf.int64)
+
+    def order(_):
+        seed = tf.stack([tf.constant(RANDOM_STATE, tf.int64), pipeline_epoch.read_value()])
+        shuffled = tf.random.experimental.stateless_shuffle(indices, seed=seed)
+        return tf.data.Dataset.from_tensor_slices(shuffled).skip(skip)
+    return tf.data.Dataset.range(1).flat_map(order)
+
+def make_dataset(indices, training, batch_size=BATCH_SIZE, skip_batches=0):
+    """
+    Потоковый пайплайн: индексы примеров -> параллельное чтение/декодирование -> батчи.
+    Перемешиваются только индексы, поэтому пиковая память ограничена prefetch, а не размером датасета.
+    skip_batches - продолжить эпоху с этого батча (возобновление обучения).
+    """
+    if training:
+        dataset = epoch_order(indices, skip_batches * batch_size)
+    else:
+        dataset = tf.data.Dataset.from_tensor_slices(indices)
+    if cached_dataset is not None:
+        dataset = dataset.batch(batch_size).map(load_cached_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        dataset = dataset.map(lambda index: (tf.gather(all_paths, index), tf.gather(all_labels, index)))
+        dataset = dataset.map(encode_single_sample, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size)
+    if training and AUGMENT:
+        dataset = dataset.map(augment_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    if training:
+        # flat_map скрывает размер эпохи, а без него model.fit запоминает число шагов первой эпохи
+        num_batches = -(-(len(indices) - skip_batches * batch_size) // batch_size)
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(num_batches))
+    return dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
+
+def make_synthetic_dataset(batch_size, seed=RANDOM_STATE, skip_batches=0):
+    """Бесконечный поток синтетических CAPTCHA (synthetic_captcha.py), SYNTHETIC_STEPS_PER_EPOCH батчей за эпоху"""
+    from synthetic_captcha import tf_dataset
+    dataset = tf_dataset(batch_size, char_to_num, MAX_SEQUENCE_LENGTH, seed=seed, workers=SYNTHETIC_WORKERS,
+                         transpose=not TRANSPOSE_IN_MODEL, alphabet=''.join(characters),
+                         width=IMG_WIDTH, height=IMG_HEIGHT, epoch=lambda: int(pipeline_epoch.numpy()))
+    if AUGMENT:
+        dataset = dataset.map(augment_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    # Батчи эпохи зависят только от (seed, эпоха): пропущенные генерируются заново и отбрасываются
+    return dataset.take(SYNTHETIC_STEPS_PER_EPOCH).skip(skip_batches)
+
+def make_distributed_dataset(indices, training, skip_batches=0):
+    """
+    Пайплайн для MultiWorkerMirroredStrategy: каждый воркер читает только свой шард индексов.
+    Шарды одинакового размера, иначе у воркеров разойдется число шагов и all-reduce зависнет.
+    indices=None - синтетические данные, у каждого воркера свой seed.
+    """
+    def dataset_fn(input_context):
+        batch_size = input_context.get_per_replica_batch_size(GLOBAL_BATCH_SIZE)
+        if indices is None:
+            return make_synthetic_dataset(batch_size, seed=(RANDOM_STATE, input_context.input_pipeline_id),
+                                          skip_batches=skip_batches)
+        num_shards = input_context.num_input_pipelines
+        shard_size = len(indices) // num_shards
+        shard = indices[input_context.input_pipeline_id::num_shards][:shard_size]
+        return make_dataset(shard, training, batch_size, skip_batches)
+
+    return strategy.distribute_datasets_from_function(dataset_fn)
+
+def make_train_dataset(skip_batches=0):
+    """Обучающий датасет для текущего режима (файлы/кеш, синтетика, несколько воркеров)"""
+    if DISTRIBUTED:
+        return make_distributed_dataset(None if SYNTHETIC_STEPS_PER_EPOCH else train_idx, True, skip_batches)
+    if SYNTHETIC_STEPS_PER_EPOCH:
+        return make_synthetic_dataset(BATCH_SIZE, skip_batches=skip_batches)
+    return make_dataset(train_idx, training=True, skip_batches=skip_batches)
+
+if cached_dataset is not None:
+    cached_labels = tf.constant(cached_dataset.labels)
+else:
+    all_paths = tf.constant(paths)
+    all_labels = tf.constant(y)
+
+train_dataset = make_train_dataset()
+validation_dataset = make_dataset(val_idx, training=False)  # Полная валидация для БЛОКА 13
+fit_validation_dataset = validation_dataset
+if DISTRIBUTED:
+    fit_validation_dataset = make_distributed_dataset(val_idx, training=False)
+
+# Скорость аугментации на реальном батче: должна быть заметно выше скорости обучения,
+# иначе она станет узким местом входного пайплайна (сравнение - после обучения)
+augment_rate = None
+if AUGMENT:
+    sample_images = next(iter(validation_dataset))['image']
+    augment_rate = measure_throughput(augment_images, sample_images)
+    print(f"Аугментация: {augment_rate:.0f} изображений/сек на один поток tf.data")
 
 print("Datasets созданы")
 
@@ -427,16 +642,303 @@ early_stopping = keras.callbacks.EarlyStopping(
     restore_best_weights=True
 )
 
-print(f"Начинаем обучение на {EPOCHS} эпохах...")
-history = model.fit(
-    train_dataset, 
-    validation_data=validation_dataset, 
-    epochs=EPOCHS, 
-    callbacks=[early_stopping],
-    verbose=1
-)
+class ThroughputLogger(keras.callbacks.Callback):
+    """Изображений/сек на каждой эпохе (только обучение, без валидации)"""
+    def __init__(self, num_images):
+        super().__init__()
+        self.num_images = num_images
+        self.images_per_sec = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+        self._train_time = None
+
+    def on_test_begin(self, logs=None):
+        # Валидация в конце эпохи: фиксируем время только обучающей части
+        if self._train_time is None:
+            self._train_time = time.perf_counter() - self._start
+
+    def on_epoch_end(self, epoch, logs=None):
+        train_time = self._train_time or (time.perf_counter() - self._start)
+        rate = self.num_images / train_time
+        self.images_per_sec.append(rate)
+        if logs is not None:
+            logs['images_per_sec'] = rate
+        print(f"\nЭпоха {epoch + 1}: {rate:.1f} изображений/сек ({train_time:.1f} с)")
+
+class StepInstrumentation(ThroughputLogger):
+    """
+    ThroughputLogger + метрики каждого шага обучения.
+
+    wait_sec - ожидание входного пайплайна: от конца предыдущего шага до выдачи батча.
+    model.fit берет батч внутри графа шага, поэтому момент выдачи отмечает timed() -
+    map в конце обучающего датасета; без отметки (распределенный датасет в fit_loop,
+    который получает батч до on_train_batch_begin) - время между шагами.
+    step_sec - сам шаг (forward/backward и обновление весов), до синхронизации по loss.
+    Большая доля wait_sec - обучение упирается в чтение/декодирование, а не в модель.
+    """
+    FIELDS = ['epoch', 'step', 'global_step', 'wait_sec', 'step_sec', 'images_per_sec', 'loss', 'peak_rss_mb']
+
+    def __init__(self, num_images, images_per_step, path, profile_steps=None, profile_dir=PROFILE_DIR):
+        super().__init__(num_images)
+        self.images_per_step = images_per_step
+        self.path = path
+        self.profile_range = None
+        if profile_steps:
+            start, _, end = str(profile_steps).partition('-')
+            self.profile_range = (int(start), int(end or start))
+        self.profile_dir = profile_dir
+        self._profiling = False
+        self._ready = deque()  # Моменты выдачи батчей (timed)
+        self.wait_times = []
+        self.step_times = []
+
+    def timed(self, dataset):
+        """Датасет, который отмечает момент выдачи каждого батча (один py_function на батч)"""
+        if not isinstance(dataset, tf.data.Dataset):
+            return dataset
+
+        def mark_ready():
+            self._ready.append(time.perf_counter())
+            return 0.0
+
+        def mark(batch):
+            # Map без параллелизма после prefetch выполняется в момент запроса батча шагом
+            with tf.control_dependencies([tf.py_function(mark_ready, [], tf.float64)]):
+                return tf.nest.map_structure(tf.identity, batch)
+
+        return dataset.map(mark)
+
+    def on_train_begin(self, logs=None):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.path, 'w', encoding='utf-8', newline='')
+        self._jsonl = self.path.endswith('.jsonl')
+        if not self._jsonl:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.FIELDS)
+            self._writer.writeheader()
+        # Глобальный шаг = iterations оптимизатора: после возобновления нумерация продолжается
+        self._global_step = int(self.model.optimizer.iterations.numpy())
+
+    def on_epoch_begin(self, epoch, logs=None):
+        super().on_epoch_begin(epoch, logs)
+        self._epoch = epoch
+        self._batch_end = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._batch_begin = time.perf_counter()
+        if self.profile_range and self._global_step + 1 == self.profile_range[0] and not self._profiling:
+            tf.profiler.experimental.start(self.profile_dir)
+            self._profiling = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        # float(loss) дожидается завершения шага, иначе замерили бы только его запуск
+        loss = float(logs['loss']) if logs and 'loss' in logs else None
+        now = time.perf_counter()
+        self._global_step += 1
+        ready = None
+        while self._ready:
+            stamp = self._ready.popleft()
+            if ready is None and stamp > self._batch_end:
+                ready = stamp
+        ready = self._batch_begin if ready is None else ready
+        wait, step = ready - self._batch_end, now - max(ready, self._batch_begin)
+        self._batch_end = now
+        self.wait_times.append(wait)
+        self.step_times.append(step)
+        record = {
+            'epoch': self._epoch + 1,
+            'step': batch + 1,
+            'global_step': self._global_step,
+            'wait_sec': round(wait, 6),
+            'step_sec': round(step, 6),
+            'images_per_sec': round(self.images_per_step / (wait + step), 2),
+            'loss': loss,
+            # ru_maxrss в Linux - в килобайтах
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        if self._jsonl:
+            self._file.write(json.dumps(record) + '\n')
+        else:
+            self._writer.writerow(record)
+        if self._profiling and self._global_step >= self.profile_range[1]:
+            self._stop_profiler()
+
+    def on_epoch_end(self, epoch, logs=None):
+        super().on_epoch_end(epoch, logs)
+        self._file.flush()
+
+    def on_train_end(self, logs=None):
+        if self._profiling:
+            self._stop_profiler()
+        self._file.close()
+        if not self.step_times:
+            return
+        # Первый шаг включает трассировку графа - в сводку не входит
+        waits, steps = np.array(self.wait_times[1:] or self.wait_times), np.array(self.step_times[1:] or self.step_times)
+        wait_share = waits.sum() / (waits.sum() + steps.sum())
+        print(f"Шаги обучения -> {self.path}: шаг {np.median(steps) * 1000:.1f} мс (p95 {np.percentile(steps, 95) * 1000:.1f}), "
+              f"ожидание данных {np.median(waits) * 1000:.1f} мс ({wait_share:.0%} времени), "
+              f"пик памяти {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+        if wait_share > 0.2:
+            print("⚠ Обучение упирается во входной пайплайн (чтение/декодирование), а не в модель")
+
+    def _stop_profiler(self):
+        tf.profiler.experimental.stop()
+        self._profiling = False
+        print(f"Трасса профилировщика сохранена: tensorboard --logdir {self.profile_dir}")
+
+num_train_images = SYNTHETIC_STEPS_PER_EPOCH * GLOBAL_BATCH_SIZE if SYNTHETIC_STEPS_PER_EPOCH else len(train_idx)
+if INSTRUMENT:
+    # У каждого воркера свой файл: входной пайплайн у них тоже свой
+    root, ext = os.path.splitext(INSTRUMENT_FILE)
+    instrument_file = INSTRUMENT_FILE if IS_CHIEF else f"{root}.{WORKER_NAME.replace(':', '_')}{ext}"
+    throughput_logger = StepInstrumentation(num_train_images, GLOBAL_BATCH_SIZE, instrument_file, PROFILE_STEPS)
+else:
+    throughput_logger = ThroughputLogger(num_train_images)
+
+def fit_loop(model, train_dataset, validation_dataset, epochs, callbacks, initial_epoch=0, first_epoch_dataset=None):
+    """
+    Цикл обучения с теми же callbacks, что и у model.fit, для случаев, где fit не подходит:
+
+    - MultiWorkerMirroredStrategy: model.fit в Keras 3 не работает на нескольких воркерах,
+      усреднение скалярных логов в reduce_per_replica (MEAN по axis=0) падает;
+    - продолжение эпохи с середины (first_epoch_dataset - остаток эпохи initial_epoch):
+      fit считает, что все эпохи одной длины.
+
+    Шаг здесь такой же, как в fit: loss из CTCLayer (сумма по батчу реплики),
+    градиенты суммируются оптимизатором между репликами через all-reduce.
+    """
+    def batch_loss(batch, training):
+        model(batch, training=training)
+        return tf.add_n([tf.reduce_sum(tf.cast(loss, tf.float32)) for loss in model.losses])
+
+    def train_step(batch):
+        with tf.GradientTape() as tape:
+            loss = batch_loss(batch, training=True)
+        gradients = tape.gradient(loss, model.trainable_variables)
+        model.optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return loss
+
+    def test_step(batch):
+        return batch_loss(batch, training=False)
+
+    @tf.function
+    def distributed_step(batch, training):
+        losses = strategy.run(train_step if training else test_step, args=(batch,))
+        return strategy.reduce("MEAN", losses, axis=None)
+
+    def run_epoch(dataset, training):
+        total, steps = 0.0, 0
+        for batch in dataset:
+            if training:
+                callback_list.on_train_batch_begin(steps)
+            loss = distributed_step(batch, training)
+            total += loss
+            if training:
+                callback_list.on_train_batch_end(steps, {'loss': loss})
+            steps += 1
+        return float(total) / max(steps, 1)
+
+    history = keras.callbacks.History()
+    callback_list = keras.callbacks.CallbackList(callbacks + [history], model=model)
+    model.stop_training = False
+    logs = {}
+    callback_list.on_train_begin()
+    for epoch in range(initial_epoch, epochs):
+        callback_list.on_epoch_begin(epoch)
+        dataset = first_epoch_dataset if first_epoch_dataset is not None and epoch == initial_epoch else train_dataset
+        logs = {'loss': run_epoch(dataset, training=True)}
+        callback_list.on_test_begin()
+        logs['val_loss'] = run_epoch(validation_dataset, training=False)
+        callback_list.on_test_end(logs)
+        callback_list.on_epoch_end(epoch, logs)
+        print(f"Epoch {epoch + 1}/{epochs} - loss: {logs['loss']:.4f} - val_loss: {logs['val_loss']:.4f}")
+        if model.stop_training:
+            break
+    callback_list.on_train_end(logs)
+    return history
+
+# Переменные оптимизатора создаем заранее (в scope стратегии): их восстанавливает чекпоинт,
+# а fit_loop не должен создавать их внутри шага
+with strategy.scope():
+    model.optimizer.build(model.trainable_variables)
+
+callbacks = [early_stopping, throughput_logger]
+checkpoint = None
+initial_epoch = 0
+if USE_CHECKPOINTS:
+    from training_checkpoint import ResumableCheckpoint
+    import shutil
+    if ARGS.no_resume and IS_CHIEF and os.path.exists(CHECKPOINT_DIR):
+        print(f"--no-resume: удаляем старые чекпоинты {CHECKPOINT_DIR}")
+        shutil.rmtree(CHECKPOINT_DIR)
+    # Позиция в эпохе имеет смысл только при тех же данных и размере батча
+    checkpoint = ResumableCheckpoint(
+        CHECKPOINT_DIR, model, pipeline_epoch, early_stopping=early_stopping,
+        save_every_steps=CHECKPOINT_EVERY_STEPS, max_to_keep=CHECKPOINT_KEEP,
+        config={'train_images': len(train_idx), 'global_batch_size': GLOBAL_BATCH_SIZE,
+                'synthetic_steps': SYNTHETIC_STEPS_PER_EPOCH, 'workers': NUM_WORKERS},
+        is_chief=IS_CHIEF, worker_id=WORKER_NAME.replace(':', '_'),
+    )
+    if not ARGS.no_resume:
+        initial_epoch = checkpoint.restore()
+    callbacks.append(checkpoint)  # После early_stopping: восстанавливает его состояние
+
+# Чекпоинт из середины эпохи: остаток эпохи - отдельный датасет без пройденных батчей
+resume_dataset = None
+if checkpoint is not None and checkpoint.resume_step:
+    resume_dataset = make_train_dataset(skip_batches=checkpoint.resume_step)
+
+print(f"Начинаем обучение на {EPOCHS} эпохах" + (f" с эпохи {initial_epoch + 1}" if initial_epoch else "") + "...")
+if INSTRUMENT:
+    train_dataset, resume_dataset = throughput_logger.timed(train_dataset), throughput_logger.timed(resume_dataset)
+if DISTRIBUTED or resume_dataset is not None:
+    history = fit_loop(model, train_dataset, fit_validation_dataset, EPOCHS, callbacks=callbacks,
+                       initial_epoch=initial_epoch, first_epoch_dataset=resume_dataset)
+else:
+    history = model.fit(
+        train_dataset, 
+        validation_data=fit_validation_dataset, 
+        epochs=EPOCHS, 
+        initial_epoch=initial_epoch,
+        callbacks=callbacks,
+        verbose=1
+    )
 
 print("\nОбучение завершено!")
+if checkpoint is not None:
+    # История с учетом эпох до перезапуска
+    history.history = checkpoint.history
+
+# Веса у всех воркеров одинаковые: модели, графики и отчеты в output/ пишет только chief
+if not IS_CHIEF:
+    if checkpoint is not None:
+        checkpoint.cleanup()
+    print(f"Воркер {WORKER_NAME}: артефакты сохраняет chief, завершаем работу")
+    raise SystemExit(0)
+
+# Первая эпоха включает трассировку/компиляцию графа, поэтому в среднем ее не учитываем
+rates = throughput_logger.images_per_sec
+steady_rates = rates[1:] or rates
+throughput = {
+    'xla': USE_XLA,
+    'precision': 'mixed_bfloat16' if MIXED_PRECISION else 'float32',
+    'batch_size': BATCH_SIZE,
+    'train_images': throughput_logger.num_images,
+    'synthetic': bool(SYNTHETIC_STEPS_PER_EPOCH),
+    'augment': AUGMENT,
+    'augment_images_per_sec': augment_rate,
+    'images_per_sec': rates,
+    'mean_images_per_sec': float(np.mean(steady_rates)),
+}
+os.makedirs("output", exist_ok=True)
+with open("output/throughput.json", "w", encoding="utf-8") as f:
+    json.dump(throughput, f, indent=2)
+print(f"Скорость обучения ({throughput['precision']}, XLA: {USE_XLA}): "
+      f"{throughput['mean_images_per_sec']:.1f} изображений/сек -> output/throughput.json")
+if augment_rate is not None and augment_rate < 2 * throughput['mean_images_per_sec']:
+    print(f"⚠ Аугментация ({augment_rate:.0f} изображений/сек) близка к скорости обучения: "
+          f"уменьшите вероятности (--augment-probs) или отключите дорогие преобразования")
 
 # ========================================
 # БЛОК 10: Визуализация истории обучения
@@ -466,11 +968,21 @@ print("График сохранен в output/training_history.png")
 
 print("\n[БЛОК 11] Создание prediction model...")
 
+if USE_XLA:
+    # Экспортируемая модель не должна зависеть от XLA: возвращаем обычный call подмодели
+    del model.get_layer(name="features").call
+
 prediction_model = keras.models.Model(
     model.inputs[0],  # Используем первый input модели
     model.get_layer(name="dense2").output
 )
 
+if MIXED_PRECISION:
+    # Сохраняем float32 копию: сервер и TFLite не обязаны поддерживать bfloat16
+    from inference_backend import float32_layers
+    keras.mixed_precision.set_global_policy("float32")
+    prediction_model = float32_layers(prediction_model)
+
 prediction_model.summary()
 
 # ========================================
@@ -498,20 +1010,13 @@ try:
 except Exception as e:
     print(f"⚠ Не удалось экспортировать в SavedModel: {e}")
 
-# Экспорт в TFLite (для мобильных устройств)
+# Экспорт в TFLite (для мобильных устройств и бэкенда --backend tflite)
 try:
-    converter = tf.lite.TFLiteConverter.from_keras_model(prediction_model)
-    
-    # Настройки для решения проблемы с TensorListReserve
-    converter.target_spec.supported_ops = [
-        tf.lite.OpsSet.TFLITE_BUILTINS,
-        tf.lite.OpsSet.SELECT_TF_OPS
-    ]
-    converter._experimental_lower_tensor_list_ops = False
+    from inference_backend import unroll_lstm_layers
     
-    # Дополнительные настройки для стабильности
+    # Развернутые LSTM конвертируются без Select TF ops и с динамическим батчем
+    converter = tf.lite.TFLiteConverter.from_keras_model(unroll_lstm_layers(prediction_model))
     converter.optimizations = [tf.lite.Optimize.DEFAULT]
-    converter.experimental_new_converter = True
     
     tflite_model = converter.convert()
     with open("output/model.tflite", "wb") as f:
@@ -542,8 +1047,25 @@ except Exception as e:
         print(f"⚠ Альтернативный метод также не сработал: {e2}")
         print("TFLite экспорт пропущен, но модель сохранена в других форматах")
 
+# Метаданные модели: predict.py / captcha_api.py берут алфавит отсюда, а не из labels.csv
+from model_metadata import save_metadata
+
+metadata_file = save_metadata(
+    ["output/model.keras", "output/model.h5", "output/model.tflite", "output/model"],
+    characters, IMG_WIDTH, IMG_HEIGHT, IMG_CHANNELS, MAX_SEQUENCE_LENGTH,
+    prediction_model.output_shape[1], labels=LABELS_FILE,
+    input_dtype="uint8", input_layout="HWC" if TRANSPOSE_IN_MODEL else "WHC"
+)
+print(f"✓ Метаданные модели сохранены в {metadata_file}")
+
+# Модель сохранена: чекпоинты для возобновления больше не нужны
+if checkpoint is not None:
+    checkpoint.cleanup()
+    print(f"✓ Чекпоинты обучения удалены ({CHECKPOINT_DIR})")
+
 print(f"\n{'='*60}")
 print("Все модели сохранены в папку output/")
+print("Int8 квантизация и отчет о точности/задержке: python quantize_model.py")
 print(f"{'='*60}")
 
 # ========================================
@@ -553,10 +1075,11 @@ print(f"{'='*60}")
 
 print("\n[БЛОК 13] Тестирование на валидационной выборке...")
 
-y_pred = prediction_model.predict(X_val, verbose=1)
+# validation_dataset не перемешивается, поэтому порядок совпадает с y_val
+y_pred = prediction_model.predict(validation_dataset.map(lambda sample: sample['image']), verbose=1)
 y_pred_decoded = keras.backend.ctc_decode(
     y_pred, 
-    input_length=np.ones(X_val.shape[0]) * 50, 
+    input_length=np.ones(y_pred.shape[0]) * y_pred.shape[1], 
     greedy=True
 )[0][0][:, :MAX_SEQUENCE_LENGTH].numpy()
 
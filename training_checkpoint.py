@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Возобновляемое обучение для train.py
+
+Callback ResumableCheckpoint сохраняет чекпоинты в конце каждой эпохи и
+каждые N шагов (tf.train.CheckpointManager, хранятся последние K):
+
+    - веса модели и состояние оптимизатора (моменты Adam, iterations)
+    - позицию обучения: эпоха и число пройденных батчей в ней
+    - состояние EarlyStopping: best, wait, best_epoch и лучшие веса
+    - историю метрик по эпохам (для графиков БЛОКА 10)
+
+Порядок примеров в эпохе train.py берет из переменной pipeline_epoch, которую
+выставляет callback. После перезапуска restore() возвращает эпоху, а
+resume_step - число уже пройденных в ней батчей: train.py пропускает их и
+продолжает обучение с того же батча той же эпохи.
+
+После успешного завершения обучения чекпоинты удаляются (как в
+keras.callbacks.BackupAndRestore): следующий запуск начнется с нуля.
+
+    checkpoints/
+        ckpt-12.index, ckpt-12.data-00000-of-00001, ...   последние K чекпоинтов
+        checkpoint                                         указатель на последний
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+class ResumableCheckpoint(keras.callbacks.Callback):
+    """
+    Периодические чекпоинты с точным восстановлением позиции обучения.
+    Должен идти в списке callbacks после early_stopping.
+    """
+
+    def __init__(self, directory, model, pipeline_epoch, early_stopping=None,
+                 save_every_steps=0, max_to_keep=3, config=None, is_chief=True, worker_id=0):
+        super().__init__()
+        self.directory = directory
+        self.pipeline_epoch = pipeline_epoch
+        self.early_stopping = early_stopping
+        self.save_every_steps = save_every_steps
+        self.is_chief = is_chief
+        # Параметры, от которых зависит смысл позиции (размер датасета, батч):
+        # при их изменении продолжить с того же батча нельзя
+        self.config = json.dumps(config or {}, sort_keys=True)
+
+        self._epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._config = tf.Variable(self.config, dtype=tf.string, trainable=False)
+        self._history = tf.Variable('{}', dtype=tf.string, trainable=False)
+        self._es_state = tf.Variable('{}', dtype=tf.string, trainable=False)
+        self._has_best_weights = tf.Variable(False, trainable=False)
+        self._best_weights = [tf.Variable(np.zeros(w.shape, w.dtype), trainable=False) for w in model.weights]
+        self._checkpoint = tf.train.Checkpoint(
+            weights=list(model.weights), optimizer=model.optimizer,
+            epoch=self._epoch, step=self._step, config=self._config, history=self._history,
+            early_stopping=self._es_state, has_best_weights=self._has_best_weights,
+            best_weights=self._best_weights,
+        )
+        # В MultiWorkerMirroredStrategy сохранять должны все воркеры, но в общую папку пишет только chief
+        save_directory = directory if is_chief else os.path.join(directory, f".worker_{worker_id}")
+        self._manager = tf.train.CheckpointManager(self._checkpoint, save_directory,
+                                                   max_to_keep=max_to_keep if is_chief else 1)
+        self.history = {}
+        self.resume_step = 0
+        self._restored = None
+        self._steps_since_save = 0
+        self._saved_best_weights = None
+        self._completed = False
+
+    def restore(self):
+        """
+        Загружает последний чекпоинт из directory (оптимизатор должен быть уже создан).
+        Возвращает эпоху, с которой продолжать обучение (0 - чекпоинта нет).
+        """
+        path = tf.train.latest_checkpoint(self.directory)
+        if path is None:
+            return 0
+        self._checkpoint.restore(path).assert_existing_objects_matched()
+        saved_config = self._config.numpy().decode('utf-8')
+        if saved_config != self.config:
+            raise ValueError(
+                f"Чекпоинт {path} создан с другими параметрами ({saved_config}, сейчас {self.config}). "
+                f"Удалите папку {self.directory} или запустите обучение с --no-resume"
+            )
+        self.history = json.loads(self._history.numpy().decode('utf-8'))
+        self._restored = {
+            'epoch': int(self._epoch.numpy()),
+            'step': int(self._step.numpy()),
+            'early_stopping': json.loads(self._es_state.numpy().decode('utf-8')),
+            'best_weights': [v.numpy() for v in self._best_weights] if bool(self._has_best_weights.numpy()) else None,
+        }
+        self.resume_step = self._restored['step']
+        print(f"Продолжаем обучение с чекпоинта {path}: эпоха {self._restored['epoch'] + 1}, "
+              f"пропущено батчей {self._restored['step']}")
+        return self._restored['epoch']
+
+    def on_train_begin(self, logs=None):
+        # EarlyStopping.on_train_begin уже сбросил состояние: возвращаем сохраненное
+        if self._restored and self.early_stopping is not None:
+            for name, value in self._restored['early_stopping'].items():
+                setattr(self.early_stopping, name, value)
+            self.early_stopping.best_weights = self._restored['best_weights']
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.pipeline_epoch.assign(epoch)
+        self._epoch.assign(epoch)
+        resumed = self._restored is not None and epoch == self._restored['epoch']
+        self._step.assign(self.resume_step if resumed else 0)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step.assign_add(1)
+        self._steps_since_save += 1
+        if self.save_every_steps and self._steps_since_save >= self.save_every_steps:
+            self.save()
+
+    def on_epoch_end(self, epoch, logs=None):
+        for name, value in (logs or {}).items():
+            self.history.setdefault(name, []).append(float(value))
+        # Эпоха завершена: следующая начинается с первого батча
+        self._epoch.assign(epoch + 1)
+        self._step.assign(0)
+        self._restored = None
+        self.save()
+
+    def on_train_end(self, logs=None):
+        self._completed = True
+
+    def save(self):
+        """Сохраняет чекпоинт с текущей позицией; старые сверх max_to_keep удаляются"""
+        self._history.assign(json.dumps(self.history))
+        if self.early_stopping is not None:
+            es = self.early_stopping
+            best = None if es.best is None else float(es.best)
+            self._es_state.assign(json.dumps({'wait': int(es.wait), 'best': best, 'best_epoch': int(es.best_epoch)}))
+            # Лучшие веса меняются только в конце эпохи: копируем их лишь при обновлении
+            if es.best_weights is not None and es.best_weights is not self._saved_best_weights:
+                for variable, value in zip(self._best_weights, es.best_weights):
+                    variable.assign(value)
+                self._saved_best_weights = es.best_weights
+            self._has_best_weights.assign(es.best_weights is not None)
+        self._manager.save()
+        self._steps_since_save = 0
+
+    def cleanup(self):
+        """Удаляет чекпоинты после успешного завершения обучения (вызывается после сохранения модели)"""
+        if not self._completed:
+            return
+        if self.is_chief:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        else:
+            shutil.rmtree(self._manager.directory, ignore_errors=True)